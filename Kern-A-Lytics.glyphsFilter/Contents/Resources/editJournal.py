@@ -0,0 +1,297 @@
+import collections
+import json
+import os
+
+import numpy
+
+from batchEdit import write_kerning
+
+# stands for a pair which is not kerned in a master
+MISSING = numpy.iinfo(numpy.int32).min
+
+
+def _encode(value):
+    return MISSING if value is None else int(round(value))
+
+
+def _decode(value):
+    return None if value == MISSING else int(value)
+
+
+class JournalEntry(object):
+    '''
+    The cells changed by one edit (a click, or a whole drag gesture),
+    as parallel arrays of pair ids, master indices, old and new
+    values. Missing values are stored as MISSING.
+    '''
+
+    __slots__ = ['pair_ids', 'master_indices', 'old', 'new']
+
+    def __init__(self, pair_ids, master_indices, old, new):
+        self.pair_ids = numpy.asarray(pair_ids, dtype=numpy.int32)
+        self.master_indices = numpy.asarray(master_indices, dtype=numpy.int16)
+        self.old = numpy.asarray(old, dtype=numpy.int32)
+        self.new = numpy.asarray(new, dtype=numpy.int32)
+
+    def __len__(self):
+        return len(self.pair_ids)
+
+    def reversed(self):
+        return JournalEntry(
+            self.pair_ids, self.master_indices, self.new, self.old)
+
+    def new_values(self):
+        '''
+        New values as a list, with None for removed pairs.
+        '''
+        return [_decode(value) for value in self.new.tolist()]
+
+    def cells(self):
+        '''
+        Iterates (pair id, master index, old value, new value).
+        '''
+        for pair_id, master_index, old, new in zip(
+            self.pair_ids.tolist(), self.master_indices.tolist(),
+            self.old.tolist(), self.new.tolist()
+        ):
+            yield pair_id, master_index, _decode(old), _decode(new)
+
+
+class EditJournal(object):
+    '''
+    History of kerning edits, with undo and redo.
+
+    Every edit is recorded as the cells it changed, referring to pairs
+    by their index in *pairs* (the KernMatrix's pair list). Edits made
+    between begin() and end(), like the events of a slider drag, are
+    collapsed into one entry, keeping the first old and the last new
+    value of each cell. The oldest entries are dropped once the
+    history holds more than *max_cells* cells.
+
+    With a *path*, entries and undo/redo steps are appended to a JSON
+    lines sidecar file as they happen (flushed to disk line by line),
+    so the history of a session survives a crash. load() reads such a
+    file, replay() applies the edits to other fonts by pair name.
+    '''
+
+    def __init__(self, pairs, path=None, max_cells=1000000):
+        self.pairs = pairs
+        self.path = path
+        self.max_cells = max_cells
+        self._undo = collections.deque()
+        self._redo = []
+        self._cell_count = 0
+        self._gesture = None
+        self._written_pairs = set()
+        self._session_written = False
+
+    @classmethod
+    def load(cls, path):
+        '''
+        Reads a sidecar file. Entries of all sessions are kept, but only
+        the last session's undone entries can be redone. An incomplete
+        last line (from a crash while writing) is ignored.
+        '''
+        journal = cls([])
+        pair_ids = {}
+        session_ids = {}
+        with open(path) as journal_file:
+            lines = journal_file.read().split('\n')
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            kind = record[0]
+            if kind == 'session':
+                session_ids = {}
+                journal._redo = []
+            elif kind == 'pair':
+                pair = (record[2], record[3])
+                if pair not in pair_ids:
+                    pair_ids[pair] = len(journal.pairs)
+                    journal.pairs.append(pair)
+                session_ids[record[1]] = pair_ids[pair]
+            elif kind == 'edit':
+                ids, master_indices, old, new = record[1:]
+                journal._push(JournalEntry(
+                    [session_ids[pair_id] for pair_id in ids],
+                    master_indices,
+                    [_encode(value) for value in old],
+                    [_encode(value) for value in new]))
+                journal._redo = []
+            elif kind == 'undo' and journal._undo:
+                journal._redo.append(journal._undo.pop())
+            elif kind == 'redo' and journal._redo:
+                journal._undo.append(journal._redo.pop())
+        journal._cell_count = sum(
+            len(entry) for entry in journal.entries() + journal._redo)
+        return journal
+
+    @property
+    def can_undo(self):
+        return bool(self._undo)
+
+    @property
+    def can_redo(self):
+        return bool(self._redo)
+
+    def entries(self):
+        '''
+        The entries in effect, oldest first.
+        '''
+        return list(self._undo)
+
+    def begin(self):
+        '''
+        Starts collapsing edits into one entry (a no-op if started).
+        '''
+        if self._gesture is None:
+            self._gesture = collections.OrderedDict()
+
+    def end(self):
+        '''
+        Records the edits collapsed since begin() as one entry.
+        '''
+        gesture, self._gesture = self._gesture, None
+        if gesture:
+            cells = [
+                (pair_id, master_index, old, new) for
+                (pair_id, master_index), (old, new) in gesture.items() if
+                old != new]
+            if cells:
+                self._commit(JournalEntry(*zip(*cells)))
+
+    def record(self, pair_id, master_index, old, new):
+        '''
+        Records a change of a single cell (None for unkerned).
+        '''
+        old, new = _encode(old), _encode(new)
+        if self._gesture is not None:
+            key = (pair_id, master_index)
+            if key in self._gesture:
+                old = self._gesture[key][0]
+            self._gesture[key] = (old, new)
+        elif old != new:
+            self._commit(JournalEntry([pair_id], [master_index], [old], [new]))
+
+    def record_rows(self, pair_ids, values, present, new_values, new_present):
+        '''
+        Records the changed cells of rows of a KernMatrix.
+        '''
+        changed = (present != new_present) | (
+            new_present & (values != new_values))
+        rows, master_indices = numpy.nonzero(changed)
+        old = numpy.where(present, values, MISSING)[rows, master_indices]
+        new = numpy.where(new_present, new_values, MISSING)[
+            rows, master_indices]
+        entry = JournalEntry(
+            numpy.asarray(pair_ids)[rows], master_indices, old, new)
+        if self._gesture is not None:
+            for pair_id, master_index, old, new in entry.cells():
+                self.record(pair_id, master_index, old, new)
+        elif len(entry):
+            self._commit(entry)
+
+    def undo(self):
+        '''
+        Steps back one entry. Returns the entry to apply (its new
+        values are the values before the edit), None if there is none.
+        '''
+        if not self._undo:
+            return None
+        entry = self._undo.pop()
+        self._redo.append(entry)
+        self._append(['undo'])
+        return entry.reversed()
+
+    def redo(self):
+        if not self._redo:
+            return None
+        entry = self._redo.pop()
+        self._undo.append(entry)
+        self._append(['redo'])
+        return entry
+
+    def _push(self, entry):
+        self._undo.append(entry)
+        self._cell_count += len(entry)
+        # keep at least the latest entry
+        while self._cell_count > self.max_cells and len(self._undo) > 1:
+            self._cell_count -= len(self._undo.popleft())
+
+    def _commit(self, entry):
+        for dropped in self._redo:
+            self._cell_count -= len(dropped)
+        self._redo = []
+        self._push(entry)
+        if self.path is None:
+            return
+        records = []
+        for pair_id in entry.pair_ids.tolist():
+            if pair_id not in self._written_pairs:
+                self._written_pairs.add(pair_id)
+                left, right = self.pairs[pair_id]
+                records.append(['pair', pair_id, left, right])
+        records.append([
+            'edit', entry.pair_ids.tolist(), entry.master_indices.tolist(),
+            [_decode(value) for value in entry.old.tolist()],
+            entry.new_values()])
+        self._append(*records)
+
+    def _append(self, *records):
+        if self.path is None:
+            return
+        if not self._session_written:
+            self._session_written = True
+            records = (['session'],) + records
+        lines = ''.join(json.dumps(record) + '\n' for record in records)
+        with open(self.path, 'a') as journal_file:
+            journal_file.write(lines)
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+
+    def replay(self, fonts):
+        '''
+        Applies the entries in effect to the kerning of *fonts* (the
+        masters in the journal's order), one bulk write per font.
+        Returns the cells whose value in a font differed from the old
+        value of their first edit, as (pair, master index, value).
+        '''
+        final = [{} for _ in fonts]
+        expected = [{} for _ in fonts]
+        for entry in self.entries():
+            for pair_id, master_index, old, new in entry.cells():
+                if master_index >= len(fonts):
+                    raise ValueError(
+                        'journal has edits for master {}, '
+                        'but only {} fonts were given'.format(
+                            master_index, len(fonts)))
+                pair = self.pairs[pair_id]
+                expected[master_index].setdefault(pair, old)
+                final[master_index][pair] = new
+        conflicts = []
+        for master_index, font in enumerate(fonts):
+            kerning = font.kerning
+            for pair, old in expected[master_index].items():
+                value = kerning.get(pair)
+                if value != old:
+                    conflicts.append((pair, master_index, value))
+            updates = {
+                pair: value for pair, value in
+                final[master_index].items() if value is not None}
+            deletions = [
+                pair for pair, value in
+                final[master_index].items() if value is None]
+            write_kerning(font, updates, deletions)
+        return sorted(conflicts)
+
+
+def journal_path(fonts):
+    '''
+    Sidecar file of a family: next to its first font, if saved.
+    '''
+    path = getattr(fonts[0], 'path', None) if fonts else None
+    if not path:
+        return None
+    return os.path.splitext(path)[0] + '.kernjournal.jsonl'
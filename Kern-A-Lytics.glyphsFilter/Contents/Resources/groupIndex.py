@@ -0,0 +1,249 @@
+import collections
+import itertools
+
+from exceptionIndex import GROUP_FLAG, _glyph_to_group
+from kernMatrix import KernMatrix
+
+SIDES = collections.OrderedDict([
+    ('left', 'public.kern1.'),
+    ('right', 'public.kern2.'),
+])
+
+# kind: renamed, changed, split, merged, added, removed or regrouped
+GroupChange = collections.namedtuple(
+    'GroupChange',
+    ['kind', 'side', 'master_index', 'reference_groups', 'groups'])
+
+
+def _duplicate_members(groups, prefix):
+    '''
+    Glyphs which are members of more than one group of a side,
+    mapped to these groups.
+    '''
+    memberships = {}
+    for group_name in sorted(groups):
+        if group_name.startswith(prefix):
+            for glyph_name in groups[group_name]:
+                memberships.setdefault(glyph_name, []).append(group_name)
+    return {
+        glyph_name: group_names for
+        glyph_name, group_names in memberships.items() if
+        len(group_names) > 1}
+
+
+def _members(glyph_to_group):
+    members = {}
+    for glyph_name, group_name in glyph_to_group.items():
+        members.setdefault(group_name, set()).add(glyph_name)
+    return members
+
+
+class GroupIndex(object):
+    '''
+    Kerning groups of a family, reconciled once across all masters.
+
+    For each side, glyphs which belong to the same group in every
+    master form a canonical group. Where the masters agree, canonical
+    groups are the masters' groups (under the name most masters use);
+    where they disagree, a master's group is covered by several
+    canonical groups. Kerning of any master can be rewritten into this
+    shared canonical space (canonical_kerning, kern_matrix), so pairs
+    line up across masters even if groups were renamed, split or merged.
+
+    Differences to the reference master are listed in *changes*;
+    glyphs in more than one group of a side in *duplicates*. Like the
+    rest of the extension, the last of such groups wins.
+    '''
+
+    def __init__(self, master_groups, reference_index=0):
+        self.master_groups = [
+            {
+                group_name: list(glyph_list) for
+                group_name, glyph_list in groups.items() if
+                group_name.startswith(GROUP_FLAG)}
+            for groups in master_groups]
+        self.reference_index = reference_index
+        # side -> list of {glyph: group} per master
+        self.glyph_groups = {
+            side: [
+                _glyph_to_group(groups, prefix) for
+                groups in self.master_groups]
+            for side, prefix in SIDES.items()}
+        # list of {side: {glyph: [groups]}} per master
+        self.duplicates = [
+            {
+                side: _duplicate_members(groups, prefix) for
+                side, prefix in SIDES.items()}
+            for groups in self.master_groups]
+
+        self.canonical_groups = {}
+        self._canonical_of = {side: {} for side in SIDES}
+        # master group name -> canonical groups covering it, per master
+        self._parts = [{} for _ in self.master_groups]
+        self.changes = []
+        for side in SIDES:
+            self._build_side(side)
+            for m_index in range(len(self.master_groups)):
+                if m_index != reference_index:
+                    self.changes.extend(self._side_changes(side, m_index))
+
+    @classmethod
+    def from_fonts(cls, fonts, reference_index=0):
+        return cls([font.groups for font in fonts], reference_index)
+
+    def _build_side(self, side):
+        glyph_maps = self.glyph_groups[side]
+        master_members = [_members(glyph_map) for glyph_map in glyph_maps]
+        by_signature = {}
+        for glyph_name in set(itertools.chain.from_iterable(glyph_maps)):
+            signature = tuple(
+                glyph_map.get(glyph_name) for glyph_map in glyph_maps)
+            by_signature.setdefault(signature, set()).add(glyph_name)
+
+        # masters' own names for the canonical groups they contain exactly
+        exact_names = {}
+        for signature, members in by_signature.items():
+            names = [
+                group_name for m_index, group_name in enumerate(signature) if
+                group_name is not None and
+                master_members[m_index][group_name] == members]
+            if names:
+                reference_name = signature[self.reference_index]
+                if reference_name in names:
+                    exact_names[signature] = reference_name
+                else:
+                    exact_names[signature] = max(
+                        set(names), key=lambda name: (names.count(name), name))
+
+        used_names = set()
+        for signature in sorted(
+            by_signature,
+            key=lambda s: (s not in exact_names, min(by_signature[s]))
+        ):
+            members = by_signature[signature]
+            group_name = exact_names.get(signature)
+            if group_name is None or group_name in used_names:
+                base_name = signature[self.reference_index] or next(
+                    name for name in signature if name is not None)
+                group_name = '{}_{}'.format(base_name, min(members))
+            used_names.add(group_name)
+
+            self.canonical_groups[group_name] = sorted(members)
+            for glyph_name in members:
+                self._canonical_of[side][glyph_name] = group_name
+            for m_index, master_name in enumerate(signature):
+                if master_name is not None:
+                    self._parts[m_index].setdefault(
+                        master_name, []).append(group_name)
+
+    def _side_changes(self, side, m_index):
+        '''
+        Compares the groups of a master to the reference master.
+        '''
+        reference_map = self.glyph_groups[side][self.reference_index]
+        master_map = self.glyph_groups[side][m_index]
+        reference = _members(reference_map)
+        master = _members(master_map)
+        targets = {
+            group_name: set(
+                master_map[g] for g in members if g in master_map)
+            for group_name, members in reference.items()}
+        origins = {
+            group_name: set(
+                reference_map[g] for g in members if g in reference_map)
+            for group_name, members in master.items()}
+
+        changes = []
+        explained = set()
+
+        def change(kind, reference_groups, groups):
+            changes.append(GroupChange(
+                kind, side, m_index,
+                tuple(sorted(reference_groups)), tuple(sorted(groups))))
+            explained.update(reference_groups)
+
+        for group_name in sorted(reference):
+            group_targets = targets[group_name]
+            if not group_targets:
+                change('removed', [group_name], [])
+            elif len(group_targets) == 1:
+                target = next(iter(group_targets))
+                if origins[target] != {group_name}:
+                    continue
+                if master[target] != reference[group_name]:
+                    change('changed', [group_name], [target])
+                elif target != group_name:
+                    change('renamed', [group_name], [target])
+                else:
+                    explained.add(group_name)
+            elif all(origins[t] == {group_name} for t in group_targets):
+                change('split', [group_name], group_targets)
+        for group_name in sorted(master):
+            group_origins = origins[group_name]
+            if not group_origins:
+                changes.append(GroupChange(
+                    'added', side, m_index, (), (group_name,)))
+            elif len(group_origins) > 1 and all(
+                targets[o] == {group_name} for o in group_origins
+            ):
+                change('merged', group_origins, [group_name])
+        for group_name in sorted(set(reference) - explained):
+            change('regrouped', [group_name], targets[group_name])
+        return changes
+
+    def group_of(self, master_index, glyph_name, side):
+        '''
+        The group of a glyph in a master (None if ungrouped).
+        '''
+        return self.glyph_groups[side][master_index].get(glyph_name)
+
+    def canonical_group_of(self, glyph_name, side):
+        return self._canonical_of[side].get(glyph_name)
+
+    def canonical_items(self, master_index, item):
+        '''
+        Canonical groups covering a group of a master. Glyph names are
+        kept as they are. Groups not covered (undefined in the master,
+        or with all members claimed by other groups) get a name of
+        their own for the master (see unmatched_name), as their name
+        may be that of another canonical group.
+        '''
+        if GROUP_FLAG in item:
+            return self._parts[master_index].get(item) or [
+                self.unmatched_name(master_index, item)]
+        return [item]
+
+    def unmatched_name(self, master_index, group_name):
+        '''
+        Name of a group of a master without canonical parts, kept apart
+        from the canonical groups: 'public.kern1.O@1' for master 1.
+        '''
+        name = '{}@{}'.format(group_name, master_index)
+        while name in self.canonical_groups:
+            name += '@'
+        return name
+
+    def canonical_pairs(self, master_index, pair):
+        left, right = pair
+        return list(itertools.product(
+            self.canonical_items(master_index, left),
+            self.canonical_items(master_index, right)))
+
+    def canonical_kerning(self, master_index, kerning):
+        '''
+        Kerning of a master, with pair keys in the canonical space.
+        '''
+        canonical = {}
+        for pair, value in kerning.items():
+            for canonical_pair in self.canonical_pairs(master_index, pair):
+                canonical[canonical_pair] = value
+        return canonical
+
+    def kern_matrix(self, fonts):
+        '''
+        Combined kerning of the fonts (in the order of the index),
+        with pairs lined up in the canonical space.
+        '''
+        return KernMatrix.from_kernings([
+            self.canonical_kerning(m_index, font.kerning) for
+            m_index, font in enumerate(fonts)])
@@ -0,0 +1,196 @@
+import itertools
+
+import numpy
+
+
+def round_values(values):
+    '''
+    Rounds kerning values to integers, halves away from zero (as
+    Python 2 round() does, on every host), as int32.
+    '''
+    values = numpy.asarray(values, dtype=numpy.float64)
+    return (numpy.sign(values) * numpy.floor(numpy.abs(values) + 0.5)).astype(
+        numpy.int32)
+
+
+def _fractions(rows, m_index, values, rounded):
+    fractional = values != rounded
+    return {
+        (row, m_index): value for row, value in zip(
+            rows[fractional].tolist(), values[fractional].tolist())}
+
+
+class KernMatrix(object):
+    '''
+    Combined kerning of a number of fonts, stored column-wise.
+
+    *values* is an int32 array of shape (pairs, masters), *present* a
+    boolean mask of the same shape, and *pairs* the sorted pair index.
+    Values of pairs which are not kerned in a master are stored as 0
+    (and flagged as not present), so *values* can be used directly
+    wherever Nones used to be counted as zero.
+
+    Kerning values which are not integers are rounded (see round_values),
+    and kept as read in *fractions*, {(pair index, master index): value}.
+    Edits only write the cells they change back to the fonts, so
+    the values of all other cells stay as they are. A cell changed back
+    to its rounded value is written with the value read (font_value).
+
+    The matrix can be used in place of the OrderedDict returned by
+    get_combined_kern_dict: iterating, keys(), items(), get() and
+    item access return value lists with None for missing pairs.
+    '''
+
+    def __init__(self, pairs, values, present, fractions=None):
+        self.pairs = pairs
+        self.index = {pair: i for i, pair in enumerate(pairs)}
+        self.values = values
+        self.present = present
+        self.fractions = fractions or {}
+
+    @classmethod
+    def from_kernings(cls, kernings):
+        '''
+        Builds the matrix from a list of kerning dictionaries,
+        with one bulk pass over each of them.
+        '''
+        kern_items = [list(kerning.items()) for kerning in kernings]
+        pairs = sorted(set(itertools.chain.from_iterable(
+            (pair for pair, _ in items) for items in kern_items)))
+        matrix = cls(
+            pairs,
+            numpy.zeros((len(pairs), len(kernings)), dtype=numpy.int32),
+            numpy.zeros((len(pairs), len(kernings)), dtype=bool))
+
+        for m_index, items in enumerate(kern_items):
+            if not items:
+                continue
+            rows = numpy.fromiter(
+                (matrix.index[pair] for pair, _ in items),
+                dtype=numpy.intp, count=len(items))
+            # kerning values may be floats, the matrix stores integers
+            values = numpy.fromiter(
+                (value for _, value in items),
+                dtype=numpy.float64, count=len(items))
+            rounded = round_values(values)
+            matrix.values[rows, m_index] = rounded
+            matrix.present[rows, m_index] = True
+            matrix.fractions.update(
+                _fractions(rows, m_index, values, rounded))
+        return matrix
+
+    @classmethod
+    def from_combined(cls, cmb_kerning):
+        '''
+        Builds the matrix from a combined kerning dictionary (pairs
+        mapped to value lists with None), keeping its order.
+        '''
+        if isinstance(cmb_kerning, cls):
+            return cmb_kerning
+        pairs = list(cmb_kerning.keys())
+        rows = [cmb_kerning[pair] for pair in pairs]
+        shape = (len(rows), len(rows[0]) if rows else 0)
+        flat_values = list(itertools.chain.from_iterable(rows))
+        present = numpy.fromiter(
+            (value is not None for value in flat_values),
+            dtype=bool, count=len(flat_values)).reshape(shape)
+        values = numpy.fromiter(
+            (value or 0 for value in flat_values),
+            dtype=numpy.float64, count=len(flat_values)).reshape(shape)
+        rounded = round_values(values)
+        fractions = {}
+        for m_index in range(shape[1]):
+            fractions.update(_fractions(
+                numpy.arange(shape[0]), m_index, values[:, m_index],
+                rounded[:, m_index]))
+        return cls(pairs, rounded, present, fractions)
+
+    @classmethod
+    def from_fonts(cls, fonts):
+        return cls.from_kernings([font.kerning for font in fonts])
+
+    @property
+    def master_count(self):
+        return self.values.shape[1]
+
+    def row(self, pair_index):
+        '''
+        Value list of a pair, with None for masters in which
+        the pair is not kerned.
+        '''
+        return [
+            value if present else None for value, present in zip(
+                self.values[pair_index].tolist(),
+                self.present[pair_index].tolist())
+        ]
+
+    def set_value(self, pair, master_index, value):
+        '''
+        Changes a single value; None removes the pair from a master.
+        '''
+        pair_index = self.index[pair]
+        if value is None:
+            self.values[pair_index, master_index] = 0
+            self.present[pair_index, master_index] = False
+        else:
+            self.values[pair_index, master_index] = round_values(value)
+            self.present[pair_index, master_index] = True
+
+    def font_value(self, pair_index, master_index, value):
+        '''
+        The value to write to a font for a cell: the value read, if
+        *value* is what it was rounded to, *value* otherwise.
+        '''
+        fraction = self.fractions.get((pair_index, master_index))
+        if fraction is not None and value == round_values(fraction):
+            return fraction
+        return value
+
+    def subset(self, pair_indices):
+        '''
+        Returns a new matrix containing only the given pairs
+        (in the given order).
+        '''
+        pair_indices = numpy.asarray(pair_indices, dtype=numpy.intp)
+        rows = {
+            pair_index: row for
+            row, pair_index in enumerate(pair_indices.tolist())}
+        return KernMatrix(
+            [self.pairs[i] for i in pair_indices.tolist()],
+            self.values[pair_indices],
+            self.present[pair_indices],
+            {
+                (rows[pair_index], m_index): value for
+                (pair_index, m_index), value in self.fractions.items() if
+                pair_index in rows})
+
+    # dictionary interface, compatible with get_combined_kern_dict
+
+    def __len__(self):
+        return len(self.pairs)
+
+    def __iter__(self):
+        return iter(self.pairs)
+
+    def __contains__(self, pair):
+        return pair in self.index
+
+    def __getitem__(self, pair):
+        return self.row(self.index[pair])
+
+    def __setitem__(self, pair, value_list):
+        for master_index, value in enumerate(value_list):
+            self.set_value(pair, master_index, value)
+
+    def keys(self):
+        return list(self.pairs)
+
+    def items(self):
+        for pair_index, pair in enumerate(self.pairs):
+            yield pair, self.row(pair_index)
+
+    def get(self, pair, default=None):
+        pair_index = self.index.get(pair)
+        if pair_index is None:
+            return default
+        return self.row(pair_index)
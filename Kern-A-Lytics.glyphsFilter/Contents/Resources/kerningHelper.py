@@ -1,8 +1,20 @@
 import itertools
 import collections
-import heapq
 import random
 
+from exceptionIndex import ExceptionIndex
+from flatKerning import FlatKerning
+from groupIndex import GroupIndex
+from kernFilters import PairStats, largest_value_indices, rank_pairs
+from kernMatrix import KernMatrix
+from interpolationCheck import DEFAULT_TOLERANCE, InterpolationReport
+from masterDrift import DEFAULT_RESIDUAL, DriftReport
+from presencePatterns import PresencePatterns
+from profileIndex import SIMILAR_AMOUNT, ProfileIndex
+from robustOutliers import DEFAULT_THRESHOLD, OutlierReport
+from reprCache import ReprGlyphCache
+from searchIndex import PairSearchIndex, character_mapping
+
 
 def _sort_kern_dict(input_dict):
     '''
@@ -87,22 +99,16 @@ def random_value_list(length=None):
     return r_list
 
 
-def get_repr_pair(font, def_pair):
+def get_repr_pair(font, def_pair, cache=None):
     '''
     Returns representative glyphs for a given kerning pair
     (which may involve groups). At this point, the method is
     not smart enough to filter out exceptions.
+    Pass the font's ReprGlyphCache when calling this repeatedly.
     '''
-    left_item, right_item = def_pair
-    font_glyph_order = font.glyphOrder
-    font_groups = list(font.groups.keys())
-    if set(def_pair) <= set(font_glyph_order + font_groups):
-        left_glyphs = font.groups.get(def_pair[0], [left_item])
-        right_glyphs = font.groups.get(def_pair[1], [right_item])
-        left_glyphs.sort(key=lambda x: font_glyph_order.index(x))
-        right_glyphs.sort(key=lambda x: font_glyph_order.index(x))
-        return left_glyphs[0], right_glyphs[0]
-    return
+    if cache is None:
+        cache = ReprGlyphCache(font)
+    return cache.repr_pair(def_pair)
 
 
 def get_combined_kern_dict(fonts):
@@ -125,6 +131,60 @@ def get_combined_kern_dict(fonts):
     return _sort_kern_dict(c_kerning)
 
 
+def get_kern_matrix(fonts):
+    '''
+    Returns the combined kerning of a number of fonts as a KernMatrix,
+    which can be used in place of get_combined_kern_dict's output.
+    '''
+    return KernMatrix.from_fonts(fonts)
+
+
+def get_flat_kerning(fonts, max_pairs=None):
+    '''
+    Returns the glyph-level kerning of a number of fonts (FlatKerning),
+    with groups expanded. Its matrix can be filtered like the one
+    returned by get_kern_matrix, even if the fonts' groups differ.
+    '''
+    return FlatKerning.from_fonts(fonts, max_pairs)
+
+
+def get_group_index(fonts):
+    '''
+    Reconciles the kerning groups of a number of fonts (GroupIndex),
+    listing renamed, split and merged groups and duplicate members.
+    '''
+    return GroupIndex.from_fonts(fonts)
+
+
+def get_canonical_kern_matrix(fonts, group_index=None):
+    '''
+    Like get_kern_matrix, but with group pairs rewritten to groups
+    shared by all fonts, so pairs line up even if groups differ.
+    '''
+    if group_index is None:
+        group_index = GroupIndex.from_fonts(fonts)
+    return group_index.kern_matrix(fonts)
+
+
+def get_search_index(fonts, kern_matrix=None):
+    '''
+    Returns a PairSearchIndex of the combined kerning of a number of
+    fonts, with the groups and character mapping of the first font.
+    '''
+    if kern_matrix is None:
+        kern_matrix = KernMatrix.from_fonts(fonts)
+    return PairSearchIndex(
+        kern_matrix.pairs, fonts[0].groups, character_mapping(fonts[0]))
+
+
+def get_profile_index(cmb_kerning):
+    '''
+    Returns a ProfileIndex of combined kerning (a dict or KernMatrix),
+    which finds the pairs kerned alike across the masters.
+    '''
+    return ProfileIndex(KernMatrix.from_combined(cmb_kerning))
+
+
 def same_value_dict(cmb_kerning):
     '''
     Pairs in which all items are kerned by the same value
@@ -158,78 +218,102 @@ def outlier_dict(cmb_kerning, factor=4):
     return _sort_kern_dict(output)
 
 
-def high_gamut_dict(cmb_kerning, approx_amount=100):
+def robust_outlier_dict(
+    cmb_kerning, threshold=DEFAULT_THRESHOLD, method='mad'
+):
+    '''
+    Pairs in which a master's value deviates from the others by a
+    robust score above *threshold* (missing values left out), most
+    severe first. *method* is 'mad' (median absolute deviation)
+    or 'loo' (leave-one-out z-scores).
+    '''
+    kern_matrix = KernMatrix.from_combined(cmb_kerning)
+    report = OutlierReport.from_matrix(
+        kern_matrix, method, threshold=threshold)
+    return _indexed_dict(kern_matrix, report.ranked())
+
+
+def interpolation_dict(
+    cmb_kerning, positions=None, tolerance=DEFAULT_TOLERANCE
+):
     '''
-    Pairs with the highest kerning gamut
+    Pairs whose kerning changes direction along the masters, with an
+    inner master at least *tolerance* units off the line between its
+    neighbours, largest error first. *positions* are the masters'
+    locations on the axis (evenly spaced if None).
     '''
+    kern_matrix = KernMatrix.from_combined(cmb_kerning)
+    report = InterpolationReport.from_matrix(
+        kern_matrix, positions, tolerance=tolerance)
+    return _indexed_dict(kern_matrix, report.ranked())
+
+
+def drift_residual_dict(cmb_kerning, threshold=DEFAULT_RESIDUAL):
+    '''
+    Pairs differing from their other masters by at least *threshold*
+    units, after correcting for the systematic scale and offset between
+    the masters (see masterDrift.DriftReport), largest residual first.
+    '''
+    kern_matrix = KernMatrix.from_combined(cmb_kerning)
+    report = DriftReport.from_matrix(kern_matrix)
+    return _indexed_dict(kern_matrix, report.ranked(threshold))
+
+
+def similar_dict(cmb_kerning, pair, amount=SIMILAR_AMOUNT):
+    '''
+    The pairs whose values across the masters are most like those of
+    *pair*, in proportion (any strength), most similar first.
+    '''
+    kern_matrix = KernMatrix.from_combined(cmb_kerning)
+    similar, _ = get_profile_index(kern_matrix).similar(
+        kern_matrix.index[pair], amount)
+    return _indexed_dict(kern_matrix, similar)
+
+
+def partial_dict(cmb_kerning):
+    '''
+    Pairs kerned in some masters, but missing in others, grouped by
+    the masters they are missing in (most common pattern first).
+    '''
+    kern_matrix = KernMatrix.from_combined(cmb_kerning)
+    patterns = PresencePatterns.from_matrix(kern_matrix)
+    return _indexed_dict(kern_matrix, patterns.partial_members())
+
+
+def _indexed_dict(kern_matrix, pair_indices):
     output = collections.OrderedDict({})
-    gamut_dict = {}
-    for pair, values in cmb_kerning.items():
-        gamut = _gamut(values)
-        gamut_dict.setdefault(gamut, []).append(pair)
-    max_gamut_list = sorted(gamut_dict.keys(), reverse=True)
-    pair_count = 0
-    for gamut_value in max_gamut_list:
-        pairs = gamut_dict.get(gamut_value)
-        if pair_count < approx_amount:
-            for pair in pairs:
-                output[pair] = cmb_kerning.get(pair)
-        pair_count += len(pairs)
+    for pair_index in pair_indices:
+        output[kern_matrix.pairs[pair_index]] = kern_matrix.row(pair_index)
     return output
 
 
-def largest_value_dict(cmb_kerning, amount=200):
+def ranked_dict(cmb_kerning, metric='max', amount=100):
     '''
-    Pairs kerned by the largest distance
-    '''
-
-    # dictionaries that contain the largest and smallest value per pair
-    max_value_dict = {
-        pair: max(numeric_value_list(v_list)) for
-        (pair, v_list) in cmb_kerning.items()
-    }
-    min_value_dict = {
-        pair: min(numeric_value_list(v_list)) for
-        (pair, v_list) in cmb_kerning.items()
-    }
-
-    # sorting by value
-    max_value_list = sorted(
-        # Lambda function to sort the resulting pairs
-        # based on the sum of all kerning values
-        heapq.nlargest(amount // 2, max_value_dict, key=max_value_dict.get),
-        key=lambda pair: sum(numeric_value_list(cmb_kerning.get(pair)))
-    )
-    min_value_list = sorted(
-        # Lambda function to sort the resulting pairs
-        # based on the sum of all kerning values
-        heapq.nsmallest(amount // 2, min_value_dict, key=min_value_dict.get),
-        key=lambda pair: sum(numeric_value_list(cmb_kerning.get(pair)))
-    )
-
-    # re-establishing the combined-value dict based on lists created above
-    max_value_cmb_dict = {
-        pair: cmb_kerning.get(pair) for pair in max_value_list}
-    min_value_cmb_dict = {
-        pair: cmb_kerning.get(pair) for pair in min_value_list}
-
-    # sorting those dictionaries by the greatest value in the valuelist
-    max_sorted_dict = collections.OrderedDict(
-        sorted(
-            max_value_cmb_dict.items(),
-            key=lambda t: max_value_dict.get(t[0]),
-            reverse=True))
-
-    min_sorted_dict = collections.OrderedDict(
-        sorted(
-            min_value_cmb_dict.items(),
-            key=lambda t: min_value_dict.get(t[0]),
-            reverse=True))
+    Exactly *amount* pairs ranking highest by a metric: 'max', 'min'
+    (smallest first), 'gamut', 'abs_mean' or 'spread' (relative to the
+    mean). cmb_kerning may be a combined dict or a KernMatrix.
+    '''
+    kern_matrix = KernMatrix.from_combined(cmb_kerning)
+    stats = PairStats.from_matrix(kern_matrix)
+    return _indexed_dict(kern_matrix, rank_pairs(stats, metric, amount))
 
-    output = {}
-    output.update(max_sorted_dict)
-    output.update(min_sorted_dict)
-    return output
+
+def high_gamut_dict(cmb_kerning, approx_amount=100):
+    '''
+    Pairs with the highest kerning gamut (exactly approx_amount)
+    '''
+    return ranked_dict(cmb_kerning, 'gamut', approx_amount)
+
+
+def largest_value_dict(cmb_kerning, amount=200):
+    '''
+    Pairs kerned by the largest distance: half of them with the
+    largest value, the others with the smallest value.
+    '''
+    kern_matrix = KernMatrix.from_combined(cmb_kerning)
+    stats = PairStats.from_matrix(kern_matrix)
+    return _indexed_dict(
+        kern_matrix, largest_value_indices(stats, amount))
 
 
 def _make_grouped_dicts(groups):
@@ -256,96 +340,28 @@ def _make_grouped_dicts(groups):
 
 def single_exception_list(font):
     '''
-    Creates a list of exceptions for a single font
-    '''
-    g_flag = 'public.kern'
-    grouped_dict_l, grouped_dict_r = _make_grouped_dicts(font.groups)
-
-    group_group_pairs = [
-        pair for pair in font.kerning.keys() if
-        all([g_flag in item for item in pair])]
-    glyph_group_pairs = [
-        pair for pair in font.kerning.keys() if
-        g_flag not in pair[0] and g_flag in pair[1]]
-    group_glyph_pairs = [
-        pair for pair in font.kerning.keys() if
-        g_flag in pair[0] and g_flag not in pair[1]]
-    glyph_glyph_pairs = [
-        pair for pair in font.kerning.keys() if not
-        any([g_flag in item for item in pair])]
-
-    pair_list = []
-    covered_pairs = []
-    for (left, right) in group_glyph_pairs:
-        group_pair = (
-            left, grouped_dict_r.get(right, right))
-        if group_pair in group_group_pairs:
-            pair_list.append((left, right))
-            pair_list.append(group_pair)
-            covered_pairs.append((left, right))
-
-    for (left, right) in glyph_group_pairs:
-        group_pair = (
-            grouped_dict_l.get(left, left), right)
-        if group_pair in group_group_pairs:
-            pair_list.append((left, right))
-            pair_list.append(group_pair)
-            covered_pairs.append((left, right))
-
-    for (left, right) in glyph_glyph_pairs:
-        group_l_pair = (
-            grouped_dict_l.get(left, left), right)
-        group_r_pair = (
-            left, grouped_dict_r.get(right, right))
-        group_both_pair = (
-            grouped_dict_l.get(left, left), grouped_dict_r.get(right, right))
-
-        if (
-            group_l_pair in group_glyph_pairs and
-            group_l_pair not in covered_pairs
-        ):
-            pair_list.append((left, right))
-            pair_list.append(group_l_pair)
-            covered_pairs.append(group_l_pair)
-        if (
-            group_r_pair in glyph_group_pairs and
-            group_r_pair not in covered_pairs
-        ):
-            pair_list.append((left, right))
-            pair_list.append(group_r_pair)
-            covered_pairs.append(group_r_pair)
-        if (
-            group_both_pair in group_group_pairs and
-            group_both_pair not in covered_pairs
-        ):
-            pair_list.append((left, right))
-            pair_list.append(group_both_pair)
-            covered_pairs.append(group_both_pair)
-
-    zip_list = sorted(zip(pair_list[::2], pair_list[1::2]))
-    sorted_pair_list = []
-    for exception, base_pair in zip_list:
-        sorted_pair_list.append(exception)
-        # sorted_pair_list.append(base_pair)
-    return sorted_pair_list
+    Creates a sorted list of exceptions for a single font
+    '''
+    return ExceptionIndex.from_font(font).sorted_exceptions()
 
 
 def exception_dict(fonts, cmb_kerning):
-    all_exceptions = []
-    output = collections.OrderedDict({})
+    '''
+    Exceptions found in any of the fonts
+    '''
+    all_exceptions = set()
     for font in fonts:
-        font_exceptions = single_exception_list(font)
-        all_exceptions.extend(font_exceptions)
-    for pair in all_exceptions:
-        if pair not in output.keys():
-            output[pair] = cmb_kerning.get(pair)
+        all_exceptions.update(ExceptionIndex.from_font(font).base)
+    output = collections.OrderedDict({})
+    for pair in sorted(all_exceptions):
+        output[pair] = cmb_kerning.get(pair)
     return output
 
 
 def small_average_dict(cmb_kerning, small_av_value=5):
     output = collections.OrderedDict({})
     for pair, values in cmb_kerning.items():
-        if _average(values) in range(-small_av_value, small_av_value):
+        if _average(values) < small_av_value:
             output[pair] = cmb_kerning.get(pair)
     return output
 
@@ -0,0 +1,162 @@
+from __future__ import division
+
+import numpy
+
+from robustOutliers import MIN_SCALE, row_medians
+
+# residual (in units, after correcting for drift) from which a pair
+# is reported
+DEFAULT_RESIDUAL = 20
+# Huber's tuning constant: residuals beyond this many deviations
+# are weighted down
+HUBER_K = 1.345
+ITERATIONS = 8
+# masters sharing fewer pairs are not compared
+MIN_SHARED = 10
+
+
+def _huber_fits(x, y, shared, iterations=ITERATIONS, min_scale=MIN_SCALE):
+    '''
+    Robust straight lines y ~ scale * x + offset, for one column x and
+    every column of y at once, over the rows *shared* by both. Starts
+    from least squares; residuals beyond HUBER_K robust deviations
+    (their median absolute deviation, at least *min_scale*) are then
+    weighted down, iteratively, until the lines settle.
+    '''
+    squares = x ** 2
+    weights = shared.astype(numpy.float64)
+    counts = shared.sum(axis=0)
+    # buffers reused by every iteration
+    weighted = numpy.empty_like(y)
+    residuals = numpy.empty_like(y)
+    scale = offset = None
+    for iteration in range(iterations + 1):
+        numpy.multiply(weights, y, out=weighted)
+        s0 = weights.sum(axis=0)
+        s1 = x.dot(weights)
+        s2 = squares.dot(weights)
+        t0 = weighted.sum(axis=0)
+        t1 = x.dot(weighted)
+        determinant = s0 * s2 - s1 ** 2
+        fits = (counts >= MIN_SHARED) & (determinant > 0)
+        last_scale, last_offset = scale, offset
+        scale = numpy.where(
+            fits, (s0 * t1 - s1 * t0) / numpy.where(fits, determinant, 1),
+            numpy.nan)
+        offset = (t0 - scale * s1) / numpy.where(fits, s0, 1)
+        if iteration and numpy.allclose(
+            scale, last_scale, rtol=0, atol=1e-4, equal_nan=True
+        ) and numpy.allclose(
+            offset, last_offset, rtol=0, atol=1e-2, equal_nan=True
+        ):
+            break
+        numpy.multiply(x[:, None], scale, out=residuals)
+        residuals += offset
+        numpy.subtract(y, residuals, out=residuals)
+        numpy.abs(residuals, out=residuals)
+        if iteration == 0:
+            # the spread of the residuals is estimated once
+            deviations = row_medians(
+                numpy.where(shared, residuals, numpy.nan).T, counts)
+            cutoff = HUBER_K * numpy.fmax(deviations / 0.6745, min_scale)
+        numpy.maximum(residuals, cutoff, out=residuals)
+        numpy.divide(cutoff, residuals, out=weights)
+        weights *= shared
+    return scale, offset
+
+
+class DriftReport(object):
+    '''
+    Systematic differences between the masters of a KernMatrix (*values*
+    and *present*: pairs x masters).
+
+    For every two masters a and b, a robust (Huber) line is fitted
+    through the pairs kerned in both: b ~ scale[a, b] * a + offset[a, b]
+    (NaN where they share fewer than MIN_SHARED pairs). A master kerned
+    uniformly 15% tighter than another shows as a scale of 0.85, rather
+    than as thousands of flagged pairs. *shared* counts the pairs
+    each two masters kern.
+
+    Every kerned value is then predicted from the pair's other masters,
+    corrected for their drift (the median of their predictions), and
+    *residuals* (pairs x masters, NaN where there is no prediction)
+    remain: per pair, the largest absolute one (*error*) and the master
+    it belongs to (*master*, -1 if none).
+    '''
+
+    def __init__(self, values, present, iterations=ITERATIONS):
+        pair_count, master_count = values.shape
+        number_values = values.astype(numpy.float64)
+        self.shared = present.T.astype(numpy.int64).dot(present)
+        self.scale = numpy.full((master_count, master_count), numpy.nan)
+        self.offset = numpy.full((master_count, master_count), numpy.nan)
+        numpy.fill_diagonal(self.scale, 1.0)
+        numpy.fill_diagonal(self.offset, 0.0)
+        # without pairs, the masters are not compared
+        for a in range(master_count if pair_count else 0):
+            # fitted both ways, as inverting a line fitted through
+            # loosely related masters would exaggerate their drift
+            others = numpy.flatnonzero(numpy.arange(master_count) != a)
+            self.scale[a, others], self.offset[a, others] = _huber_fits(
+                number_values[:, a], number_values[:, others],
+                present[:, a:a + 1] & present[:, others], iterations)
+
+        self.residuals = numpy.full(values.shape, numpy.nan)
+        for b in range(master_count):
+            predictions = number_values * self.scale[:, b]
+            predictions += self.offset[:, b]
+            compared = ~numpy.isnan(self.scale[:, b])
+            compared[b] = False
+            usable = present & compared
+            predictions[~usable] = numpy.nan
+            counts = usable.sum(axis=1)
+            predicted = row_medians(predictions, counts)
+            valid = present[:, b] & (counts > 0)
+            self.residuals[valid, b] = (
+                number_values[valid, b] - predicted[valid])
+
+        abs_residuals = numpy.abs(self.residuals)
+        abs_residuals[numpy.isnan(abs_residuals)] = -1
+        master = numpy.argmax(abs_residuals, axis=1)
+        error = abs_residuals[numpy.arange(pair_count), master]
+        self.master = numpy.where(error >= 0, master, -1)
+        self.error = numpy.maximum(error, 0.0)
+
+    @classmethod
+    def from_matrix(cls, kern_matrix, **options):
+        return cls(kern_matrix.values, kern_matrix.present, **options)
+
+    def ranked(self, threshold=DEFAULT_RESIDUAL):
+        '''
+        Indices of the pairs with a residual of at least *threshold*
+        units, largest first.
+        '''
+        pair_indices = numpy.flatnonzero(self.error >= threshold)
+        return pair_indices[numpy.argsort(
+            -self.error[pair_indices], kind='mergesort')]
+
+    def format_matrix(self, master_names=None):
+        '''
+        The drift matrix as text: row a, column b reads "b is about
+        scale x a + offset".
+        '''
+        master_count = len(self.scale)
+        if master_names is None:
+            master_names = [
+                'm{}'.format(master) for master in range(master_count)]
+        width = max(
+            [len(name) for name in master_names] + [len('x0.00 +000')])
+        lines = [' '.join(
+            [''.ljust(width)] +
+            [name.rjust(width) for name in master_names])]
+        for a in range(master_count):
+            cells = [master_names[a].ljust(width)]
+            for b in range(master_count):
+                if numpy.isnan(self.scale[a, b]):
+                    cell = '-'
+                else:
+                    cell = 'x{:.2f} {:+.0f}'.format(
+                        self.scale[a, b], self.offset[a, b])
+                cells.append(cell.rjust(width))
+            lines.append(' '.join(cells))
+        return '\n'.join(lines)
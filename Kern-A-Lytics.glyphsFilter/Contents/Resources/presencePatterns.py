@@ -0,0 +1,109 @@
+import numpy
+
+# presence codes are int64 bitmasks, one bit per master
+MAX_MASTERS = 63
+KERNED, MISSING = 'x', '-'
+
+
+def presence_codes(present):
+    '''
+    Bitmask of the masters kerning each pair (bit i for master i), for
+    a boolean array of pairs x masters.
+    '''
+    master_count = present.shape[1]
+    if master_count > MAX_MASTERS:
+        raise ValueError(
+            'presence codes need {} masters or less, not {}'.format(
+                MAX_MASTERS, master_count))
+    bits = numpy.left_shift(1, numpy.arange(master_count, dtype=numpy.int64))
+    return present.dot(bits)
+
+
+def pattern_string(code, master_count):
+    '''
+    A presence code as one character per master: 'x-x' is kerned in
+    the first and last of three masters, missing in the middle one.
+    '''
+    return ''.join(
+        KERNED if (code >> master) & 1 else MISSING for
+        master in range(master_count))
+
+
+def missing_masters(code, master_count):
+    return [
+        master for master in range(master_count) if
+        not (code >> master) & 1]
+
+
+class PresencePatterns(object):
+    '''
+    Groups the pairs of a KernMatrix (*present*: pairs x masters) by the
+    masters they are kerned in, in one vectorized pass.
+
+    *codes* holds the presence code of every pair. The distinct codes
+    (*patterns*) are sorted by the number of pairs sharing them (*counts*),
+    most common first; *pattern_ids* maps pairs to their pattern.
+    '''
+
+    def __init__(self, present):
+        self.master_count = present.shape[1]
+        self.full_code = (1 << self.master_count) - 1
+        self.codes = presence_codes(present)
+        patterns, pattern_ids, counts = numpy.unique(
+            self.codes, return_inverse=True, return_counts=True)
+        order = numpy.argsort(-counts, kind='mergesort')
+        rank = numpy.empty_like(order)
+        rank[order] = numpy.arange(len(order))
+        self.patterns = patterns[order]
+        self.counts = counts[order]
+        self.pattern_ids = rank[pattern_ids.ravel()]
+
+    @classmethod
+    def from_matrix(cls, kern_matrix):
+        return cls(kern_matrix.present)
+
+    def partial_mask(self):
+        '''
+        Pairs kerned in some, but not all masters.
+        '''
+        return (self.codes != 0) & (self.codes != self.full_code)
+
+    def missing_only_mask(self, master):
+        '''
+        Pairs kerned in every master but *master*.
+        '''
+        return self.codes == self.full_code ^ (1 << master)
+
+    def members(self, code):
+        '''
+        Indices of the pairs sharing a presence code.
+        '''
+        return numpy.flatnonzero(self.codes == code)
+
+    def partial_members(self):
+        '''
+        Indices of the partially kerned pairs, grouped by pattern,
+        most common pattern first.
+        '''
+        pair_indices = numpy.flatnonzero(self.partial_mask())
+        return pair_indices[numpy.argsort(
+            self.pattern_ids[pair_indices], kind='mergesort')]
+
+    def summary(self, master_names=None, partial_only=True):
+        '''
+        One dict per pattern, most common first: the pattern string,
+        the masters missing the pairs (by name if given) and the
+        number of pairs.
+        '''
+        rows = []
+        for code, count in zip(self.patterns.tolist(), self.counts.tolist()):
+            if partial_only and code in (0, self.full_code):
+                continue
+            missing = missing_masters(code, self.master_count)
+            if master_names is not None:
+                missing = [master_names[master] for master in missing]
+            rows.append({
+                'pattern': pattern_string(code, self.master_count),
+                'missing': missing,
+                'pair_count': count})
+        return rows
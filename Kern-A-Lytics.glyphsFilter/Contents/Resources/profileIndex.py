@@ -0,0 +1,143 @@
+from __future__ import division
+
+import numpy
+
+# hash tables, and hyperplanes (bits) per table
+TABLES = 8
+BITS = 10
+# number of similar pairs looked up by default
+SIMILAR_AMOUNT = 20
+# edited pairs are looked at separately until the tables are rebuilt
+REBUILD_AFTER = 1024
+
+
+def profiles(values, present):
+    '''
+    Kerning profiles: the values of each pair across the masters
+    (missing values counted as 0), scaled to unit length, so pairs
+    with the same shape at different strengths have the same profile.
+    Unkerned pairs have a profile of zeros.
+    '''
+    vectors = numpy.where(present, values, 0).astype(numpy.float64)
+    lengths = numpy.sqrt((vectors ** 2).sum(axis=1))
+    vectors /= numpy.where(lengths > 0, lengths, 1)[:, None]
+    return vectors
+
+
+class ProfileIndex(object):
+    '''
+    Finds the pairs whose kerning profile (see profiles) is most similar
+    to that of a given pair, by cosine similarity, without comparing it
+    with every pair of the KernMatrix.
+
+    Profiles are hashed by random-projection LSH: in each of *tables*
+    hash tables, a pair's code holds the side of *bits* random
+    hyperplanes its profile lies on, so similar profiles tend to share
+    codes. Each table is kept as the codes in sorted order; a lookup
+    collects the pairs sharing a code with the given one in any table,
+    or differing in a single bit, and ranks only those.
+
+    update() rehashes edited pairs (FilterEngine.row_listeners calls it
+    as values change). They are looked up separately, and stale
+    positions are skipped, until *rebuild_after* pairs have changed.
+    '''
+
+    def __init__(
+        self, kern_matrix, tables=TABLES, bits=BITS, seed=0,
+        rebuild_after=REBUILD_AFTER
+    ):
+        self.kern_matrix = kern_matrix
+        self.rebuild_after = rebuild_after
+        random = numpy.random.RandomState(seed)
+        self.planes = random.standard_normal(
+            (tables * bits, kern_matrix.master_count))
+        self.tables = tables
+        self.bits = bits
+        self._bit_values = numpy.left_shift(
+            1, numpy.arange(bits, dtype=numpy.int64))
+        self.profiles = profiles(kern_matrix.values, kern_matrix.present)
+        self.codes = self._codes(self.profiles)
+        self._build()
+
+    def _codes(self, vectors):
+        '''
+        Codes of profiles (pairs x tables); -1 for unkerned pairs.
+        '''
+        sides = vectors.dot(self.planes.T) > 0
+        codes = sides.reshape(len(vectors), self.tables, self.bits).dot(
+            self._bit_values)
+        codes[~vectors.any(axis=1)] = -1
+        return codes
+
+    def _build(self):
+        self._order = numpy.argsort(self.codes, axis=0, kind='mergesort')
+        self._sorted_codes = self.codes[
+            self._order, numpy.arange(self.tables)]
+        self._dirty = set()
+
+    def __len__(self):
+        return len(self.codes)
+
+    def update(self, pair_indices):
+        '''
+        Rehashes pairs whose values changed in the matrix.
+        '''
+        pair_indices = numpy.asarray(pair_indices, dtype=numpy.intp)
+        kern_matrix = self.kern_matrix
+        self.profiles[pair_indices] = profiles(
+            kern_matrix.values[pair_indices],
+            kern_matrix.present[pair_indices])
+        self.codes[pair_indices] = self._codes(self.profiles[pair_indices])
+        self._dirty.update(pair_indices.tolist())
+        if len(self._dirty) > self.rebuild_after:
+            self._build()
+
+    def candidates(self, pair_index):
+        '''
+        Indices of the pairs sharing a code with a pair, or differing
+        from it in one bit, in any table.
+        '''
+        codes = self.codes[pair_index]
+        if codes[0] < 0:
+            return numpy.zeros(0, dtype=numpy.intp)
+        # the pair's own codes, and those differing in one bit
+        probes = codes[:, None] ^ numpy.concatenate(
+            [[0], self._bit_values])[None, :]
+        # a mask, as buckets of the tables overlap
+        hits = numpy.zeros(len(self.codes), dtype=bool)
+        for table in range(self.tables):
+            table_probes = numpy.sort(probes[table])
+            sorted_codes = self._sorted_codes[:, table]
+            starts = numpy.searchsorted(sorted_codes, table_probes, 'left')
+            ends = numpy.searchsorted(sorted_codes, table_probes, 'right')
+            for start, end in zip(starts.tolist(), ends.tolist()):
+                hits[self._order[start:end, table]] = True
+        if self._dirty:
+            hits[list(self._dirty)] = True
+        candidates = numpy.flatnonzero(hits)
+        if self._dirty:
+            # edited pairs may sit at the position of their old codes
+            current = numpy.zeros(len(candidates), dtype=bool)
+            for table in range(self.tables):
+                current |= numpy.isin(
+                    self.codes[candidates, table], probes[table])
+            candidates = candidates[current]
+        return candidates
+
+    def similar(self, pair_index, amount=SIMILAR_AMOUNT, within=None):
+        '''
+        The (up to) *amount* pairs most similar to a pair, most similar
+        first, and their cosine similarities. With *within* (an index
+        array, like a filter's membership), only its pairs are returned.
+        '''
+        candidates = self.candidates(pair_index)
+        candidates = candidates[candidates != pair_index]
+        if within is not None:
+            candidates = candidates[numpy.isin(candidates, within)]
+        similarities = self.profiles[candidates].dot(
+            self.profiles[pair_index])
+        if len(candidates) > amount:
+            best = numpy.argpartition(-similarities, amount)[:amount]
+            candidates, similarities = candidates[best], similarities[best]
+        order = numpy.argsort(-similarities, kind='mergesort')
+        return candidates[order], similarities[order]
@@ -0,0 +1,130 @@
+import threading
+import time
+
+# fonts which cannot be observed rebuild their cache after this many
+# seconds, so group edits show up eventually
+UNOBSERVED_MAX_AGE = 2.0
+
+
+def _glyph_order(font):
+    try:
+        return font.glyphOrder
+    except AttributeError:
+        return font.lib['public.glyphOrder']
+
+
+def _defcon_font(font):
+    '''
+    The defcon font behind a font object, None if there is none (as
+    for the GSFont behind a Glyphs font).
+    '''
+    try:
+        naked = font.naked()
+    except AttributeError:
+        return
+    if hasattr(naked, 'addObserver') and hasattr(
+        getattr(naked, 'groups', None), 'addObserver'
+    ):
+        return naked
+
+
+class ReprGlyphCache(object):
+    '''
+    Representative glyphs of a single font: a rank for every glyph in
+    the glyph order, and the first member (by glyph order) of every
+    kerning group. The cache is rebuilt lazily after invalidate(), or
+    once it is older than *max_age* seconds (if set). It may be used
+    from several threads.
+    '''
+
+    def __init__(self, font):
+        self.font = font
+        self._rank = None
+        self._groups = None
+        self._representatives = None
+        self._built = 0
+        self.max_age = None
+        self._lock = threading.RLock()
+
+    def invalidate(self, notification=None):
+        with self._lock:
+            self._rank = None
+            self._representatives = None
+
+    def _stale(self):
+        return self._rank is None or self._representatives is None or (
+            self.max_age is not None and
+            time.time() - self._built > self.max_age)
+
+    def _build(self):
+        self._built = time.time()
+        glyph_order = _glyph_order(self.font)
+        self._rank = {name: i for i, name in enumerate(glyph_order)}
+        self._groups = dict(self.font.groups.items())
+        self._representatives = {}
+        for group_name in self._groups:
+            if group_name.startswith('public.kern'):
+                self._representatives[group_name] = self._first_member(
+                    group_name)
+
+    def _first_member(self, group_name):
+        members = self._groups[group_name]
+        if not members:
+            return
+        unranked = len(self._rank)
+        return min(members, key=lambda name: self._rank.get(name, unranked))
+
+    @property
+    def rank(self):
+        with self._lock:
+            if self._stale():
+                self._build()
+            return self._rank
+
+    def repr_glyph(self, item):
+        '''
+        Representative glyph name for a glyph or group name,
+        None if the font does not know the item.
+        '''
+        with self._lock:
+            if self._stale():
+                self._build()
+            if item in self._groups:
+                if item not in self._representatives:
+                    self._representatives[item] = self._first_member(item)
+                return self._representatives[item]
+            if item in self._rank:
+                return item
+
+    def repr_pair(self, pair):
+        '''
+        Representative glyphs for a kerning pair, None if either
+        side cannot be resolved in this font.
+        '''
+        left, right = [self.repr_glyph(item) for item in pair]
+        if left is None or right is None:
+            return
+        return left, right
+
+    def observe(self):
+        '''
+        Invalidates the cache whenever groups or glyph order change.
+        This relies on defcon notifications, so only fonts exposing
+        a defcon font via naked() are observed. Other fonts (Glyphs)
+        are rebuilt every UNOBSERVED_MAX_AGE seconds instead, and
+        False is returned.
+        '''
+        naked = _defcon_font(self.font)
+        if naked is None:
+            self.max_age = UNOBSERVED_MAX_AGE
+            return False
+        naked.groups.addObserver(self, 'invalidate', 'Groups.Changed')
+        naked.addObserver(self, 'invalidate', 'Font.GlyphOrderChanged')
+        return True
+
+    def stop_observing(self):
+        naked = _defcon_font(self.font)
+        if naked is None:
+            return
+        naked.groups.removeObserver(self, 'Groups.Changed')
+        naked.removeObserver(self, 'Font.GlyphOrderChanged')
@@ -0,0 +1,146 @@
+from __future__ import division
+
+import numpy
+
+# scores beyond which a value is an outlier (Iglewicz and Hoaglin)
+DEFAULT_THRESHOLD = 3.5
+# deviations are measured in units of at least MIN_SCALE, so values
+# differing by a few units do not make outliers of each other
+MIN_SCALE = 5
+# fewer kerned masters than this give no scores
+MIN_MASTERS = 3
+METHODS = ['mad', 'loo']
+
+
+def _sorted_medians(sorted_values, counts):
+    '''
+    Medians of rows sorted with NaN last, of *counts* values each.
+    '''
+    rows = numpy.arange(len(sorted_values))
+    low = numpy.maximum((counts - 1) // 2, 0)
+    high = numpy.maximum(counts // 2, 0)
+    return (sorted_values[rows, low] + sorted_values[rows, high]) / 2
+
+
+def row_medians(values, counts):
+    '''
+    Medians of the rows of *values* (NaN where there is no value),
+    which hold *counts* values each.
+    '''
+    return _sorted_medians(numpy.sort(values, axis=1), counts)
+
+
+def mad_scores(
+    values, present, min_scale=MIN_SCALE, min_masters=MIN_MASTERS
+):
+    '''
+    Modified z-scores of the kerned values of each pair: distance from
+    the pair's median, over the median absolute deviation (scaled to
+    a standard deviation). Returns scores and centers (the medians);
+    both are NaN where a pair is not kerned, or in too few masters.
+    '''
+    counts = present.sum(axis=1)
+    values = numpy.where(present, values, numpy.nan)
+    medians = row_medians(values, counts)
+    deviations = numpy.abs(values - medians[:, None])
+    mad = row_medians(deviations, counts) / 0.6745
+    # fmax, as rows without values have a NaN deviation
+    scale = numpy.fmax(mad, min_scale)
+    scores = (values - medians[:, None]) / scale[:, None]
+    scores[counts < min_masters] = numpy.nan
+    centers = numpy.where(
+        numpy.isnan(scores), numpy.nan, medians[:, None])
+    return scores, centers
+
+
+def loo_scores(
+    values, present, min_scale=MIN_SCALE, min_masters=MIN_MASTERS
+):
+    '''
+    Leave-one-out z-scores: distance of each kerned value from the mean
+    of the pair's other kerned values, over their standard deviation.
+    Returns scores and centers (the means of the other values), NaN
+    like those of mad_scores.
+    '''
+    min_masters = max(min_masters, 3)
+    counts = present.sum(axis=1)[:, None]
+    values = numpy.where(present, values, 0).astype(numpy.float64)
+    others = numpy.maximum(counts - 1, 1)
+    other_means = (values.sum(axis=1)[:, None] - values) / others
+    other_squares = (values ** 2).sum(axis=1)[:, None] - values ** 2
+    other_variances = (
+        other_squares - others * other_means ** 2) / numpy.maximum(
+        others - 1, 1)
+    scale = numpy.maximum(
+        numpy.sqrt(numpy.maximum(other_variances, 0)), min_scale)
+    scores = (values - other_means) / scale
+    invalid = ~present | (counts < min_masters)
+    scores[invalid] = numpy.nan
+    other_means[invalid] = numpy.nan
+    return scores, other_means
+
+
+def robust_scores(values, present, method='mad', **options):
+    '''
+    Scores and centers of every value, by one of METHODS.
+    '''
+    if method == 'mad':
+        return mad_scores(values, present, **options)
+    if method == 'loo':
+        return loo_scores(values, present, **options)
+    raise ValueError('unknown outlier method: {!r}'.format(method))
+
+
+class OutlierReport(object):
+    '''
+    Robust outliers of a KernMatrix's values (pairs x masters). Unlike
+    PairStats.outlier, missing values are left out rather than counted
+    as 0, and values are compared with the other masters' (see
+    robust_scores), so a master with the wrong sign is found, while a
+    pair kerned in a single master is not an outlier at all.
+
+    For every pair: the master deviating most (*master*, -1 if there
+    are no scores), its *score* (absolute), its *deviation* in units
+    from the center of the pair's values, and whether it has the
+    opposite sign of the center (*wrong_sign*).
+    '''
+
+    def __init__(
+        self, values, present, method='mad', threshold=DEFAULT_THRESHOLD,
+        **options
+    ):
+        self.method = method
+        self.threshold = threshold
+        self.scores, centers = robust_scores(
+            values, present, method, **options)
+        abs_scores = numpy.abs(self.scores)
+        abs_scores[numpy.isnan(abs_scores)] = -1
+        master = numpy.argmax(abs_scores, axis=1)
+        rows = numpy.arange(len(values))
+        score = abs_scores[rows, master]
+        has_score = score >= 0
+        self.master = numpy.where(has_score, master, -1)
+        self.score = numpy.maximum(score, 0.0)
+        center = numpy.where(has_score, centers[rows, master], 0.0)
+        value = values[rows, master]
+        self.deviation = numpy.where(has_score, value - center, 0.0)
+        min_scale = options.get('min_scale', MIN_SCALE)
+        self.wrong_sign = has_score & (
+            numpy.sign(value) * numpy.sign(center) < 0) & (
+            numpy.minimum(numpy.abs(value), numpy.abs(center)) >= min_scale)
+
+    @classmethod
+    def from_matrix(cls, kern_matrix, method='mad', **options):
+        return cls(kern_matrix.values, kern_matrix.present, method, **options)
+
+    @property
+    def flagged(self):
+        return self.score > self.threshold
+
+    def ranked(self):
+        '''
+        Indices of the outliers, most severe first.
+        '''
+        pair_indices = numpy.flatnonzero(self.flagged)
+        return pair_indices[numpy.argsort(
+            -self.score[pair_indices], kind='mergesort')]
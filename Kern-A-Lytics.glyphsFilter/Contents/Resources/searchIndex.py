@@ -0,0 +1,272 @@
+import bisect
+import unicodedata
+
+import numpy
+
+from exceptionIndex import GROUP_FLAG, _glyph_to_group
+
+try:
+    from fontTools import unicodedata as script_data
+except ImportError:
+    script_data = None
+
+try:
+    unichr
+except NameError:
+    unichr = chr
+
+SIDES = {'left': 0, 'l': 0, 'right': 1, 'r': 1}
+ATTRIBUTES = ['script', 'category', 'case']
+CASES = {'Lu': 'upper', 'Lt': 'upper', 'Ll': 'lower'}
+
+
+def character_mapping(font):
+    '''
+    Maps the glyph names of a font to their unicodes. Fonts without
+    glyphs (or a way to list them) give an empty mapping.
+    '''
+    try:
+        cmap = font.getCharacterMapping()
+    except AttributeError:
+        try:
+            return {
+                glyph.name: list(glyph.unicodes) for
+                glyph in font if glyph.unicodes}
+        except (AttributeError, TypeError):
+            return {}
+    unicodes = {}
+    for code_point, glyph_names in cmap.items():
+        for glyph_name in glyph_names:
+            unicodes.setdefault(glyph_name, []).append(code_point)
+    return unicodes
+
+
+def script_name(character):
+    '''
+    Unicode script of a character (like 'Latin'), from fontTools if
+    available. Otherwise, letters are assigned the script their
+    character name starts with, everything else is 'Common'.
+    '''
+    if script_data is not None:
+        return script_data.script_name(script_data.script(character))
+    if unicodedata.category(character)[0] not in 'LM':
+        return 'Common'
+    name = unicodedata.name(character, '')
+    return name.split(' ')[0].title() if name else 'Unknown'
+
+
+def code_point_attributes(code_point):
+    '''
+    (attribute, value) pairs of a code point, with lowercase values.
+    '''
+    try:
+        character = unichr(code_point)
+    except ValueError:
+        # beyond a narrow build's range
+        return []
+    category = unicodedata.category(character)
+    attributes = [
+        ('script', script_name(character).lower()),
+        ('category', category.lower()),
+        ('category', category[0].lower())]
+    if category in CASES:
+        attributes.append(('case', CASES[category]))
+    return attributes
+
+
+class PairSearchIndex(object):
+    '''
+    Inverted index of a KernMatrix's pairs (*pairs*), built once, by
+    the glyphs and groups on either side.
+
+    Each side item (a glyph or group name in the pairs) has the sorted
+    indices of its pairs. Items are found by name, or prefix, in a
+    sorted key list: glyph names find the glyph and its kerning group,
+    group names (also without their public.kern1./2. prefix) the group.
+    Items are partitioned by the script, general category and case of
+    their glyphs (a group's are those of all members), from *unicodes*
+    (glyph name -> unicodes; unencoded glyphs like 'a.sc' count as their
+    base glyph).
+
+    Queries give boolean masks over the pairs, so they combine with
+    each other and with the masks and index arrays of the FilterEngine.
+    '''
+
+    def __init__(self, pairs, groups, unicodes=None):
+        self.pairs = pairs
+        unicodes = unicodes or {}
+        groups = {
+            group_name: glyph_list for group_name, glyph_list in
+            groups.items() if group_name.startswith(GROUP_FLAG)}
+        self._item_ids = []
+        self._items = []
+        self._pair_items = []
+        self._postings = []
+        self._keys = []
+        self._key_items = []
+        self._partitions = []
+        for side in range(2):
+            self._index_side(side, groups, unicodes)
+
+    def _index_side(self, side, groups, unicodes):
+        item_ids = {}
+        pair_items = numpy.array([
+            item_ids.setdefault(pair[side], len(item_ids)) for
+            pair in self.pairs], dtype=numpy.int32)
+        items = sorted(item_ids, key=item_ids.get)
+        # pairs of each item: a slice of the pairs sorted by item
+        order = numpy.argsort(pair_items, kind='mergesort')
+        ends = numpy.cumsum(numpy.bincount(pair_items, minlength=len(items)))
+        starts = numpy.concatenate([[0], ends[:-1]]).astype(int)
+        postings = [
+            order[start:end] for start, end in
+            zip(starts.tolist(), ends.tolist())]
+
+        prefix = 'public.kern{}.'.format(side + 1)
+        glyph_to_group = _glyph_to_group(groups, prefix)
+        key_items = {}
+        for item, item_id in item_ids.items():
+            key_items.setdefault(item, set()).add(item_id)
+            if item.startswith(prefix):
+                key_items.setdefault(item[len(prefix):], set()).add(item_id)
+                for glyph_name in groups.get(item, []):
+                    key_items.setdefault(glyph_name, set()).add(item_id)
+            elif item in glyph_to_group:
+                group_id = item_ids.get(glyph_to_group[item])
+                if group_id is not None:
+                    key_items[item].add(group_id)
+        keys = sorted(key_items)
+
+        partitions = {}
+        for item, item_id in item_ids.items():
+            glyph_names = groups.get(item) or [item]
+            for glyph_name in glyph_names:
+                code_points = unicodes.get(glyph_name) or unicodes.get(
+                    glyph_name.split('.')[0], [])
+                for code_point in code_points:
+                    for attribute in code_point_attributes(code_point):
+                        partitions.setdefault(attribute, set()).add(item_id)
+
+        self._item_ids.append(item_ids)
+        self._items.append(items)
+        self._pair_items.append(pair_items)
+        self._postings.append(postings)
+        self._keys.append(keys)
+        self._key_items.append([
+            numpy.array(sorted(key_items[key]), dtype=numpy.int32) for
+            key in keys])
+        self._partitions.append({
+            attribute: self._item_mask(side, sorted(ids)) for
+            attribute, ids in partitions.items()})
+
+    def __len__(self):
+        return len(self.pairs)
+
+    def _item_mask(self, side, item_ids):
+        mask = numpy.zeros(len(self._items[side]), dtype=bool)
+        mask[numpy.asarray(item_ids, dtype=numpy.int32)] = True
+        return mask
+
+    def values(self, side, attribute):
+        '''
+        The values of an attribute found on a side, like the scripts.
+        '''
+        return sorted(
+            value for key, value in self._partitions[side] if
+            key == attribute)
+
+    def find_items(self, side, name):
+        '''
+        Item ids matching a name, or a prefix if it ends with '*'.
+        '''
+        keys = self._keys[side]
+        if name.endswith('*'):
+            name = name[:-1]
+            start = bisect.bisect_left(keys, name)
+            end = start
+            while end < len(keys) and keys[end].startswith(name):
+                end += 1
+        else:
+            start = bisect.bisect_left(keys, name)
+            end = start + (start < len(keys) and keys[start] == name)
+        found = self._key_items[side][start:end]
+        if not found:
+            return numpy.zeros(0, dtype=numpy.int32)
+        return numpy.unique(numpy.concatenate(found))
+
+    def item_mask(self, side, name=None, **attributes):
+        '''
+        Boolean mask over a side's items: those matching *name* (see
+        find_items) and all attributes given (script='cyrillic',
+        category='Lu', case='upper'; values are not case sensitive).
+        '''
+        mask = numpy.ones(len(self._items[side]), dtype=bool)
+        if name is not None:
+            mask = self._item_mask(side, self.find_items(side, name))
+        for attribute, value in attributes.items():
+            if attribute not in ATTRIBUTES:
+                raise ValueError(
+                    'unknown attribute: {}'.format(attribute))
+            partition = self._partitions[side].get(
+                (attribute, value.lower()))
+            if partition is None:
+                return numpy.zeros(len(mask), dtype=bool)
+            mask &= partition
+        return mask
+
+    def side_mask(self, side, name=None, **attributes):
+        '''
+        Boolean mask over the pairs whose *side* (0 or 1) matches.
+        '''
+        return self.item_mask(side, name, **attributes)[
+            self._pair_items[side]]
+
+    def mask(self, side=None, name=None, **attributes):
+        '''
+        Like side_mask, matching either side if *side* is None.
+        '''
+        if side is not None:
+            return self.side_mask(side, name, **attributes)
+        return (
+            self.side_mask(0, name, **attributes) |
+            self.side_mask(1, name, **attributes))
+
+    def pairs_of(self, name):
+        '''
+        Sorted indices of the pairs involving a glyph or group
+        (directly or through groups) on either side.
+        '''
+        found = [
+            self._postings[side][item_id] for side in range(2) for
+            item_id in self.find_items(side, name).tolist()]
+        if not found:
+            return numpy.zeros(0, dtype=numpy.intp)
+        return numpy.unique(numpy.concatenate(found))
+
+    def search(self, text, within=None):
+        '''
+        Indices of the pairs matching all terms of a search text, like
+        'left:script=cyrillic T'. A term is a name ('T', or 'T*' for
+        a prefix) or attribute=value, optionally preceded by 'left:' or
+        'right:'. With *within* (an index array, like a FilterEngine
+        membership), its matching pairs are returned, in its order.
+        '''
+        mask = numpy.ones(len(self.pairs), dtype=bool)
+        for term in text.split():
+            mask &= self.term_mask(term)
+        if within is None:
+            return numpy.flatnonzero(mask)
+        within = numpy.asarray(within, dtype=numpy.intp)
+        return within[mask[within]]
+
+    def term_mask(self, term):
+        side = None
+        if ':' in term:
+            side_name, term = term.split(':', 1)
+            if side_name.lower() not in SIDES:
+                raise ValueError('unknown side: {}'.format(side_name))
+            side = SIDES[side_name.lower()]
+        if '=' in term:
+            attribute, value = term.split('=', 1)
+            return self.mask(side, **{attribute.lower(): value})
+        return self.mask(side, term)
@@ -0,0 +1,388 @@
+from __future__ import division
+
+import collections
+import json
+import re
+import time
+
+import numpy
+
+from interpolationCheck import smooth
+from kernFilters import RANKING_METRICS
+from kernMatrix import round_values
+from pairQuery import CONDITION_STATS, OPERATORS, QueryEngine
+
+
+# Edit actions work on the value and presence arrays of the selected
+# pairs (rows) and return new ones. Like the buttons of the window,
+# missing values are counted as 0.
+
+def average(values, present):
+    '''
+    Sets all masters to the average value of the pair.
+    '''
+    mean = round_values(values.sum(axis=1) / values.shape[1])
+    new_values = numpy.repeat(mean[:, None], values.shape[1], axis=1)
+    return new_values.astype(values.dtype), numpy.ones_like(present)
+
+
+def equalize(values, present, source):
+    '''
+    Sets all masters to the value of the *source* master
+    (removing the pair where the source master does not kern it).
+    '''
+    master_count = values.shape[1]
+    return (
+        numpy.repeat(values[:, source:source + 1], master_count, axis=1),
+        numpy.repeat(present[:, source:source + 1], master_count, axis=1))
+
+
+def _factor(positions, target, near, far):
+    '''
+    Distance of master *target* from master *near*, in units of the
+    distance from *far* to *near*.
+    '''
+    span = positions[near] - positions[far]
+    if span == 0:
+        raise ValueError('Masters {} and {} share a position'.format(
+            far, near))
+    return (positions[target] - positions[near]) / span
+
+
+def interpolate(values, present, targets, factor=None, positions=None):
+    '''
+    Sets the *targets* masters to a value interpolated between their
+    neighbours, or extrapolated from the two nearest masters at the
+    ends of the master list, by *factor* (default: 0.5). With
+    *positions* (the masters' locations on the axis) instead, the
+    factor follows from the locations.
+    '''
+    master_count = values.shape[1]
+    if master_count < 3:
+        raise ValueError('Need at least 3 masters to interpolate')
+    if factor is not None and positions is not None:
+        raise ValueError('Interpolate by a factor or by positions')
+    if factor is None and positions is None:
+        factor = 0.5
+    number_values = values.astype(numpy.float64)
+    new_values = values.copy()
+    new_present = present.copy()
+    for target in targets:
+        if target == 0:
+            p_min, p_max = number_values[:, 2], number_values[:, 1]
+            if positions is not None:
+                factor = _factor(positions, 0, 1, 2)
+            result = p_max + (p_max - p_min) * factor
+        elif target == master_count - 1:
+            p_min, p_max = number_values[:, -3], number_values[:, -2]
+            if positions is not None:
+                factor = _factor(
+                    positions, target, target - 1, target - 2)
+            result = p_max + (p_max - p_min) * factor
+        else:
+            p_min = number_values[:, target - 1]
+            p_max = number_values[:, target + 1]
+            if positions is not None:
+                factor = -_factor(positions, target, target - 1, target + 1)
+            result = p_min + (p_max - p_min) * factor
+        new_values[:, target] = round_values(result)
+        new_present[:, target] = True
+    return new_values, new_present
+
+
+def delete(values, present):
+    '''
+    Removes the pairs from all masters.
+    '''
+    return numpy.zeros_like(values), numpy.zeros_like(present)
+
+
+def shift(values, present, amount, masters=None):
+    '''
+    Adds *amount* to the values of the given masters (default: all).
+    '''
+    if masters is None:
+        masters = range(values.shape[1])
+    masters = list(masters)
+    new_values = values.copy()
+    new_present = present.copy()
+    new_values[:, masters] += int(amount)
+    new_present[:, masters] = True
+    return new_values, new_present
+
+
+ACTIONS = collections.OrderedDict([
+    ('average', average),
+    ('equalize', equalize),
+    ('interpolate', interpolate),
+    ('delete', delete),
+    ('shift', shift),
+    ('smooth', smooth),
+])
+# actions taking the masters' locations on the axis
+POSITIONED_ACTIONS = ['interpolate', 'smooth']
+
+CONDITION_RE = re.compile(
+    r'^\s*(\w+)\s*(<=|>=|==|!=|<|>)\s*(-?\d+(?:\.\d*)?)\s*$')
+
+
+def condition_mask(stats, condition):
+    '''
+    Evaluates a condition like 'gamut < 6' for all pairs. Valid names
+    are the PairStats in CONDITION_STATS and the RANKING_METRICS keys.
+    '''
+    match = CONDITION_RE.match(condition)
+    if match is None:
+        raise ValueError('invalid condition: {!r}'.format(condition))
+    name, op, number = match.groups()
+    if name in RANKING_METRICS:
+        name = RANKING_METRICS[name][0]
+    if name not in CONDITION_STATS:
+        raise ValueError('unknown statistic in condition: {!r}'.format(
+            condition))
+    return OPERATORS[op](getattr(stats, name), float(number))
+
+
+def write_kerning(font, updates, deletions):
+    '''
+    Writes changed pairs to a font's kerning in one bulk update.
+    Where the kerning wraps a defcon object, its notifications are held
+    until all changes are written.
+    '''
+    kerning = font.kerning
+    native = kerning.naked() if hasattr(kerning, 'naked') else None
+    hold = hasattr(native, 'holdNotifications')
+    if hold:
+        native.holdNotifications()
+    try:
+        kerned_pairs = set(kerning.keys())
+        for pair in deletions:
+            if pair in kerned_pairs:
+                del kerning[pair]
+        if updates:
+            kerning.update(updates)
+    finally:
+        if hold:
+            native.releaseHeldNotifications()
+
+
+class WriteBack(object):
+    '''
+    Holds values written to the fonts' kerning, to write them in bulk:
+    on flush(), or once *interval* seconds have passed since the last
+    write (never, if None). Values have the semantics of a direct write;
+    None removes the pair. Meanwhile, the analysis model (KernMatrix)
+    already has the new values.
+    '''
+
+    def __init__(self, fonts, interval=None):
+        self.fonts = fonts
+        self.interval = interval
+        self._pending = [{} for _ in fonts]
+        self._last_flush = time.time()
+
+    @property
+    def pending(self):
+        return any(self._pending)
+
+    def set(self, font_index, pair, value):
+        self._pending[font_index][pair] = value
+        if (
+            self.interval is not None and
+            time.time() - self._last_flush >= self.interval
+        ):
+            self.flush()
+
+    def flush(self):
+        '''
+        Writes all pending values, one bulk update per font.
+        '''
+        for font, pending in zip(self.fonts, self._pending):
+            if pending:
+                write_kerning(
+                    font,
+                    {
+                        pair: value for pair, value in pending.items() if
+                        value is not None},
+                    [
+                        pair for pair, value in pending.items() if
+                        value is None])
+                pending.clear()
+        self._last_flush = time.time()
+
+
+def load_rules(path):
+    '''
+    Reads a JSON rule file: a list of rules (or {"rules": [...]}).
+    '''
+    with open(path) as rule_file:
+        rules = json.load(rule_file)
+    if isinstance(rules, dict):
+        rules = rules['rules']
+    return rules
+
+
+class BatchEditor(object):
+    '''
+    Applies an edit action to many pairs of a FilterEngine's matrix
+    in one vectorized operation, then writes the changed pairs to each
+    font in a single bulk update.
+
+    Rules (see run_rules) describe edits declaratively, for instance:
+
+        {"action": "average", "where": ["gamut < 6"]}
+        {"action": "delete", "filter": "zero_value"}
+        {"action": "shift", "amount": -10, "masters": ["Bold"],
+            "filter": "outlier", "where": ["max > 200"]}
+        {"action": "delete", "query": "m3 is None AND NOT exception"}
+        {"action": "smooth", "filter": "interpolation"}
+
+    Masters are given by index or by name (see *master_names*).
+    Interpolation (unless given a factor) and smoothing use the
+    engine's master_positions.
+    Queries (see pairQuery) may use the search terms of *search_index*
+    and the similar pairs of *profile_index*.
+    Edits are recorded in the *journal* (an EditJournal), if given.
+    '''
+
+    rule_keys = ['action', 'filter', 'where', 'query', 'name']
+
+    def __init__(
+        self, engine, fonts, master_names=None, journal=None,
+        search_index=None, profile_index=None
+    ):
+        self.engine = engine
+        self.fonts = fonts
+        self.master_names = master_names or []
+        self.journal = journal
+        self.queries = QueryEngine(engine, search_index, profile_index)
+
+    def select(self, filter_key=None, where=(), query=None):
+        '''
+        Indices of the pairs in a filter (default: all pairs)
+        meeting all conditions and matching the query.
+        '''
+        engine = self.engine
+        if filter_key is None:
+            pair_indices = numpy.arange(len(engine.kern_matrix))
+        else:
+            pair_indices = engine.membership(filter_key)
+        if where:
+            engine.compute_filter('single')
+            with engine.lock:
+                mask = numpy.ones(len(engine.kern_matrix), dtype=bool)
+                for condition in where:
+                    mask &= condition_mask(engine.stats, condition)
+            pair_indices = pair_indices[mask[pair_indices]]
+        if query:
+            pair_indices = self.queries.select(query, pair_indices)
+        return pair_indices
+
+    def master_index(self, master):
+        if isinstance(master, int):
+            return master
+        return self.master_names.index(master)
+
+    def apply(self, action, pair_indices, **options):
+        '''
+        Applies an action (a key of ACTIONS) to the given pairs,
+        returns the engine's change set.
+        '''
+        for option in ('source',):
+            if option in options:
+                options[option] = self.master_index(options[option])
+        for option in ('targets', 'masters'):
+            if options.get(option) is not None:
+                options[option] = [
+                    self.master_index(master) for master in options[option]]
+        if action in POSITIONED_ACTIONS and options.get('factor') is None:
+            options.setdefault('positions', self.engine.master_positions)
+        pair_indices = numpy.unique(
+            numpy.asarray(pair_indices, dtype=numpy.intp))
+        kern_matrix = self.engine.kern_matrix
+        with self.engine.lock:
+            new_values, new_present = ACTIONS[action](
+                kern_matrix.values[pair_indices],
+                kern_matrix.present[pair_indices], **options)
+            return self.set_rows(pair_indices, new_values, new_present)
+
+    def set_rows(self, pair_indices, new_values, new_present, record=True):
+        '''
+        Replaces the values of a number of (unique) pairs in the
+        engine and the fonts. Returns the engine's change set.
+        '''
+        kern_matrix = self.engine.kern_matrix
+        with self.engine.lock:
+            values = kern_matrix.values[pair_indices]
+            present = kern_matrix.present[pair_indices]
+            changes = self.engine.set_rows(
+                pair_indices, new_values, new_present)
+        if record and self.journal is not None:
+            self.journal.record_rows(
+                pair_indices, values, present, new_values, new_present)
+        self._write_fonts(
+            pair_indices, values, present, new_values, new_present)
+        return changes
+
+    def set_cells(self, pair_indices, master_indices, values, record=True):
+        '''
+        Sets single values (None removes a pair from a master),
+        for instance those of a journal entry.
+        '''
+        rows, positions = numpy.unique(
+            numpy.asarray(pair_indices, dtype=numpy.intp),
+            return_inverse=True)
+        kern_matrix = self.engine.kern_matrix
+        with self.engine.lock:
+            new_values = kern_matrix.values[rows]
+            new_present = kern_matrix.present[rows]
+            for position, master_index, value in zip(
+                positions.tolist(), list(master_indices), values
+            ):
+                new_present[position, master_index] = value is not None
+                new_values[position, master_index] = (
+                    0 if value is None else value)
+            return self.set_rows(rows, new_values, new_present, record)
+
+    def _write_fonts(self, pair_indices, values, present, new_values,
+            new_present):
+        # only changed cells are written, unchanged ones keep the
+        # fonts' own (possibly fractional) values
+        kern_matrix = self.engine.kern_matrix
+        pairs = kern_matrix.pairs
+        for f_index, font in enumerate(self.fonts):
+            was_kerned = present[:, f_index]
+            is_kerned = new_present[:, f_index]
+            changed = is_kerned & (
+                ~was_kerned | (values[:, f_index] != new_values[:, f_index]))
+            updates = {
+                pairs[pair_index]: kern_matrix.font_value(
+                    pair_index, f_index, value) for
+                pair_index, value in zip(
+                    pair_indices[changed].tolist(),
+                    new_values[changed, f_index].tolist())}
+            deletions = [
+                pairs[pair_index] for pair_index in
+                pair_indices[was_kerned & ~is_kerned].tolist()]
+            if updates or deletions:
+                write_kerning(font, updates, deletions)
+
+    def run_rules(self, rules):
+        '''
+        Applies rules in order, each to the state left by the previous.
+        Returns the number of pairs each rule was applied to.
+        '''
+        counts = []
+        for rule in rules:
+            rule = dict(rule)
+            action = rule.get('action')
+            if action not in ACTIONS:
+                raise ValueError('unknown action in rule: {!r}'.format(rule))
+            options = {
+                key: value for key, value in rule.items() if
+                key not in self.rule_keys}
+            pair_indices = self.select(
+                rule.get('filter'), rule.get('where', ()), rule.get('query'))
+            self.apply(action, pair_indices, **options)
+            counts.append(len(pair_indices))
+        return counts
@@ -0,0 +1,169 @@
+import itertools
+
+GROUP_FLAG = 'public.kern'
+
+
+def _glyph_to_group(groups, prefix):
+    '''
+    Maps each glyph to the kerning group (with the given prefix)
+    it belongs to.
+    '''
+    glyph_to_group = {}
+    for group_name, glyph_list in groups.items():
+        if group_name.startswith(prefix):
+            for glyph_name in glyph_list:
+                glyph_to_group[glyph_name] = group_name
+    return glyph_to_group
+
+
+class ExceptionIndex(object):
+    '''
+    Exceptions of a single font, built once from its kerned pairs
+    (or its kerning dictionary) and groups.
+
+    Kerning pairs are split into the four pair classes (group-group,
+    glyph-group, group-glyph, glyph-glyph), which are kept as sets.
+    Each exception is mapped to the base pair it overrides, following
+    the lookup order of the UFO specification: a glyph-glyph pair
+    overrides glyph-group, then group-glyph, then group-group pairs;
+    glyph-group and group-glyph pairs override group-group pairs.
+    '''
+
+    def __init__(self, kerned_pairs, groups):
+        self.groups = {
+            group_name: list(glyph_list) for
+            group_name, glyph_list in groups.items() if
+            group_name.startswith(GROUP_FLAG)}
+        self.left_groups = _glyph_to_group(self.groups, 'public.kern1.')
+        self.right_groups = _glyph_to_group(self.groups, 'public.kern2.')
+
+        self.group_group = set()
+        self.glyph_group = set()
+        self.group_glyph = set()
+        self.glyph_glyph = set()
+        for pair in kerned_pairs:
+            self._pair_class(pair).add(pair)
+
+        # exception -> base pair, base pair -> set of exceptions
+        self.base = {}
+        self.exceptions = {}
+        for pair in itertools.chain(
+            self.group_glyph, self.glyph_group, self.glyph_glyph
+        ):
+            self._resolve(pair)
+
+    @classmethod
+    def from_font(cls, font):
+        return cls(font.kerning, font.groups)
+
+    def _pair_class(self, pair):
+        left, right = pair
+        if GROUP_FLAG in left:
+            if GROUP_FLAG in right:
+                return self.group_group
+            return self.group_glyph
+        if GROUP_FLAG in right:
+            return self.glyph_group
+        return self.glyph_glyph
+
+    def _base_candidates(self, pair):
+        '''
+        Pairs which *pair* may override, in lookup order.
+        '''
+        left, right = pair
+        left_group = self.left_groups.get(left)
+        right_group = self.right_groups.get(right)
+        pair_class = self._pair_class(pair)
+        if pair_class is self.glyph_glyph:
+            return [
+                ((left, right_group), self.glyph_group),
+                ((left_group, right), self.group_glyph),
+                ((left_group, right_group), self.group_group),
+            ]
+        if pair_class is self.group_glyph:
+            return [((left, right_group), self.group_group)]
+        if pair_class is self.glyph_group:
+            return [((left_group, right), self.group_group)]
+        return []
+
+    def _resolve(self, pair):
+        '''
+        (Re-)establishes the base pair of *pair*.
+        '''
+        old_base = self.base.pop(pair, None)
+        if old_base is not None:
+            self.exceptions[old_base].discard(pair)
+            if not self.exceptions[old_base]:
+                del self.exceptions[old_base]
+        if pair not in self._pair_class(pair):
+            return
+        for base_pair, base_pairs in self._base_candidates(pair):
+            if base_pair in base_pairs:
+                self.base[pair] = base_pair
+                self.exceptions.setdefault(base_pair, set()).add(pair)
+                return
+
+    def _dependents(self, pair):
+        '''
+        Kerned pairs which may have *pair* as their base pair.
+        '''
+        left, right = pair
+        left_glyphs = self.groups.get(left, []) if GROUP_FLAG in left else []
+        right_glyphs = (
+            self.groups.get(right, []) if GROUP_FLAG in right else [])
+        candidates = []
+        if left_glyphs:
+            candidates.extend((l_glyph, right) for l_glyph in left_glyphs)
+        if right_glyphs:
+            candidates.extend((left, r_glyph) for r_glyph in right_glyphs)
+        if left_glyphs and right_glyphs:
+            candidates.extend(itertools.product(left_glyphs, right_glyphs))
+        return [
+            candidate for candidate in candidates if
+            candidate in self._pair_class(candidate)]
+
+    def add_pair(self, pair):
+        '''
+        Registers a newly kerned pair. Returns the pairs whose
+        exception status may have changed.
+        '''
+        self._pair_class(pair).add(pair)
+        return self._update(pair)
+
+    def remove_pair(self, pair):
+        '''
+        Unregisters a pair which is no longer kerned. Returns the
+        pairs whose exception status may have changed.
+        '''
+        self._pair_class(pair).discard(pair)
+        return self._update(pair)
+
+    def _update(self, pair):
+        affected = [pair] + self._dependents(pair)
+        for affected_pair in affected:
+            self._resolve(affected_pair)
+        return affected
+
+    def __contains__(self, pair):
+        return pair in self.base
+
+    def __len__(self):
+        return len(self.base)
+
+    def is_exception(self, pair):
+        return pair in self.base
+
+    def base_of(self, exception):
+        '''
+        The pair overridden by an exception (None for regular pairs).
+        '''
+        return self.base.get(exception)
+
+    def exceptions_of(self, pair):
+        '''
+        The exceptions overriding a (group) pair.
+        '''
+        return self.exceptions.get(pair, set())
+
+    def sorted_exceptions(self):
+        return sorted(self.base)
@@ -0,0 +1,257 @@
+import itertools
+
+import numpy
+
+from exceptionIndex import GROUP_FLAG, _glyph_to_group
+from kernMatrix import KernMatrix
+from reprCache import _glyph_order
+
+
+class KerningResolver(object):
+    '''
+    Effective kerning of glyph pairs in a single font, looked up on
+    demand. Following the UFO specification, a glyph-glyph pair wins
+    over glyph-group, then group-glyph, then group-group pairs.
+    '''
+
+    def __init__(self, kerning, groups):
+        self.kerning = kerning
+        self.left_groups = _glyph_to_group(groups, 'public.kern1.')
+        self.right_groups = _glyph_to_group(groups, 'public.kern2.')
+        # glyphs kerned individually (not only through their group)
+        self.left_glyphs = set(
+            left for left, _ in kerning if GROUP_FLAG not in left)
+        self.right_glyphs = set(
+            right for _, right in kerning if GROUP_FLAG not in right)
+
+    @classmethod
+    def from_font(cls, font):
+        return cls(font.kerning, font.groups)
+
+    def source(self, left, right):
+        '''
+        The kerned pair which applies to a glyph pair,
+        None if the glyphs are not kerned.
+        '''
+        left_group = self.left_groups.get(left)
+        right_group = self.right_groups.get(right)
+        for pair in (
+            (left, right), (left, right_group),
+            (left_group, right), (left_group, right_group)
+        ):
+            if pair in self.kerning:
+                return pair
+
+    def value(self, left, right):
+        source = self.source(left, right)
+        if source is not None:
+            return self.kerning[source]
+
+    def left_key(self, glyph_name):
+        '''
+        Glyphs with the same left key are kerned alike on the left side:
+        individually kerned glyphs are their own key, others share the
+        key of their group. None for glyphs never kerned on the left.
+        '''
+        if glyph_name in self.left_glyphs:
+            return glyph_name
+        return self.left_groups.get(glyph_name)
+
+    def right_key(self, glyph_name):
+        if glyph_name in self.right_glyphs:
+            return glyph_name
+        return self.right_groups.get(glyph_name)
+
+
+def _side_classes(resolvers, glyph_names, key_name, rank):
+    '''
+    Partitions glyphs into classes which are kerned alike in every
+    master, each sorted by glyph order. Classes are sorted by their
+    first glyph.
+    '''
+    by_signature = {}
+    for glyph_name in glyph_names:
+        signature = tuple(
+            getattr(resolver, key_name)(glyph_name) for
+            resolver in resolvers)
+        if any(key is not None for key in signature):
+            by_signature.setdefault(signature, []).append(glyph_name)
+    unranked = len(rank)
+    sort_key = lambda name: (rank.get(name, unranked), name)
+    classes = [
+        tuple(sorted(members, key=sort_key)) for
+        members in by_signature.values()]
+    classes.sort(key=lambda members: sort_key(members[0]))
+    return classes
+
+
+def _precedence(pair):
+    '''
+    Lookup precedence of a kerned pair: group-group pairs (0) are
+    overridden by group-glyph (1), glyph-group (2) and glyph-glyph (3).
+    '''
+    left, right = pair
+    return 2 * (GROUP_FLAG not in left) + (GROUP_FLAG not in right)
+
+
+def _classes_by_item(classes, key_name, resolver, group_map):
+    '''
+    Maps every glyph and group name of a master to the indices of the
+    classes it covers.
+    '''
+    by_item = {}
+    for c_index, members in enumerate(classes):
+        representative = members[0]
+        key = getattr(resolver, key_name)(representative)
+        if key is None:
+            continue
+        by_item.setdefault(key, []).append(c_index)
+        group_name = group_map.get(representative)
+        if group_name is not None and group_name != key:
+            # individually kerned glyphs are still kerned by their group
+            by_item.setdefault(group_name, []).append(c_index)
+    return by_item
+
+
+class FlatKerning(object):
+    '''
+    Glyph-level kerning of a number of fonts.
+
+    Glyphs which are kerned alike in every master (same group, and not
+    kerned individually) form a class. Pairs of classes whose values
+    come from the same kerned pairs in every master share a row of
+    *matrix*, a KernMatrix keyed by a representative glyph pair, which
+    can be passed to the FilterEngine: every glyph pair of a row has
+    exactly its values. So the kerning is stored once per distinct
+    combination of kerned pairs, rather than once per glyph pair.
+    Single glyph pairs are resolved lazily (lookup), glyph_pairs()
+    expands a row on demand.
+
+    Masters may use different group structures. *max_pairs* limits the
+    number of class pairs; a ValueError is raised beyond it.
+    '''
+
+    def __init__(self, fonts, max_pairs=None):
+        self.resolvers = [KerningResolver.from_font(font) for font in fonts]
+        rank = {}
+        if fonts:
+            glyph_order = _glyph_order(fonts[0]) or []
+            rank = {name: i for i, name in enumerate(glyph_order)}
+
+        left_names = set()
+        right_names = set()
+        for resolver in self.resolvers:
+            left_names.update(resolver.left_glyphs, resolver.left_groups)
+            right_names.update(resolver.right_glyphs, resolver.right_groups)
+        self.left_classes = _side_classes(
+            self.resolvers, left_names, 'left_key', rank)
+        self.right_classes = _side_classes(
+            self.resolvers, right_names, 'right_key', rank)
+        self._left_class_of = {
+            name: c_index for c_index, members in
+            enumerate(self.left_classes) for name in members}
+        self._right_class_of = {
+            name: c_index for c_index, members in
+            enumerate(self.right_classes) for name in members}
+
+        # class pair -> the kerned pair which applies, in every master;
+        # pairs of higher precedence are written last
+        master_count = len(self.resolvers)
+        sources = {}
+        for m_index, resolver in enumerate(self.resolvers):
+            left_by_item = _classes_by_item(
+                self.left_classes, 'left_key', resolver,
+                resolver.left_groups)
+            right_by_item = _classes_by_item(
+                self.right_classes, 'right_key', resolver,
+                resolver.right_groups)
+            for pair in sorted(resolver.kerning, key=_precedence):
+                for class_pair in itertools.product(
+                    left_by_item.get(pair[0], []),
+                    right_by_item.get(pair[1], [])
+                ):
+                    class_sources = sources.get(class_pair)
+                    if class_sources is None:
+                        class_sources = sources[class_pair] = (
+                            [None] * master_count)
+                    class_sources[m_index] = pair
+                if max_pairs is not None and len(sources) > max_pairs:
+                    raise ValueError(
+                        'glyph-level kerning exceeds {} pairs'.format(
+                            max_pairs))
+
+        by_sources = {}
+        for class_pair in sorted(sources):
+            by_sources.setdefault(
+                tuple(sources[class_pair]), []).append(class_pair)
+        kernings = [{} for _ in self.resolvers]
+        by_pair = {}
+        for row_sources, class_pairs in by_sources.items():
+            left_index, right_index = class_pairs[0]
+            pair = (
+                self.left_classes[left_index][0],
+                self.right_classes[right_index][0])
+            by_pair[pair] = class_pairs
+            for m_index, source in enumerate(row_sources):
+                if source is not None:
+                    kernings[m_index][pair] = (
+                        self.resolvers[m_index].kerning[source])
+
+        self.matrix = KernMatrix.from_kernings(kernings)
+        self.row_class_pairs = [by_pair[pair] for pair in self.matrix.pairs]
+        self._rows = {
+            class_pair: pair_index for
+            pair_index, class_pairs in enumerate(self.row_class_pairs) for
+            class_pair in class_pairs}
+        self.weights = numpy.array([
+            sum(
+                len(self.left_classes[left_index]) *
+                len(self.right_classes[right_index]) for
+                left_index, right_index in class_pairs) for
+            class_pairs in self.row_class_pairs], dtype=numpy.int64)
+
+    @classmethod
+    def from_fonts(cls, fonts, max_pairs=None):
+        return cls(fonts, max_pairs)
+
+    @property
+    def glyph_pair_count(self):
+        '''
+        Number of kerned glyph pairs after full expansion.
+        '''
+        return int(self.weights.sum())
+
+    def lookup(self, left, right):
+        '''
+        Values of a glyph pair in every master (None where unkerned).
+        '''
+        return [resolver.value(left, right) for resolver in self.resolvers]
+
+    def pair_index(self, left, right):
+        '''
+        Matrix row holding the values of a glyph pair,
+        None if the pair is not kerned in any master.
+        '''
+        class_pair = (
+            self._left_class_of.get(left), self._right_class_of.get(right))
+        return self._rows.get(class_pair)
+
+    def glyph_pairs(self, pair_index):
+        '''
+        Iterates the glyph pairs sharing the values of a matrix row.
+        '''
+        return itertools.chain.from_iterable(
+            itertools.product(
+                self.left_classes[left_index],
+                self.right_classes[right_index]) for
+            left_index, right_index in self.row_class_pairs[pair_index])
+
+    def iter_glyph_pairs(self):
+        '''
+        Iterates (glyph pair, value list) for all kerned glyph pairs,
+        without keeping the expansion in memory.
+        '''
+        for pair_index in range(len(self.row_class_pairs)):
+            values = self.matrix.row(pair_index)
+            for glyph_pair in self.glyph_pairs(pair_index):
+                yield glyph_pair, values
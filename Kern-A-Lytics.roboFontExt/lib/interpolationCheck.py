@@ -0,0 +1,201 @@
+from __future__ import division
+
+import numpy
+
+from kernMatrix import round_values
+
+# residual (in units) from which an uneven pair is flagged
+DEFAULT_TOLERANCE = 10
+# steps between masters up to this size do not change direction
+MIN_STEP = 2
+
+
+def master_positions(fonts):
+    '''
+    Positions of the masters on the interpolation axis: the designspace
+    location on the only axis along which they differ, or else their
+    weight classes if all differ. None if neither is known (masters
+    are then taken as evenly spaced, in the order given).
+    '''
+    locations = [getattr(font, 'location', None) for font in fonts]
+    if all(locations):
+        axes = [
+            axis for axis in sorted(set().union(*locations)) if
+            len(set(location.get(axis) for location in locations)) > 1]
+        if len(axes) == 1 and all(axes[0] in loc for loc in locations):
+            return [float(location[axes[0]]) for location in locations]
+    try:
+        weights = [font.info.openTypeOS2WeightClass for font in fonts]
+    except AttributeError:
+        return None
+    if None not in weights and len(set(weights)) == len(weights):
+        return [float(weight) for weight in weights]
+    return None
+
+
+def _axis(positions, master_count):
+    '''
+    Master order along the axis and the sorted positions.
+    '''
+    if positions is None:
+        return (
+            numpy.arange(master_count),
+            numpy.arange(master_count, dtype=numpy.float64))
+    positions = numpy.asarray(positions, dtype=numpy.float64)
+    if len(positions) != master_count:
+        raise ValueError('{} positions given for {} masters'.format(
+            len(positions), master_count))
+    order = numpy.argsort(positions, kind='mergesort')
+    return order, positions[order]
+
+
+def _neighbours(present):
+    '''
+    Column of the nearest kerned master before and after every cell
+    (-1 and the column count where there is none).
+    '''
+    master_count = present.shape[1]
+    # masters are few, small indices keep the arrays small
+    columns = numpy.arange(master_count, dtype=numpy.int16)
+    before = numpy.full(present.shape, -1, dtype=numpy.int16)
+    numpy.maximum.accumulate(
+        numpy.where(present[:, :-1], columns[:-1], -1).astype(numpy.int16),
+        axis=1, out=before[:, 1:])
+    after = numpy.full(present.shape, master_count, dtype=numpy.int16)
+    numpy.minimum.accumulate(
+        numpy.where(present[:, :0:-1], columns[:0:-1], master_count).astype(
+            numpy.int16),
+        axis=1, out=after[:, -2::-1])
+    return before, after
+
+
+class InterpolationReport(object):
+    '''
+    Checks whether the kerning of each pair changes evenly along the
+    interpolation axis. Masters are put in the order of their
+    *positions* (evenly spaced in the given order if None), unkerned
+    masters are left out.
+
+    Every kerned inner master is compared with the linear prediction
+    from its kerned neighbours: *residuals* (pairs x masters, NaN where
+    there is no prediction) and, per pair, the largest absolute
+    residual (*error*) and the master it belongs to (*master*, -1 if
+    none). *reversals* counts how often the kerning changes direction
+    along the axis (steps up to MIN_STEP units ignored); pairs with
+    reversals are not monotonic, pairs with two or more zig-zag.
+    Flagged are pairs which are not monotonic, with an error of at
+    least *tolerance* units.
+    '''
+
+    def __init__(
+        self, values, present, positions=None, tolerance=DEFAULT_TOLERANCE
+    ):
+        self.positions = positions
+        self.tolerance = tolerance
+        pair_count, master_count = values.shape
+        order, axis = _axis(positions, master_count)
+        sorted_values = values[:, order].astype(numpy.float64)
+        sorted_present = present[:, order]
+        rows = numpy.arange(pair_count)[:, None]
+        before, after = _neighbours(sorted_present)
+        stepped = sorted_present & (before >= 0)
+        valid = stepped & (after < master_count)
+        numpy.maximum(before, 0, out=before)
+        numpy.minimum(after, master_count - 1, out=after)
+
+        # linear predictions from both neighbours, computed in place
+        v_before = sorted_values[rows, before]
+        residuals = sorted_values[rows, after]
+        residuals -= v_before
+        x_before = axis[before]
+        span = axis[after] - x_before
+        span[span <= 0] = 1
+        x_before -= axis
+        x_before /= span
+        del span
+        residuals *= x_before
+        del x_before
+        residuals += sorted_values
+        residuals -= v_before
+        # residuals are now the value minus its prediction
+        residuals[~valid] = numpy.nan
+        self.residuals = numpy.empty_like(residuals)
+        self.residuals[:, order] = residuals
+
+        numpy.abs(residuals, out=residuals)
+        residuals[~valid] = -1
+        worst = numpy.argmax(residuals, axis=1)
+        error = residuals[numpy.arange(pair_count), worst]
+        del residuals
+        self.error = numpy.maximum(error, 0.0)
+        self.master = numpy.where(error >= 0, order[worst], -1)
+
+        # direction of each step from the previous kerned master
+        steps = sorted_values
+        steps -= v_before
+        del v_before
+        signs = numpy.sign(steps).astype(numpy.int8)
+        signs[(numpy.abs(steps) <= MIN_STEP) | ~stepped] = 0
+        del steps
+        columns = numpy.arange(master_count, dtype=numpy.int16)
+        last = numpy.full(signs.shape, -1, dtype=numpy.int16)
+        numpy.maximum.accumulate(
+            numpy.where(signs[:, :-1] != 0, columns[:-1], -1).astype(
+                numpy.int16),
+            axis=1, out=last[:, 1:])
+        previous = signs[rows, numpy.maximum(last, 0)]
+        previous[last < 0] = 0
+        self.reversals = (
+            (signs != 0) & (previous != 0) & (signs != previous)).sum(axis=1)
+
+    @classmethod
+    def from_matrix(cls, kern_matrix, positions=None, **options):
+        return cls(
+            kern_matrix.values, kern_matrix.present, positions, **options)
+
+    @property
+    def non_monotonic(self):
+        return self.reversals > 0
+
+    @property
+    def zigzag(self):
+        return self.reversals > 1
+
+    @property
+    def flagged(self):
+        return self.non_monotonic & (self.error >= self.tolerance)
+
+    def ranked(self):
+        '''
+        Indices of the flagged pairs, largest error first.
+        '''
+        pair_indices = numpy.flatnonzero(self.flagged)
+        return pair_indices[numpy.argsort(
+            -self.error[pair_indices], kind='mergesort')]
+
+
+def smooth(values, present, positions=None):
+    '''
+    Least-squares proposal for many pairs at once: the kerned values of
+    each pair are replaced by the straight line fitting them best along
+    the axis. Pairs kerned in fewer than three masters are kept.
+    '''
+    order, sorted_axis = _axis(positions, values.shape[1])
+    axis = numpy.empty_like(sorted_axis)
+    axis[order] = sorted_axis
+    weights = present.astype(numpy.float64)
+    y = values.astype(numpy.float64)
+    s0 = weights.sum(axis=1)
+    s1 = (weights * axis).sum(axis=1)
+    s2 = (weights * axis ** 2).sum(axis=1)
+    t0 = (weights * y).sum(axis=1)
+    t1 = (weights * axis * y).sum(axis=1)
+    determinant = s0 * s2 - s1 ** 2
+    fits = (s0 >= 3) & (determinant > 0)
+    safe = numpy.where(fits, determinant, 1)
+    slope = (s0 * t1 - s1 * t0) / safe
+    intercept = (t0 - slope * s1) / numpy.where(fits, s0, 1)
+    line = round_values(intercept[:, None] + slope[:, None] * axis)
+    new_values = numpy.where(
+        fits[:, None] & present, line, values).astype(values.dtype)
+    return new_values, present.copy()
@@ -0,0 +1,701 @@
+from __future__ import division
+
+import collections
+import threading
+
+import numpy
+
+from exceptionIndex import ExceptionIndex
+from interpolationCheck import DEFAULT_TOLERANCE, InterpolationReport
+from robustOutliers import DEFAULT_THRESHOLD, OutlierReport
+
+
+# filter keys and popup labels, in the order they appear in the popup.
+# labels are formatted with the FilterEngine's attributes.
+FILTERS = [
+    ('all', 'All Pairs'),
+    ('single', 'Single Pairs'),
+    ('same_value', 'Same Value Across all Masters'),
+    ('zero_value', 'Zero-Value Pairs'),
+    ('partial', 'Missing in Some Masters'),
+    ('largest_value', 'Long-Distance Kerning Pairs'),
+    ('high_gamut', 'High Gamut Across Pairs'),
+    ('outlier', 'Outliers by a Factor of {outlier_factor}'),
+    ('robust_outlier', 'Robust Outliers (Score > {robust_threshold})'),
+    ('interpolation',
+        'Uneven Interpolation (Error >= {interpolation_tolerance})'),
+    ('exception', 'Exceptions'),
+    ('small_average', 'Average Kern Distance < {small_average_value}'),
+    ('ranking', 'Top {ranking_amount} by {ranking_label}'),
+]
+
+# filters whose membership depends on the values of all other pairs
+RANKED_FILTERS = ['largest_value', 'high_gamut', 'ranking']
+
+# metrics pairs can be ranked by: the PairStats attribute, whether
+# the lowest values rank first, and the label used in the popup
+RANKING_METRICS = collections.OrderedDict([
+    ('max', ('maximum', False, 'Largest Value')),
+    ('min', ('minimum', True, 'Smallest Value')),
+    ('gamut', ('gamut', False, 'Gamut')),
+    ('abs_mean', ('abs_mean', False, 'Average Distance')),
+    ('spread', ('spread', False, 'Spread Relative to Mean')),
+    ('severity', ('outlier_score', False, 'Outlier Severity')),
+    ('interpolation', ('interpolation_error', False, 'Interpolation Error')),
+])
+# filters decided by the statistics of each pair alone
+STAT_FILTERS = [
+    'single', 'same_value', 'zero_value', 'partial', 'outlier',
+    'robust_outlier', 'interpolation', 'small_average']
+# stat filters listing their pairs by a score, rather than in pair order
+SCORED_FILTERS = {
+    'robust_outlier': 'outlier_score',
+    'interpolation': 'interpolation_error'}
+
+
+def outlier_mask(abs_values, factor):
+    '''
+    Pairs (rows of absolute values) with one or more values exceeding
+    their average by *factor*.
+    '''
+    abs_equal = (abs_values == abs_values[:, :1]).all(axis=1)
+    abs_average = abs_values.mean(axis=1)
+    return ~abs_equal & (
+        abs_values >= (abs_average * factor)[:, None]).any(axis=1)
+
+
+class PairStats(object):
+    '''
+    Per-pair statistics of a KernMatrix, computed in one vectorized pass.
+    Like the kerningHelper functions, gamut and abs_mean only consider
+    values which are kerned and non-zero; minimum, maximum and the
+    outlier test count missing values as 0. *spread* is the standard
+    deviation of the kerned values, relative to abs_mean, and
+    *kerned_masters* the number of masters kerning the pair.
+
+    The robust outlier statistics (see robustOutliers.OutlierReport,
+    by *robust_method*) leave missing values out: the master deviating
+    most (outlier_master, -1 if none), its score and its deviation.
+    So does the interpolation check along *master_positions* (see
+    interpolationCheck.InterpolationReport): the inner master furthest
+    from the line between its neighbours (interpolation_master), that
+    distance (interpolation_error) and the changes of direction
+    (reversals).
+    '''
+
+    names = [
+        'minimum', 'maximum', 'total', 'gamut', 'abs_mean', 'spread',
+        'all_equal', 'all_zero', 'kerned_masters', 'outlier', 'single',
+        'outlier_master', 'outlier_score', 'outlier_deviation',
+        'interpolation_master', 'interpolation_error', 'reversals']
+
+    def __init__(
+        self, values, present, pairs, outlier_factor=4, robust_method='mad',
+        master_positions=None
+    ):
+        int_info = numpy.iinfo(values.dtype)
+
+        self.minimum = values.min(axis=1)
+        self.maximum = values.max(axis=1)
+        self.total = values.sum(axis=1, dtype=numpy.int64)
+
+        kerned = present & (values != 0)
+        kerned_count = kerned.sum(axis=1)
+        has_kerning = kerned_count > 0
+        kerned_max = numpy.where(kerned, values, int_info.min).max(axis=1)
+        kerned_min = numpy.where(kerned, values, int_info.max).min(axis=1)
+        self.gamut = numpy.where(
+            has_kerning,
+            kerned_max.astype(numpy.int64) - kerned_min, 0)
+
+        abs_values = numpy.abs(values.astype(numpy.int64))
+        self.abs_mean = numpy.where(
+            has_kerning,
+            numpy.where(kerned, abs_values, 0).sum(axis=1) /
+            numpy.maximum(kerned_count, 1), 0.0)
+
+        kerned_values = numpy.where(kerned, values, 0).astype(numpy.float64)
+        kerned_mean = kerned_values.sum(axis=1) / numpy.maximum(
+            kerned_count, 1)
+        variance = numpy.where(
+            kerned, (kerned_values - kerned_mean[:, None]) ** 2, 0.0).sum(
+            axis=1) / numpy.maximum(kerned_count, 1)
+        self.spread = numpy.where(
+            has_kerning,
+            numpy.sqrt(variance) / numpy.where(has_kerning, self.abs_mean, 1),
+            0.0)
+
+        # same value (or unkerned) in every master
+        self.all_equal = (
+            (present.all(axis=1) &
+                (values == values[:, :1]).all(axis=1)) |
+            ~present.any(axis=1))
+        self.all_zero = ~has_kerning
+        self.kerned_masters = present.sum(axis=1)
+
+        self.outlier = outlier_mask(abs_values, outlier_factor)
+        report = OutlierReport(values, present, robust_method)
+        self.outlier_master = report.master
+        self.outlier_score = report.score
+        self.outlier_deviation = report.deviation
+        interpolation = InterpolationReport(values, present, master_positions)
+        self.interpolation_master = interpolation.master
+        self.interpolation_error = interpolation.error
+        self.reversals = interpolation.reversals
+
+        self.single = numpy.fromiter(
+            (not any(side.startswith('public') for side in pair)
+                for pair in pairs),
+            dtype=bool, count=len(pairs))
+
+    @classmethod
+    def from_matrix(
+        cls, kern_matrix, outlier_factor=4, robust_method='mad',
+        master_positions=None
+    ):
+        return cls(
+            kern_matrix.values, kern_matrix.present, kern_matrix.pairs,
+            outlier_factor, robust_method, master_positions)
+
+    def update_row(
+        self, kern_matrix, pair_index, outlier_factor=4, robust_method='mad',
+        master_positions=None
+    ):
+        '''
+        Recomputes the statistics of a single pair.
+        '''
+        row = slice(pair_index, pair_index + 1)
+        row_stats = PairStats(
+            kern_matrix.values[row], kern_matrix.present[row],
+            kern_matrix.pairs[row], outlier_factor, robust_method,
+            master_positions)
+        for name in self.names:
+            getattr(self, name)[pair_index] = getattr(row_stats, name)[0]
+
+    def update_rows(
+        self, kern_matrix, pair_indices, outlier_factor=4, robust_method='mad',
+        master_positions=None
+    ):
+        '''
+        Recomputes the statistics of a number of pairs at once.
+        '''
+        rows_stats = PairStats(
+            kern_matrix.values[pair_indices],
+            kern_matrix.present[pair_indices],
+            [kern_matrix.pairs[i] for i in pair_indices.tolist()],
+            outlier_factor, robust_method, master_positions)
+        for name in self.names:
+            getattr(self, name)[pair_indices] = getattr(rows_stats, name)
+
+
+class FilterEngine(object):
+    '''
+    Computes the memberships of all list filters for a KernMatrix.
+    Memberships are index arrays into the matrix' pairs, in the
+    order in which the filter presents them.
+
+    Filters can be computed one by one (compute_filter), for instance
+    by a FilterWorker in the background. Changes to the matrix should
+    be made through set_value(), which holds the engine's lock and
+    brings statistics and memberships up to date without recomputing
+    the whole family (see update_pair).
+
+    Exceptions are found using the groups of *fonts*, or *master_groups*
+    (a list of group dicts) for matrices keyed by other groups.
+    Robust outliers are pairs with an outlier_score (by *robust_method*)
+    above *robust_threshold*, most severe first. Uneven interpolation
+    lists the pairs changing direction along *master_positions* (the
+    masters' axis locations, evenly spaced if None) with an interpolation
+    error of at least *interpolation_tolerance* units, largest first.
+    '''
+
+    def __init__(
+        self, kern_matrix, fonts=None, outlier_factor=4,
+        small_average_value=5, largest_amount=200, gamut_amount=100,
+        master_groups=None, ranking_metric='spread', ranking_amount=100,
+        robust_threshold=DEFAULT_THRESHOLD, robust_method='mad',
+        interpolation_tolerance=DEFAULT_TOLERANCE, master_positions=None
+    ):
+        self.kern_matrix = kern_matrix
+        self.fonts = fonts
+        if master_groups is None and fonts is not None:
+            master_groups = [font.groups for font in fonts]
+        self.master_groups = master_groups
+        self.outlier_factor = outlier_factor
+        self.small_average_value = small_average_value
+        self.robust_threshold = robust_threshold
+        self.robust_method = robust_method
+        self.interpolation_tolerance = interpolation_tolerance
+        self.master_positions = master_positions
+        self.largest_amount = largest_amount
+        self.gamut_amount = gamut_amount
+        self.ranking_metric = ranking_metric
+        self.ranking_amount = ranking_amount
+        self.ranking_label = RANKING_METRICS[ranking_metric][2]
+        self.keys = [key for key, _ in FILTERS]
+        self.lock = threading.RLock()
+        self._compute_locks = {
+            'stats': threading.Lock(), 'exception': threading.Lock()}
+        self.stats = None
+        self.exception_indexes = None
+        self.masks = {
+            'all': numpy.ones(len(kern_matrix), dtype=bool)}
+        self._members = {}
+        self._thresholds = {}
+        self._exception_present = None
+        # advances whenever values or the ranking change
+        self.version = 0
+        # called with the indices of edited pairs, holding the lock
+        self.row_listeners = []
+
+    def compute(self):
+        '''
+        Computes the statistics and every filter membership.
+        '''
+        for key in self.keys:
+            self.compute_filter(key)
+        return self.members()
+
+    def compute_filter(self, key):
+        '''
+        Computes a single filter (and whatever it depends on). If another
+        thread is already computing it, waits for that computation.
+        '''
+        if key == 'exception':
+            with self._compute_locks['exception']:
+                if self.exception_indexes is None:
+                    self._compute_exceptions()
+        elif key != 'all':
+            with self._compute_locks['stats']:
+                if self.stats is None:
+                    self._compute_stats()
+        return self.membership(key)
+
+    def is_ready(self, key):
+        if key == 'all':
+            return True
+        if key == 'exception':
+            return self.exception_indexes is not None
+        return self.stats is not None
+
+    def _compute_stats(self):
+        '''
+        Statistics are computed from a snapshot of the matrix, without
+        holding the lock. Pairs edited meanwhile are updated afterwards.
+        '''
+        with self.lock:
+            values = self.kern_matrix.values.copy()
+            present = self.kern_matrix.present.copy()
+        stats = PairStats(
+            values, present, self.kern_matrix.pairs, self.outlier_factor,
+            self.robust_method, self.master_positions)
+        with self.lock:
+            self.stats = stats
+            for key in STAT_FILTERS:
+                # copied, as some masks are views of the statistics
+                self.masks[key] = numpy.array(self._row_mask(key))
+            edited = (
+                (values != self.kern_matrix.values) |
+                (present != self.kern_matrix.present)).any(axis=1)
+            for pair_index in numpy.flatnonzero(edited).tolist():
+                self._update_stats(pair_index)
+
+    def _compute_exceptions(self):
+        '''
+        Exceptions are indexed from the matrix (rather than the fonts'
+        kerning), so they stay in sync with edits made through it.
+        Like the statistics, they are computed from a snapshot.
+        '''
+        pairs = self.kern_matrix.pairs
+        with self.lock:
+            present = self.kern_matrix.present.copy()
+        exception_indexes = []
+        for f_index, groups in enumerate(self.master_groups or []):
+            kerned_pairs = [
+                pairs[i] for i in
+                numpy.flatnonzero(present[:, f_index]).tolist()]
+            exception_indexes.append(ExceptionIndex(kerned_pairs, groups))
+        with self.lock:
+            self.exception_indexes = exception_indexes
+            self._exception_present = present
+            self.masks['exception'] = numpy.zeros(len(pairs), dtype=bool)
+            for exception_index in self.exception_indexes:
+                self._update_exception_mask(exception_index.base)
+            edited = (present != self.kern_matrix.present).any(axis=1)
+            for pair_index in numpy.flatnonzero(edited).tolist():
+                self._update_exceptions(pair_index)
+
+    def _row_mask(self, key, rows=slice(None)):
+        stats = self.stats
+        if key == 'single':
+            return stats.single[rows]
+        if key == 'same_value':
+            return stats.all_equal[rows]
+        if key == 'zero_value':
+            return stats.all_zero[rows]
+        if key == 'partial':
+            kerned_masters = stats.kerned_masters[rows]
+            return (kerned_masters > 0) & (
+                kerned_masters < self.kern_matrix.master_count)
+        if key == 'outlier':
+            return stats.outlier[rows]
+        if key == 'robust_outlier':
+            return stats.outlier_score[rows] > self.robust_threshold
+        if key == 'interpolation':
+            return (stats.reversals[rows] > 0) & (
+                stats.interpolation_error[rows] >=
+                self.interpolation_tolerance)
+        if key == 'small_average':
+            return stats.abs_mean[rows] < self.small_average_value
+
+    def _update_exception_mask(self, pairs):
+        index = self.kern_matrix.index
+        mask = self.masks['exception']
+        for pair in pairs:
+            pair_index = index.get(pair)
+            if pair_index is not None:
+                mask[pair_index] = any(
+                    pair in exception_index for
+                    exception_index in self.exception_indexes)
+
+    def membership(self, key):
+        '''
+        Index array of the pairs in a filter, which is computed
+        first if needed.
+        '''
+        if not self.is_ready(key):
+            return self.compute_filter(key)
+        with self.lock:
+            if key not in self._members:
+                if key == 'largest_value':
+                    members = largest_value_indices(
+                        self.stats, self.largest_amount)
+                elif key in RANKED_FILTERS:
+                    members = rank_pairs(self.stats, *self._ranking(key))
+                else:
+                    members = numpy.flatnonzero(self.masks[key])
+                if key in SCORED_FILTERS:
+                    scores = getattr(self.stats, SCORED_FILTERS[key])
+                    members = members[numpy.argsort(
+                        -scores[members], kind='mergesort')]
+                if key in RANKED_FILTERS:
+                    self._thresholds[key] = self._ranking_thresholds(
+                        key, members)
+                self._members[key] = members
+            return self._members[key]
+
+    def members(self):
+        return {key: self.membership(key) for key in self.keys}
+
+    def ranking(self, metric, amount):
+        '''
+        Exactly *amount* pairs ranking highest by *metric* (a key of
+        RANKING_METRICS), as an index array. Computed from the
+        statistics by partial selection, so this is cheap to repeat.
+        '''
+        self.compute_filter('single')
+        with self.lock:
+            return rank_pairs(self.stats, metric, amount)
+
+    def set_ranking(self, metric=None, amount=None):
+        '''
+        Changes metric and/or amount of the 'ranking' filter.
+        Returns the change set.
+        '''
+        with self.lock:
+            if metric is not None:
+                self.ranking_metric = metric
+                self.ranking_label = RANKING_METRICS[metric][2]
+            if amount is not None:
+                self.ranking_amount = amount
+            self._members.pop('ranking', None)
+            self._thresholds.pop('ranking', None)
+            self.version += 1
+        return {'ranking': []}
+
+    def _ranking(self, key):
+        '''
+        Metric and amount of a ranked filter with a single metric.
+        '''
+        if key == 'high_gamut':
+            return 'gamut', self.gamut_amount
+        return self.ranking_metric, self.ranking_amount
+
+    def _ranking_thresholds(self, key, members):
+        '''
+        Scores a non-member has to reach to enter a ranked filter
+        (None for parts which take no pairs). If every pair is a member,
+        any change may reorder the filter.
+        '''
+        stats = self.stats
+        if len(members) == len(self.kern_matrix) or not len(members):
+            return None
+        if key == 'largest_value':
+            half = self.largest_amount // 2
+            return tuple(
+                _metric_scores(stats, metric)[pick].min() if
+                len(pick) else None for
+                metric, pick in (('max', members[:half]),
+                    ('min', members[half:])))
+        metric, _ = self._ranking(key)
+        return _metric_scores(stats, metric)[members].min()
+
+    def _ranking_affected(self, key, pair_index, old_stats):
+        '''
+        Whether a change to a pair can alter a ranked filter. Pairs
+        which were and remain below the ranking's threshold do not.
+        '''
+        members = self._members.get(key)
+        threshold = self._thresholds.get(key)
+        if members is None:
+            return False
+        if threshold is None or pair_index in members:
+            return True
+        if key == 'largest_value':
+            metric_thresholds = zip(('max', 'min'), threshold)
+        else:
+            metric_thresholds = [(self._ranking(key)[0], threshold)]
+        for metric, metric_threshold in metric_thresholds:
+            if metric_threshold is None:
+                continue
+            attribute, ascending, _ = RANKING_METRICS[metric]
+            scores = [
+                old_stats[attribute],
+                getattr(self.stats, attribute)[pair_index]]
+            if ascending:
+                scores = [-score for score in scores]
+            if max(scores) >= metric_threshold:
+                return True
+        return False
+
+    def set_value(self, pair, master_index, value):
+        '''
+        Changes a value in the matrix and updates the filters.
+        Returns the change set (see update_pair).
+        '''
+        with self.lock:
+            self.kern_matrix.set_value(pair, master_index, value)
+            return self.update_pair(self.kern_matrix.index[pair])
+
+    def set_rows(self, pair_indices, values, present):
+        '''
+        Replaces the values of a number of pairs (all masters) and
+        updates the filters in one vectorized pass. Returns the change
+        set; ranked filters which have been computed are listed with
+        all edited pairs.
+        '''
+        pair_indices = numpy.asarray(pair_indices, dtype=numpy.intp)
+        with self.lock:
+            kern_matrix = self.kern_matrix
+            kern_matrix.values[pair_indices] = values
+            kern_matrix.present[pair_indices] = present
+            self.version += 1
+            for listener in self.row_listeners:
+                listener(pair_indices)
+            changes = {}
+            if self.stats is not None and len(pair_indices):
+                self.stats.update_rows(
+                    kern_matrix, pair_indices, self.outlier_factor,
+                    self.robust_method, self.master_positions)
+                for key in STAT_FILTERS:
+                    mask = self.masks[key]
+                    is_member = numpy.array(self._row_mask(key, pair_indices))
+                    changed = mask[pair_indices] != is_member
+                    if key in SCORED_FILTERS:
+                        # edited members may change places
+                        changed |= is_member
+                    changed = pair_indices[changed]
+                    mask[pair_indices] = is_member
+                    if len(changed):
+                        changes[key] = changed.tolist()
+                for key in RANKED_FILTERS:
+                    if key in self._members:
+                        changes[key] = pair_indices.tolist()
+            if self.exception_indexes is not None:
+                presence_changed = pair_indices[(
+                    kern_matrix.present[pair_indices] !=
+                    self._exception_present[pair_indices]).any(axis=1)]
+                for pair_index in presence_changed.tolist():
+                    for key, affected in self._update_exceptions(
+                        pair_index
+                    ).items():
+                        changes.setdefault(key, []).extend(affected)
+            for key in changes:
+                self._members.pop(key, None)
+            return changes
+
+    def update_pair(self, pair_index):
+        '''
+        Updates statistics and memberships of a single pair after its
+        values have changed in the matrix, in O(masters). Only if a
+        pair appears in or disappears from a master, the font's
+        exceptions overriding it are looked at as well.
+
+        Returns the change set: a dict mapping the keys of all filters
+        whose membership changed to the indices of the pairs affected.
+        Ranked filters are listed with the edited pair, and re-ranked
+        on their next access. Filters which have not been computed yet
+        are not reported.
+        '''
+        with self.lock:
+            self.version += 1
+            for listener in self.row_listeners:
+                listener([pair_index])
+            changes = {}
+            if self.stats is not None:
+                changes.update(self._update_stats(pair_index))
+            if self.exception_indexes is not None:
+                changes.update(self._update_exceptions(pair_index))
+            for key in changes:
+                self._members.pop(key, None)
+            return changes
+
+    def _update_stats(self, pair_index):
+        changes = {}
+        old_stats = {
+            attribute: getattr(self.stats, attribute)[pair_index]
+            for attribute, _, _ in RANKING_METRICS.values()}
+        self.stats.update_row(
+            self.kern_matrix, pair_index, self.outlier_factor,
+            self.robust_method, self.master_positions)
+        for key in STAT_FILTERS:
+            mask = self.masks[key]
+            is_member = self._row_mask(key, pair_index)
+            if mask[pair_index] != is_member or (
+                key in SCORED_FILTERS and is_member
+            ):
+                mask[pair_index] = is_member
+                changes[key] = [pair_index]
+
+        for key in RANKED_FILTERS:
+            if self._ranking_affected(key, pair_index, old_stats):
+                changes[key] = [pair_index]
+        return changes
+
+    def _update_exceptions(self, pair_index):
+        '''
+        A pair appearing in or disappearing from a font
+        may change the font's exceptions.
+        '''
+        pair = self.kern_matrix.pairs[pair_index]
+        present = self.kern_matrix.present[pair_index]
+        affected = set()
+        for f_index in numpy.flatnonzero(
+            present != self._exception_present[pair_index]
+        ).tolist():
+            exception_index = self.exception_indexes[f_index]
+            if present[f_index]:
+                affected.update(exception_index.add_pair(pair))
+            else:
+                affected.update(exception_index.remove_pair(pair))
+        self._exception_present[pair_index] = present
+        if not affected:
+            return {}
+        mask = self.masks['exception']
+        before = mask.copy()
+        self._update_exception_mask(affected)
+        changed = numpy.flatnonzero(before != mask)
+        if len(changed):
+            return {'exception': changed.tolist()}
+        return {}
+
+    def pair_list(self, key):
+        pairs = self.kern_matrix.pairs
+        return [pairs[i] for i in self.membership(key).tolist()]
+
+    def label(self, key):
+        '''
+        Popup label of a filter. Filters which have not been
+        computed yet show an ellipsis instead of their count.
+        '''
+        template = dict(FILTERS)[key].format(**vars(self))
+        if not self.is_ready(key):
+            return '{} (...)'.format(template)
+        members = self._members.get(key)
+        if members is None:
+            members = self.membership(key)
+        return '{} ({})'.format(template, len(members))
+
+
+class FilterWorker(threading.Thread):
+    '''
+    Computes the filters of a FilterEngine in the background, the
+    slowest ones first. *callback* is called with each filter key as
+    soon as the filter is ready (on the worker thread).
+    '''
+
+    priority = ['exception', 'outlier']
+
+    def __init__(self, engine, callback):
+        super(FilterWorker, self).__init__()
+        self.daemon = True
+        self.engine = engine
+        self.callback = callback
+        self._stopped = threading.Event()
+
+    def run(self):
+        keys = self.priority + [
+            key for key in self.engine.keys if key not in self.priority]
+        for key in keys:
+            if self._stopped.is_set():
+                return
+            self.engine.compute_filter(key)
+            self.callback(key)
+
+    def stop(self):
+        self._stopped.set()
+
+
+def _metric_scores(stats, metric):
+    '''
+    Scores by which a metric ranks pairs, highest first.
+    '''
+    attribute, ascending, _ = RANKING_METRICS[metric]
+    scores = getattr(stats, attribute).astype(numpy.float64)
+    return -scores if ascending else scores
+
+
+def top_k(scores, k, exclude=None):
+    '''
+    Indices of the *k* highest scores, highest first, ties broken by
+    index. Uses partial selection (numpy.partition), so only the k
+    selected scores are sorted. Pairs flagged in *exclude* are skipped.
+    '''
+    if exclude is None:
+        candidates = numpy.arange(len(scores))
+    else:
+        candidates = numpy.flatnonzero(~exclude)
+    k = max(min(k, len(candidates)), 0)
+    if not k:
+        return candidates[:0]
+    candidate_scores = scores[candidates]
+    if k < len(candidates):
+        kth_index = len(candidates) - k
+        kth_score = numpy.partition(candidate_scores, kth_index)[kth_index]
+        above = numpy.flatnonzero(candidate_scores > kth_score)
+        tied = numpy.flatnonzero(
+            candidate_scores == kth_score)[:k - len(above)]
+        picked = numpy.concatenate([above, tied])
+        candidates = candidates[picked]
+        candidate_scores = candidate_scores[picked]
+    return candidates[numpy.lexsort((candidates, -candidate_scores))]
+
+
+def rank_pairs(stats, metric, k, exclude=None):
+    '''
+    Indices of exactly *k* pairs (or all pairs, if there are fewer)
+    ranking highest by a metric of RANKING_METRICS.
+    '''
+    return top_k(_metric_scores(stats, metric), k, exclude)
+
+
+def largest_value_indices(stats, amount):
+    '''
+    Pairs kerned by the largest distance: half of *amount* with the
+    largest maximum, followed by those with the smallest minimum.
+    '''
+    max_pick = rank_pairs(stats, 'max', amount // 2)
+    exclude = numpy.zeros(len(stats.maximum), dtype=bool)
+    exclude[max_pick] = True
+    min_pick = rank_pairs(stats, 'min', amount - len(max_pick), exclude)
+    return numpy.concatenate([max_pick, min_pick])
@@ -3,14 +3,45 @@ from __future__ import print_function
 from mojo.glyphPreview import GlyphPreview
 import AppKit, Foundation
 import math
+import numpy
 import vanilla
 import mojo.drawingTools as drawBot
 from mojo.canvas import Canvas
+from mojo.UI import Message
 from pprint import pprint
+from PyObjCTools.AppHelper import callAfter
 import importlib
 
+import kernMatrix
+importlib.reload(kernMatrix)
 import kerningHelper
 importlib.reload(kerningHelper)
+import interpolationCheck
+importlib.reload(interpolationCheck)
+import kernFilters
+importlib.reload(kernFilters)
+import reprCache
+importlib.reload(reprCache)
+import outlineCache
+importlib.reload(outlineCache)
+import pairPrefetch
+importlib.reload(pairPrefetch)
+import pairRows
+importlib.reload(pairRows)
+import pairTable
+importlib.reload(pairTable)
+import searchIndex
+importlib.reload(searchIndex)
+import presencePatterns
+importlib.reload(presencePatterns)
+import profileIndex
+importlib.reload(profileIndex)
+import pairQuery
+importlib.reload(pairQuery)
+import batchEdit
+importlib.reload(batchEdit)
+import editJournal
+importlib.reload(editJournal)
 import pairView
 importlib.reload(pairView)
 from pairView import DrawPair
@@ -154,6 +185,8 @@ class CanvasDelegate(object):
                 self.drag_index, self.parent.pair, new_kern_value)
 
     def mouseDown(self, event):
+        # a drag is undone as a whole
+        self.parent.journal.begin()
         # find point closest to mouse pointer
         mx, my = event.locationInWindow()
         distances = []
@@ -174,12 +207,75 @@ class CanvasDelegate(object):
                 self.drag_index, self.parent.pair, None)
             self.parent.w.c.update()
 
+    def mouseUp(self, event):
+        self.parent.write_back.flush()
+        self.parent.journal.end()
+        self.parent.flush_changes()
+
+
+def _format_values(values):
+    return ' '.join('-' if value is None else str(value) for value in values)
+
+
+class SmoothSheet(object):
+    '''
+    Lists the values smoothing would give a number of pairs. They are
+    only written (through the parent's apply_batch) on Apply.
+    '''
+    max_rows = 1000
+
+    def __init__(self, parent, pair_indices, proposal):
+        self.parent = parent
+        self.pair_indices = pair_indices
+        kern_matrix = parent.kern_matrix
+        rows = []
+        for pair_index, new_values in zip(
+            pair_indices[:self.max_rows].tolist(),
+            proposal[:self.max_rows].tolist()
+        ):
+            left, right = kern_matrix.pairs[pair_index]
+            values = kern_matrix.row(pair_index)
+            rows.append({
+                'L': left, 'R': right,
+                'Values': _format_values(values),
+                'Proposal': _format_values([
+                    None if old is None else new for
+                    new, old in zip(new_values, values)])})
+        message = 'Smoothing changes {} pair(s)'.format(len(pair_indices))
+        if len(pair_indices) > self.max_rows:
+            message += ' (the first {} are listed)'.format(self.max_rows)
+
+        self.w = vanilla.Sheet((560, 400), parent.w)
+        self.w.message = vanilla.TextBox((10, 10, -10, 20), message)
+        self.w.proposal = vanilla.List(
+            (10, 40, -10, -50), rows,
+            columnDescriptions=[
+                {'title': title, 'key': title} for
+                title in ['L', 'R', 'Values', 'Proposal']])
+        self.w.cancel = vanilla.Button(
+            (-230, -35, 100, 20), 'Cancel', callback=self.cancel_callback)
+        self.w.apply = vanilla.Button(
+            (-120, -35, 110, 20), 'Apply', callback=self.apply_callback)
+        self.w.setDefaultButton(self.w.apply)
+        self.w.open()
+
+    def cancel_callback(self, sender):
+        self.w.close()
+
+    def apply_callback(self, sender):
+        self.w.close()
+        pair_count = self.parent.apply_batch('smooth', self.pair_indices)
+        print('Smoothing {} pair(s) along the masters'.format(pair_count))
+
 
 class FlexibleWindow(object):
 
     min_w_height = 800
     button_width = 150
     padding = 10
+    # seconds between writes to the fonts while dragging a slider
+    # (None: only on mouse up)
+    write_back_interval = None
 
     def __init__(self, fonts):
 
@@ -198,20 +294,41 @@ class FlexibleWindow(object):
         self.list_pos = self.p_point_pos + 40
         
         self.min_w_width = len(self.fonts) * self.min_unit_width
-        # cmb_kern_dict is an ordered dict
-        self.cmb_kern_dict = kerningHelper.get_combined_kern_dict(fonts)
-        self.pair_list = list(self.cmb_kern_dict.keys())
-        self.filtered_pairlists = self.make_filtered_pairlists(
-            self.cmb_kern_dict)
+        # kern_matrix is sorted by pair, like the former combined dict
+        self.kern_matrix = kerningHelper.get_kern_matrix(fonts)
+        self.search_index = kerningHelper.get_search_index(
+            fonts, self.kern_matrix)
+        # pairs kerned alike across the masters
+        self.profile_index = kerningHelper.get_profile_index(
+            self.kern_matrix)
+        # rows of the list, produced as they are shown
+        self.pair_list = pairRows.PairRows(
+            self.kern_matrix, groups=fonts[0].groups,
+            stats=lambda: self.filter_engine.stats)
+        self.group_index = kerningHelper.get_group_index(fonts)
+        self.warn_group_differences()
+        self.repr_caches = [reprCache.ReprGlyphCache(f) for f in fonts]
+        for repr_cache in self.repr_caches:
+            repr_cache.observe()
+        self.outline_cache = outlineCache.OutlineCache()
+        for f_index, f in enumerate(fonts):
+            self.outline_cache.observe(f_index, f)
+        self.prefetcher = pairPrefetch.PairPrefetcher(
+            fonts, self.repr_caches, self.outline_cache)
+        self.make_filtered_pairlists(self.kern_matrix)
 
         # initial value for the first pair to show
         initial_pair = self.pair_list[0]
         self.pair = initial_pair
-        initial_value = self.cmb_kern_dict[initial_pair]
+        initial_value = self.kern_matrix[initial_pair]
         self.values = initial_value
         self.steps = len(self.values)
         self.update_display(self.values)
         self.drag_index = None
+        # set while the list is refilled in place
+        self.refreshing = False
+        # filters changed by a gesture, updated on mouse up
+        self.pending_changes = set()
 
         self.w = vanilla.Window(
             (self.min_w_width, self.min_w_height),
@@ -239,9 +356,13 @@ class FlexibleWindow(object):
             ('Average Pairs', 'average_button_callback'),
             ('Equalize Pairs', 'transfer_button_callback'),
             ('Interpolate Pair', 'interpolate_button_callback'),
+            ('Smooth Pairs...', 'smooth_button_callback'),
             # ('Transfer Pair', 'transfer_button_callback'),
             ('+10', 'plus_button_callback'),
             ('-10', 'minus_button_callback'),
+            ('Similar Pairs', 'similar_button_callback'),
+            ('Undo', 'undo_button_callback'),
+            ('Redo', 'redo_button_callback'),
             # ('+10%', 'dummy_button_callback'),
             # ('-10%', 'dummy_button_callback'),
         ]
@@ -250,16 +371,21 @@ class FlexibleWindow(object):
         # list starts at 210 and has 10 padding at bottom
         # total whitespace: 200 height - 8 * 20 = 40
         # individual_whitespace = 40 / (len(buttons) - 1)
-        button_height = 20
-        button_space = len(buttons) * button_height
+        # the last row holds the Whole List checkbox
+        # rows get smaller buttons once the regular ones do not fit
+        button_height = min(
+            20, (abs(button_top) - self.padding) // (len(buttons) + 1))
+        button_size = 'regular' if button_height >= 20 else 'small'
+        button_space = (len(buttons) + 1) * button_height
         button_whitespace = (abs(button_top) - self.padding) - button_space
-        button_step_space = button_whitespace / (len(buttons) - 1)
+        button_step_space = button_whitespace / len(buttons)
         for i, (b_label, b_callback_name) in enumerate(buttons):
             button = vanilla.Button((
                 -(self.padding + self.button_width),
                 button_top + i * button_height,
                 self.button_width, button_height), b_label,
-                callback=getattr(self, b_callback_name)
+                callback=getattr(self, b_callback_name),
+                sizeStyle=button_size
             )
             setattr(
                 self.w,
@@ -267,6 +393,11 @@ class FlexibleWindow(object):
                 button)
             # button_top += self.padding / 2
             button_top += button_step_space
+        # edit every pair of the list, rather than the selected ones
+        self.w.whole_list = vanilla.CheckBox((
+            -(self.padding + self.button_width),
+            button_top + len(buttons) * button_height,
+            self.button_width, button_height), 'Whole List')
         try:
             # graph labels with monospaced digits
             nsfont = AppKit.NSFont.monospacedDigitSystemFontOfSize_weight_(14, 0.0)
@@ -280,14 +411,15 @@ class FlexibleWindow(object):
         )
         for f_index, f in enumerate(self.fonts):
             x = self.step_dist * f_index
-            pair_preview = DrawPair((x, 0, self.step_dist, -0))
+            pair_preview = DrawPair(
+                (x, 0, self.step_dist, -0), self.outline_cache, f_index)
 
             initial_pair = self.pair_list[0]
-            kern_value = self.cmb_kern_dict.get(initial_pair)[f_index]
+            kern_value = self.kern_matrix.get(initial_pair)[f_index]
             if kern_value is None:
                 kern_value = 0
 
-            repr_pair = kerningHelper.get_repr_pair(f, initial_pair)
+            repr_pair = self.repr_caches[f_index].repr_pair(initial_pair)
             if repr_pair is not None:
                 # XXXX the following line is problematic
                 # if UFOs with different group structures are opened
@@ -304,101 +436,146 @@ class FlexibleWindow(object):
 
         # pop-up button for list filtering
 
+        search_width = 180
         self.w.list_filter = vanilla.PopUpButton(
-            (10, self.list_pos - 30, -self.padding, 20),
+            (10, self.list_pos - 30,
+                -(self.padding + self.button_width + self.padding +
+                    search_width + self.padding), 20),
             self.filter_options,
             callback=self.filter_callback
         )
+        # narrows the list by a query, e.g. 'gamut > 40 AND left:T'
+        self.w.search = vanilla.SearchBox(
+            (-(self.padding + self.button_width + self.padding +
+                search_width), self.list_pos - 31, search_width, 22),
+            placeholder='Search Pairs',
+            callback=self.search_callback
+        )
+
+        # metric and amount of the Top ... filter
+        ranking_metrics = list(kernFilters.RANKING_METRICS)
+        self.w.ranking_metric = vanilla.PopUpButton(
+            (-(self.padding + self.button_width), self.list_pos - 30,
+                self.button_width - 50, 20),
+            [label for _, _, label in kernFilters.RANKING_METRICS.values()],
+            callback=self.ranking_callback
+        )
+        self.w.ranking_metric.set(
+            ranking_metrics.index(self.filter_engine.ranking_metric))
+        self.w.ranking_amount = vanilla.EditText(
+            (-(self.padding + 45), self.list_pos - 30, 45, 20),
+            str(self.filter_engine.ranking_amount),
+            callback=self.ranking_callback
+        )
 
         # list of kerning pairs (bottom)
-        column_pairs = self.make_columns(self.pair_list)
-        self.w.display_list = vanilla.List(
+        self.w.display_list = pairTable.PairTable(
             (10, self.list_pos, -(self.padding + self.button_width + self.padding), -10),
-            column_pairs,
+            self.pair_list,
             columnDescriptions=[{'title': 'L'}, {'title': 'R'}],
-            allowsMultipleSelection=False,
+            allowsMultipleSelection=True,
             selectionCallback=self.list_callback)
 
         self.w.bind('resize', self.resize_callback)
+        self.w.bind('close', self.close_callback)
         self.w.open()
 
-    def make_filtered_pairlists(self, cmb_kern_dict):
+        self.filter_worker = kernFilters.FilterWorker(
+            self.filter_engine, self.filter_ready_callback)
+        self.filter_worker.start()
+        self.prefetcher.start()
+
+    def warn_group_differences(self):
+        '''
+        Pairs are compared by name, which is misleading where
+        the masters' groups differ.
         '''
-        Creates the filtered lists for selection in popup button
+        for change in self.group_index.changes:
+            print('Warning: {} {} group(s) {} in master {}: {}'.format(
+                change.side, change.kind,
+                ', '.join(change.reference_groups) or '-',
+                change.master_index, ', '.join(change.groups) or '-'))
+        for m_index, duplicates in enumerate(self.group_index.duplicates):
+            for side, glyph_groups in sorted(duplicates.items()):
+                for glyph_name, group_names in sorted(glyph_groups.items()):
+                    print('Warning: {} is in several {} groups '
+                        'in master {}: {}'.format(
+                            glyph_name, side, m_index,
+                            ', '.join(group_names)))
+
+    def make_filtered_pairlists(self, kern_matrix):
+        '''
+        Sets up the filter engine, which keeps the filtered lists
+        for selection in popup button. Apart from All Pairs, the lists
+        are computed by a background worker once the window is open.
         '''
-        filter_lists = []
-        self.filter_options = []
         small_average_value = 5
         outlier_factor = 5
 
-        all_pairs = list(cmb_kern_dict.keys())
-        filter_lists.append(all_pairs)
-        self.filter_options.append(
-            'All Pairs ({})'.format(len(all_pairs)))
-
-        single_pair_dict = kerningHelper.single_pair_dict(
-            self.cmb_kern_dict)
-        filter_lists.append(list(single_pair_dict.keys()))
-        self.filter_options.append(
-            'Single Pairs ({})'.format(len(single_pair_dict)))
-
-        same_value_dict = kerningHelper.same_value_dict(
-            cmb_kern_dict)
-        filter_lists.append(list(same_value_dict.keys()))
-        self.filter_options.append(
-            'Same Value Across all Masters ({})'.format(len(same_value_dict)))
-
-        zero_value_dict = kerningHelper.zero_value_dict(
-            self.cmb_kern_dict)
-        filter_lists.append(list(zero_value_dict.keys()))
-        self.filter_options.append(
-            'Zero-Value Pairs ({})'.format(len(zero_value_dict)))
-
-        largest_value_dict = kerningHelper.largest_value_dict(
-            self.cmb_kern_dict)
-        filter_lists.append(list(largest_value_dict.keys()))
-        self.filter_options.append(
-            'Long-Distance Kerning Pairs ({})'.format(len(largest_value_dict)))
-
-        high_gamut_dict = kerningHelper.high_gamut_dict(
-            self.cmb_kern_dict)
-        filter_lists.append(list(high_gamut_dict.keys()))
-        self.filter_options.append(
-            'High Gamut Across Pairs ({})'.format(len(high_gamut_dict)))
-
-        outlier_dict = kerningHelper.outlier_dict(
-            self.cmb_kern_dict, outlier_factor)
-        filter_lists.append(list(outlier_dict.keys()))
-        self.filter_options.append(
-            'Outliers by a Factor of {} ({})'.format(
-                outlier_factor, len(outlier_dict)))
-
-        exception_dict = kerningHelper.exception_dict(
-            self.fonts, self.cmb_kern_dict)
-        filter_lists.append(list(exception_dict.keys()))
-        self.filter_options.append(
-            'Exceptions ({})'.format(len(exception_dict)))
-
-        small_average_dict = kerningHelper.small_average_dict(
-            self.cmb_kern_dict, small_average_value)
-        filter_lists.append(list(small_average_dict.keys()))
-        self.filter_options.append(
-            'Average Kern Distance < {} ({})'.format(
-                small_average_value, len(small_average_dict)))
-
-        # self.filter_options.append(
-        #     'Zero Test ({})'.format(len([])))
-
-        return filter_lists
-
-    def make_columns(self, pair_list):
-        column_pairs = []
-        for left, right in [pair for pair in pair_list]:
-            pair_dict = {}
-            pair_dict['L'] = left
-            pair_dict['R'] = right
-            column_pairs.append(pair_dict)
-        return column_pairs
+        self.filter_engine = kernFilters.FilterEngine(
+            kern_matrix, self.fonts,
+            outlier_factor=outlier_factor,
+            small_average_value=small_average_value,
+            master_positions=interpolationCheck.master_positions(self.fonts))
+        self.journal = editJournal.EditJournal(
+            kern_matrix.pairs, editJournal.journal_path(self.fonts))
+        self.batch_editor = batchEdit.BatchEditor(
+            self.filter_engine, self.fonts, journal=self.journal,
+            search_index=self.search_index,
+            profile_index=self.profile_index)
+        self.write_back = batchEdit.WriteBack(
+            self.fonts, self.write_back_interval)
+        self.filter_options = [
+            self.filter_engine.label(key) for key in self.filter_engine.keys]
+
+    def filter_ready_callback(self, key):
+        # called on the worker thread
+        callAfter(self.update_filter_labels, [key])
+
+    def update_filter_labels(self, changes):
+        '''
+        Refreshes the popup labels of the filters in a change set,
+        and the list if the selected filter is among them.
+        '''
+        for key in changes:
+            self.filter_options[self.filter_engine.keys.index(key)] = (
+                self.filter_engine.label(key))
+        sel_index = self.w.list_filter.get()
+        self.w.list_filter.setItems(self.filter_options)
+        self.w.list_filter.set(sel_index)
+        if self.filter_engine.keys[sel_index] in changes:
+            self.refresh_list()
+
+    def refresh_list(self):
+        '''
+        Refills the list with the pairs of the selected filter, keeping
+        the selected pairs which are still listed selected. The pair
+        shown stays, even if it left the list.
+        '''
+        selected = [
+            self.pair_list.pair_index(sel_index) for
+            sel_index in self.w.display_list.getSelection()]
+        self.pair_list.set_indices(self.filtered_pair_indices())
+        rows = numpy.flatnonzero(
+            numpy.isin(self.pair_list.pair_indices, selected))
+        self.refreshing = True
+        try:
+            self.w.display_list.set(self.pair_list)
+            self.w.display_list.setSelection(rows.tolist())
+        finally:
+            self.refreshing = False
+
+    def ranking_callback(self, sender):
+        metric = list(kernFilters.RANKING_METRICS)[
+            self.w.ranking_metric.get()]
+        try:
+            amount = int(self.w.ranking_amount.get())
+        except ValueError:
+            return
+        changes = self.filter_engine.set_ranking(metric, amount)
+        self.update_filter_labels(changes)
+        if self.filter_engine.keys[self.w.list_filter.get()] == 'ranking':
+            self.filter_callback(self.w.list_filter)
 
     def update_display(self, value_list):
         self.label_values = [
@@ -409,12 +586,27 @@ class FlexibleWindow(object):
         ]
 
     def update_kerning(self, font_index, pair, value):
-        font = self.fonts[font_index]
-        if value is None:
-            if pair in font.kerning.keys():
-                del font.kerning[pair]
-        else:
-            font.kerning[pair] = value
+        '''
+        Changes a value in the model right away. The font, the filter
+        labels and the list follow on mouse up (see flush_changes).
+        '''
+        pair_index = self.kern_matrix.index[pair]
+        old_value = self.kern_matrix.row(pair_index)[font_index]
+        changes = self.filter_engine.set_value(pair, font_index, value)
+        self.journal.record(pair_index, font_index, old_value, value)
+        self.pending_changes.update(changes)
+        if value is not None:
+            value = self.kern_matrix.font_value(pair_index, font_index, value)
+        self.write_back.set(font_index, pair, value)
+
+    def flush_changes(self):
+        '''
+        Updates the labels and the list for the filters changed
+        since the last flush.
+        '''
+        if self.pending_changes:
+            changes, self.pending_changes = self.pending_changes, set()
+            self.update_filter_labels(changes)
 
     def resize_callback(self, sender):
         _, _, self.w_width, self.w_height = self.w.getPosSize()
@@ -430,12 +622,43 @@ class FlexibleWindow(object):
             pair_preview.setPosSize(
                 (pp_origin, 0, self.step_dist, -0))
 
+    def close_callback(self, sender):
+        self.write_back.flush()
+        self.filter_worker.stop()
+        self.prefetcher.stop()
+        for repr_cache in self.repr_caches:
+            repr_cache.stop_observing()
+        self.outline_cache.stop_observing()
+
+    def filtered_pair_indices(self):
+        '''
+        The pairs of the selected filter, narrowed by the query
+        in the search box (see pairQuery).
+        '''
+        pair_indices = self.filter_engine.membership(
+            self.filter_engine.keys[self.w.list_filter.get()])
+        text = self.w.search.get().strip()
+        if text:
+            try:
+                pair_indices = self.batch_editor.queries.select(
+                    text, pair_indices)
+            except ValueError as error:
+                print('Query: {}'.format(error))
+        return pair_indices
+
     def filter_callback(self, sender):
-        sel_index = sender.get()
-        self.pair_list = self.filtered_pairlists[sel_index]
-        self.w.display_list.set(self.make_columns(self.pair_list))
+        self.pair_list.set_indices(self.filtered_pair_indices())
+        self.w.display_list.set(self.pair_list)
+        if len(self.pair_list):
+            self.w.display_list.setSelection([0])
+        self.list_callback(self.w.display_list)
+
+    def search_callback(self, sender):
+        self.filter_callback(self.w.list_filter)
 
     def list_callback(self, sender):
+        if self.refreshing:
+            return
         if not sender.getSelection() and len(self.w.display_list) is 0:
             # list is empty, don’t attempt any selection
 
@@ -452,17 +675,26 @@ class FlexibleWindow(object):
                 sel_index = sender.getSelection()[0]
 
             self.pair = self.pair_list[sel_index]
-            new_values = self.cmb_kern_dict.get(self.pair)
+            new_values = self.kern_matrix.get(self.pair)
             self.values = new_values
             self.w.c.update()
             self.update_display(new_values)
 
             for f_index, f in enumerate(self.fonts):
-                repr_pair = kerningHelper.get_repr_pair(f, self.pair)
+                # member rows of group pairs show their own glyphs
+                repr_pair = self.repr_caches[f_index].repr_pair(
+                    self.pair_list.glyph_pair(sel_index))
+                if repr_pair is None:
+                    continue
                 repr_glyphs = [f[g_name] for g_name in repr_pair]
-                kern_value = f.kerning.get(self.pair, 0)
+                # the model, as the font may be waiting for a write
+                kern_value = new_values[f_index] or 0
                 pair_obj = getattr(self.w.pairPreview, 'pair_{}'.format(f_index))
                 pair_obj.setGlyphData_kerning(repr_glyphs, kern_value)
+
+            # warm up the pairs likely to be shown next
+            self.prefetcher.prefetch(self.pair_list, sel_index)
+
     @property
     def checked(self):
         checked = []
@@ -471,65 +703,88 @@ class FlexibleWindow(object):
             checked.append(pair_obj.checked)
         return checked
 
-    def update_stack(self, pair, value_list):
-        self.values = value_list
-        self.cmb_kern_dict[pair] = value_list
+    def target_pair_indices(self):
+        '''
+        Matrix rows the buttons apply to: the selected pairs,
+        or the whole (filtered and searched) list if the checkbox
+        is ticked.
+        '''
+        if self.w.whole_list.get():
+            return self.pair_list.pair_indices
+        return [
+            self.pair_list.pair_index(sel_index) for
+            sel_index in self.w.display_list.getSelection()]
 
-        self.update_display(value_list)
-        for i, value in enumerate(value_list):
+    def apply_batch(self, action, pair_indices=None, **options):
+        '''
+        Applies a batchEdit action to the given pairs (by default the
+        target pairs), writing all fonts at once. Returns the number
+        of pairs.
+        '''
+        self.write_back.flush()
+        if pair_indices is None:
+            pair_indices = self.target_pair_indices()
+        changes = self.batch_editor.apply(action, pair_indices, **options)
+        if changes:
+            self.update_filter_labels(changes)
+        self.show_values()
+        return len(pair_indices)
+
+    def show_values(self):
+        '''
+        Updates graph and previews after the current pair was edited.
+        '''
+        self.values = self.kern_matrix.get(self.pair)
+        self.update_display(self.values)
+        for i, value in enumerate(self.values):
             pair_obj = getattr(
-                self.w.pairPreview, 'pair_{}'.format(i))
-            pair_obj.setKerning(value)
-            self.update_kerning(i, pair, value)
+                self.w.pairPreview, 'pair_{}'.format(i), None)
+            if pair_obj is not None:
+                pair_obj.setKerning(value)
         self.w.c.update()
 
     def delete_button_callback(self, sender):
-        for i, f in enumerate(self.fonts):
-            self.update_kerning(i, self.pair, None)
-        new_values = [None for i in range(len(self.fonts))]
-        self.update_stack(self.pair, new_values)
-        print('deleting {} {}'.format(*self.pair))
-
-    def _interpolate(self, poles, factor, extrapolate=False):
-        p_min, p_max = poles
-        difference = p_max - p_min
-        result = p_min + difference * factor
-        if extrapolate:
-            result = p_max + difference * factor
-        return result
+        pair_count = self.apply_batch('delete')
+        print('deleting {} pair(s)'.format(pair_count))
 
     def interpolate_button_callback(self, sender):
         # This is not really thought through.
         # For instance: what happens if all boxes are checked?
         c_index = [i for i, b_value in enumerate(self.checked) if b_value == 1]
-        number_values = [0 if v is None else v for v in self.values]
-        new_values = [v for v in self.values]
-        factor = 0.5
 
-        if len(number_values) < 3:
+        if len(self.fonts) < 3:
             Message('Not enough masters', 'Need at least 3 masters to interpolate')
-            pass
+            return
 
         if not c_index:
             print('Please select interpolation target(s)')
-            pass
+            return
 
-        for c_i in c_index:
-            if c_i == 0:
-                # extrapolation on the left
-                poles = (number_values[2], number_values[1])
-                value = self._interpolate(poles, factor, extrapolate=True)
-            elif c_i == (len(number_values) - 1):
-                # extrapolation on the right
-                poles = (number_values[-3], number_values[-2])
-                value = self._interpolate(poles, factor, extrapolate=True)
-            else:
-                # normal interpolation
-                poles = (number_values[c_i - 1], number_values[c_i + 1])
-                value = self._interpolate(poles, factor)
-            kern_value = int(round(value))
-            new_values[c_i] = kern_value
-        self.update_stack(self.pair, new_values)
+        # halfway between the neighbours, or by the masters' locations
+        self.apply_batch('interpolate', targets=c_index)
+
+    def smooth_button_callback(self, sender):
+        '''
+        Proposes to put the kerned masters of the target pairs on the
+        straight line fitting them best along the masters (see
+        interpolationCheck.smooth). Nothing is written before the
+        proposal is applied in the sheet.
+        '''
+        if len(self.fonts) < 3:
+            Message('Not enough masters', 'Need at least 3 masters to smooth')
+            return
+        pair_indices = numpy.unique(numpy.asarray(
+            self.target_pair_indices(), dtype=numpy.intp))
+        values = self.kern_matrix.values[pair_indices]
+        present = self.kern_matrix.present[pair_indices]
+        proposal, _ = interpolationCheck.smooth(
+            values, present, self.filter_engine.master_positions)
+        changed = (proposal != values).any(axis=1)
+        if not changed.any():
+            print('Nothing to smooth')
+            return
+        self.smooth_sheet = SmoothSheet(
+            self, pair_indices[changed], proposal[changed])
 
     def transfer_button_callback(self, sender):
         c_index = [i for i, b_value in enumerate(self.checked) if b_value == 1]
@@ -538,45 +793,70 @@ class FlexibleWindow(object):
         elif len(c_index) > 1:
             print('Select only one source checkbox.')
         else:
-            c_index_number = c_index[0]
-            t_value = self.values[c_index_number]
-            new_values = [t_value for i in range(len(self.fonts))]
-            self.update_stack(self.pair, new_values)
-            print('Transfering value {} across pairs'.format(t_value))
+            pair_count = self.apply_batch('equalize', source=c_index[0])
+            print('Transfering values of master {} across {} pair(s)'.format(
+                c_index[0], pair_count))
 
     def average_button_callback(self, sender):
-        number_values = [0 if v is None else v for v in self.values]
-        average_value = int(round(sum(number_values) / len(number_values)))
-        new_values = [average_value for i in range(len(self.fonts))]
-        self.update_stack(self.pair, new_values)
-        print('Setting pairs to average value {}'.format(average_value))
+        pair_count = self.apply_batch('average')
+        print('Setting {} pair(s) to their average value'.format(pair_count))
 
-    def increase_values(self, value_list, amount):
+    def increase_values(self, amount):
         '''
-        Change all or selected values by amount.
+        Change all or checked masters of the target pairs by amount.
         Used by plus_ and minus_button_callback functions.
         '''
         c_index = [i for i, b_value in enumerate(self.checked) if b_value == 1]
-        number_values = [0 if v is None else v for v in value_list]
         if len(c_index) in [0, len(self.fonts)]:
             # all or nothing are checked
-            new_values = [value + amount for value in number_values]
-        else:
-            # only some are checked
-            new_values = [
-                value + amount if
-                i in c_index else
-                value for i, value in enumerate(number_values)
-            ]
-        return new_values
+            c_index = None
+        self.apply_batch('shift', amount=amount, masters=c_index)
 
     def plus_button_callback(self, sender):
-        new_values = self.increase_values(self.values, 10)
-        self.update_stack(self.pair, new_values)
+        self.increase_values(10)
 
     def minus_button_callback(self, sender):
-        new_values = self.increase_values(self.values, -10)
-        self.update_stack(self.pair, new_values)
+        self.increase_values(-10)
+
+    def apply_journal_entry(self, entry):
+        self.write_back.flush()
+        changes = self.batch_editor.set_cells(
+            entry.pair_ids, entry.master_indices, entry.new_values(),
+            record=False)
+        if changes:
+            self.update_filter_labels(changes)
+        self.show_values()
+
+    def similar_button_callback(self, sender):
+        '''
+        Lists the current pair and the pairs kerned most like it (see
+        profileIndex) through a like() query in the search box, with
+        the current pair still selected.
+        '''
+        pair_index = self.kern_matrix.index[self.pair]
+        self.w.list_filter.set(self.filter_engine.keys.index('all'))
+        self.w.search.set('like({}, {})'.format(*self.pair))
+        self.filter_callback(self.w.list_filter)
+        rows = numpy.flatnonzero(self.pair_list.pair_indices == pair_index)
+        if len(rows):
+            self.w.display_list.setSelection([int(rows[0])])
+            self.list_callback(self.w.display_list)
+
+    def undo_button_callback(self, sender):
+        entry = self.journal.undo()
+        if entry is None:
+            print('Nothing to undo')
+        else:
+            self.apply_journal_entry(entry)
+            print('Undoing {} change(s)'.format(len(entry)))
+
+    def redo_button_callback(self, sender):
+        entry = self.journal.redo()
+        if entry is None:
+            print('Nothing to redo')
+        else:
+            self.apply_journal_entry(entry)
+            print('Redoing {} change(s)'.format(len(entry)))
 
     def dummy_button_callback(self, sender):
         pass
@@ -0,0 +1,478 @@
+'''
+Command-line batch reports of the Kern-A-Lytics filters.
+
+    python kernalytics.py Family.designspace Other.designspace -o reports
+    python kernalytics.py Light.ufo Regular.ufo Bold.ufo -o reports
+
+Every designspace file is a family; UFOs passed directly form one
+family together. For every family, a JSON report containing all filters
+and one CSV file per filter (with the values of each master) are written
+to the output directory. Families are analyzed in parallel processes.
+
+With --glyph-level, groups are expanded and the filters run on the
+effective kerning of glyph pairs, so masters with different group
+structures can be compared. Glyph pairs with identical values in every
+master (from the same kerned pairs) are reported once, with a count.
+With --reconcile-groups, group pairs are rewritten to groups shared by
+all masters instead. Either way, the report lists groups which were
+renamed, split or merged between masters, and glyphs in several groups.
+
+With --rules, the edit rules of a JSON file (see batchEdit) are applied
+to each family before the report is written; --replay applies the edits
+of a journal recorded in the window (see editJournal) to a single family.
+--save writes the edited kerning back to the UFOs.
+
+Each --query (see pairQuery) is reported like a filter, for instance
+--query 'gamut > 40 AND exception AND NOT single' or --query 'm3 is None'.
+'''
+
+import argparse
+import csv
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy
+
+import batchEdit
+import editJournal
+import kerningHelper
+import pairQuery
+import ufoLoader
+from kernFilters import FILTERS, RANKING_METRICS, FilterEngine
+from interpolationCheck import DEFAULT_TOLERANCE, master_positions, smooth
+from masterDrift import DEFAULT_RESIDUAL, DriftReport
+from presencePatterns import MAX_MASTERS, PresencePatterns
+from robustOutliers import DEFAULT_THRESHOLD, METHODS
+
+DEFAULT_OUTLIER_FACTOR = 5
+DEFAULT_SMALL_AVERAGE = 5
+
+
+def _master_name(font, index):
+    return (
+        font.source_name or font.info.styleName or
+        'master {}'.format(index))
+
+
+def _pair_rows(kern_matrix, pair_indices):
+    for pair_index in pair_indices:
+        left, right = kern_matrix.pairs[pair_index]
+        yield left, right, kern_matrix.row(pair_index)
+
+
+def _matrix_rows(matrix, digits):
+    return [
+        [None if numpy.isnan(value) else round(value, digits) for
+            value in row]
+        for row in matrix.tolist()]
+
+
+def _group_report(group_index):
+    return {
+        'changes': [change._asdict() for change in group_index.changes],
+        'duplicates': [
+            {
+                'master_index': m_index, 'side': side,
+                'glyph': glyph_name, 'groups': group_names}
+            for m_index, duplicates in enumerate(group_index.duplicates)
+            for side, glyph_groups in sorted(duplicates.items())
+            for glyph_name, group_names in sorted(glyph_groups.items())
+        ],
+    }
+
+
+def analyze_family(
+    family_name, fonts, glyph_level=False, max_pairs=None,
+    reconcile_groups=False, rules=None, journal=None, save=False,
+    queries=(), drift=False, drift_residual=DEFAULT_RESIDUAL,
+    **engine_options
+):
+    '''
+    Computes all filters for a family, returns the report as a dict.
+    The edits of *journal* and *rules* are applied to the kerning
+    first (and saved if *save*). *queries* are reported as filters
+    named query1, query2...
+    With *drift*, the systematic differences between masters are
+    reported (see masterDrift.DriftReport), and the pairs with a
+    residual of at least *drift_residual* units after correcting for
+    them are listed as the filter 'drift'.
+    Interpolation is checked along the masters' designspace locations
+    (see interpolationCheck.master_positions), unless *master_positions*
+    are given.
+    '''
+    if rules and (glyph_level or reconcile_groups):
+        raise ValueError('rules can only be applied to the fonts\' pairs')
+    if engine_options.get('master_positions') is None:
+        engine_options['master_positions'] = master_positions(fonts)
+    conflicts = None
+    if journal is not None:
+        conflicts = journal.replay(fonts)
+    group_index = kerningHelper.get_group_index(fonts)
+    if glyph_level:
+        flat_kerning = kerningHelper.get_flat_kerning(fonts, max_pairs)
+        kern_matrix = flat_kerning.matrix
+        # exceptions only exist between group and glyph pairs
+        engine = FilterEngine(kern_matrix, None, **engine_options)
+    elif reconcile_groups:
+        kern_matrix = kerningHelper.get_canonical_kern_matrix(
+            fonts, group_index)
+        engine = FilterEngine(
+            kern_matrix, fonts,
+            master_groups=[group_index.canonical_groups] * len(fonts),
+            **engine_options)
+    else:
+        kern_matrix = kerningHelper.get_kern_matrix(fonts)
+        engine = FilterEngine(kern_matrix, fonts, **engine_options)
+    master_names = [_master_name(font, i) for i, font in enumerate(fonts)]
+    search_index = None
+    if rules or queries:
+        search_index = kerningHelper.get_search_index(fonts, kern_matrix)
+    rule_counts = None
+    if rules:
+        editor = batchEdit.BatchEditor(
+            engine, fonts, master_names, search_index=search_index)
+        rule_counts = editor.run_rules(rules)
+    if save and (rules or journal is not None):
+        for font in fonts:
+            font.save_kerning()
+    engine.compute()
+
+    report = {
+        'family': family_name,
+        'masters': master_names,
+        'pair_count': len(kern_matrix),
+        'groups': _group_report(group_index),
+        'filters': {},
+    }
+    if glyph_level:
+        report['glyph_pair_count'] = flat_kerning.glyph_pair_count
+    if len(fonts) <= MAX_MASTERS:
+        report['presence'] = PresencePatterns.from_matrix(
+            kern_matrix).summary(master_names)
+    if conflicts is not None:
+        report['journal'] = {
+            'edits': sum(len(entry) for entry in journal.entries()),
+            'conflicts': [
+                {
+                    'left': left, 'right': right,
+                    'master_index': master_index, 'value': value}
+                for (left, right), master_index, value in conflicts],
+        }
+    if rule_counts is not None:
+        report['rules'] = [
+            dict(rule, pair_count=count) for
+            rule, count in zip(rules, rule_counts)]
+    query_engine = pairQuery.QueryEngine(engine, search_index)
+    filters = [
+        (key, engine.label(key), engine.membership(key)) for
+        key in engine.keys if
+        key != 'all' and not (glyph_level and key == 'exception')]
+    filters += [
+        ('query{}'.format(number), query, query_engine.select(query)) for
+        number, query in enumerate(queries, 1)]
+    if drift:
+        drift_report = DriftReport.from_matrix(kern_matrix)
+        report['drift'] = {
+            'scale': _matrix_rows(drift_report.scale, 4),
+            'offset': _matrix_rows(drift_report.offset, 1),
+            'shared': drift_report.shared.tolist(),
+            'table': drift_report.format_matrix(master_names),
+        }
+        filters.append((
+            'drift',
+            'Residual after Drift >= {}'.format(drift_residual),
+            drift_report.ranked(drift_residual)))
+    for key, label, pair_indices in filters:
+        pair_indices = pair_indices.tolist()
+        pairs = [
+            {'left': left, 'right': right, 'values': values} for
+            left, right, values in _pair_rows(kern_matrix, pair_indices)]
+        if glyph_level:
+            for pair, pair_index in zip(pairs, pair_indices):
+                pair['glyph_pairs'] = int(flat_kerning.weights[pair_index])
+        if key == 'robust_outlier':
+            stats = engine.stats
+            for pair, pair_index in zip(pairs, pair_indices):
+                pair['outlier'] = {
+                    'master': master_names[stats.outlier_master[pair_index]],
+                    'score': round(float(stats.outlier_score[pair_index]), 2),
+                    'deviation': float(stats.outlier_deviation[pair_index])}
+        if key == 'interpolation' and pair_indices:
+            stats = engine.stats
+            proposals, _ = smooth(
+                kern_matrix.values[pair_indices],
+                kern_matrix.present[pair_indices],
+                engine.master_positions)
+            for pair, pair_index, proposal in zip(
+                pairs, pair_indices, proposals.tolist()
+            ):
+                pair['interpolation'] = {
+                    'master': master_names[
+                        stats.interpolation_master[pair_index]],
+                    'error': round(
+                        float(stats.interpolation_error[pair_index]), 2),
+                    'reversals': int(stats.reversals[pair_index]),
+                    'proposal': [
+                        None if old is None else value for
+                        value, old in zip(proposal, pair['values'])]}
+        if key == 'drift':
+            for pair, pair_index in zip(pairs, pair_indices):
+                pair['drift'] = {
+                    'master': master_names[drift_report.master[pair_index]],
+                    'residual': round(
+                        float(drift_report.residuals[
+                            pair_index, drift_report.master[pair_index]]),
+                        1)}
+        report['filters'][key] = {
+            'label': label,
+            'pairs': pairs,
+        }
+    return report
+
+
+def write_report(report, output_dir, formats=('json', 'csv')):
+    '''
+    Writes a family report, returns the paths of the files written.
+    '''
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    written = []
+    if 'json' in formats:
+        json_path = os.path.join(
+            output_dir, '{}.json'.format(report['family']))
+        with open(json_path, 'w') as json_file:
+            json.dump(report, json_file, indent=1)
+        written.append(json_path)
+    if 'csv' in formats:
+        for key, filter_report in report['filters'].items():
+            csv_path = os.path.join(
+                output_dir, '{}-{}.csv'.format(report['family'], key))
+            with open(csv_path, 'w', newline='') as csv_file:
+                writer = csv.writer(csv_file)
+                glyph_level = 'glyph_pair_count' in report
+                writer.writerow(
+                    ['left', 'right'] + report['masters'] +
+                    (['glyph_pairs'] if glyph_level else []))
+                for pair in filter_report['pairs']:
+                    writer.writerow(
+                        [pair['left'], pair['right']] +
+                        ['' if v is None else v for v in pair['values']] +
+                        ([pair['glyph_pairs']] if glyph_level else []))
+            written.append(csv_path)
+    return written
+
+
+def _source_name(source):
+    '''
+    Name of a family: that of its designspace file, or the family name
+    of its first UFO.
+    '''
+    if isinstance(source, str):
+        return os.path.splitext(os.path.basename(source))[0]
+    name = ufoLoader.read_info(source[0]).familyName or 'family'
+    return name.replace(' ', '')
+
+
+def _family_names(sources):
+    '''
+    Report names of the families, unique within a run: names shared by
+    several families get their directory prepended, and a number if
+    that does not tell them apart.
+    '''
+    names = [_source_name(source) for source in sources]
+    shared = [names.count(name) > 1 for name in names]
+    for index, source in enumerate(sources):
+        if shared[index]:
+            path = source if isinstance(source, str) else source[0]
+            directory = os.path.basename(
+                os.path.dirname(os.path.abspath(path)))
+            names[index] = '{}-{}'.format(directory, names[index])
+    shared = [names.count(name) > 1 for name in names]
+    for index in range(len(names)):
+        if shared[index]:
+            names[index] = '{}-{}'.format(names[index], index + 1)
+    return names
+
+
+def load_family(source, family_name=None):
+    '''
+    *source* is a designspace path, or a list of UFO paths.
+    Returns the family name (*family_name* if given) and its fonts.
+    '''
+    if family_name is None:
+        family_name = _source_name(source)
+    if isinstance(source, str):
+        return family_name, ufoLoader.load_designspace(source)
+    return family_name, ufoLoader.load_fonts(source)
+
+
+def run_family(
+    source, output_dir, formats, analysis_options, family_name=None
+):
+    family_name, fonts = load_family(source, family_name)
+    report = analyze_family(family_name, fonts, **analysis_options)
+    written = write_report(report, output_dir, formats)
+    counts = {
+        key: len(filter_report['pairs']) for
+        key, filter_report in report['filters'].items()}
+    drift_table = report.get('drift', {}).get('table')
+    return family_name, counts, written, drift_table
+
+
+def _reported_filters(queries=(), drift=False):
+    '''
+    Keys of the filters a report can contain.
+    '''
+    keys = [key for key, _ in FILTERS if key != 'all']
+    keys += ['query{}'.format(number) for number in range(1, len(queries) + 1)]
+    if drift:
+        keys.append('drift')
+    return keys
+
+
+def _family_sources(inputs):
+    designspaces = [path for path in inputs if path.endswith('.designspace')]
+    ufos = [path for path in inputs if path not in designspaces]
+    sources = list(designspaces)
+    if ufos:
+        sources.append(ufos)
+    return sources
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description='Write Kern-A-Lytics filter reports for UFO families.')
+    parser.add_argument(
+        'inputs', nargs='+', metavar='INPUT',
+        help='designspace files (one family each) or UFOs (one family)')
+    parser.add_argument(
+        '-o', '--output-dir', default='.',
+        help='directory for the reports (default: current directory)')
+    parser.add_argument(
+        '-f', '--format', dest='formats', action='append',
+        choices=['json', 'csv'],
+        help='report format(s) to write (default: json and csv)')
+    parser.add_argument(
+        '-j', '--jobs', type=int, default=None,
+        help='number of families analyzed in parallel')
+    parser.add_argument(
+        '--outlier-factor', type=float, default=DEFAULT_OUTLIER_FACTOR)
+    parser.add_argument(
+        '--small-average', type=float, default=DEFAULT_SMALL_AVERAGE)
+    parser.add_argument(
+        '--robust-threshold', type=float, default=DEFAULT_THRESHOLD,
+        help='score above which a value is a robust outlier '
+        '(default: {})'.format(DEFAULT_THRESHOLD))
+    parser.add_argument(
+        '--robust-method', default='mad', choices=METHODS,
+        help='median absolute deviation, or leave-one-out z-scores '
+        '(default: mad)')
+    parser.add_argument(
+        '--interpolation-tolerance', type=float, default=DEFAULT_TOLERANCE,
+        help='error (in units) from which pairs changing direction along '
+        'the masters are uneven (default: {})'.format(DEFAULT_TOLERANCE))
+    parser.add_argument(
+        '--ranking-metric', default='spread', choices=list(RANKING_METRICS),
+        help='metric of the ranking filter (default: spread)')
+    parser.add_argument(
+        '--ranking-amount', type=int, default=100,
+        help='number of pairs in the ranking filter (default: 100)')
+    parser.add_argument(
+        '--glyph-level', action='store_true',
+        help='expand groups and compare the kerning of glyph pairs')
+    parser.add_argument(
+        '--max-pairs', type=int, default=None,
+        help='give up on glyph-level families with more distinct pairs')
+    parser.add_argument(
+        '--reconcile-groups', action='store_true',
+        help='line up group pairs of masters with differing groups')
+    parser.add_argument(
+        '--rules', metavar='FILE',
+        help='JSON file of edit rules applied before reporting')
+    parser.add_argument(
+        '--replay', metavar='JOURNAL',
+        help='edit journal (.kernjournal.jsonl) applied before the rules')
+    parser.add_argument(
+        '--save', action='store_true',
+        help='write the kerning edited by --replay or --rules to the UFOs')
+    parser.add_argument(
+        '--query', dest='queries', action='append', default=[],
+        metavar='QUERY', help='also report the pairs matching a query')
+    parser.add_argument(
+        '--drift', action='store_true',
+        help='report (and print) the scale and offset between masters')
+    parser.add_argument(
+        '--drift-residual', type=float, default=DEFAULT_RESIDUAL,
+        help='residual (in units) after correcting for drift from which '
+        'pairs are reported (default: {})'.format(DEFAULT_RESIDUAL))
+    parser.add_argument(
+        '--fail-on', action='append', default=[], metavar='FILTER',
+        help='exit with status 1 if this filter (or drift, query1...) '
+        'finds any pairs')
+    options = parser.parse_args(args)
+    reported = _reported_filters(options.queries, options.drift)
+    for key in options.fail_on:
+        if key not in reported:
+            parser.error(
+                'argument --fail-on: invalid choice: {!r} (choose from '
+                '{})'.format(key, ', '.join(reported)))
+    sources = _family_sources(options.inputs)
+    if options.replay and len(sources) > 1:
+        # a journal holds the pairs and masters of a single family
+        parser.error('argument --replay: only one family can be replayed')
+
+    formats = options.formats or ['json', 'csv']
+    analysis_options = {
+        'outlier_factor': options.outlier_factor,
+        'small_average_value': options.small_average,
+        'robust_threshold': options.robust_threshold,
+        'robust_method': options.robust_method,
+        'interpolation_tolerance': options.interpolation_tolerance,
+        'ranking_metric': options.ranking_metric,
+        'ranking_amount': options.ranking_amount,
+        'glyph_level': options.glyph_level,
+        'max_pairs': options.max_pairs,
+        'reconcile_groups': options.reconcile_groups,
+        'queries': options.queries,
+        'drift': options.drift,
+        'drift_residual': options.drift_residual,
+    }
+    if options.rules:
+        analysis_options['rules'] = batchEdit.load_rules(options.rules)
+    if options.replay:
+        analysis_options['journal'] = editJournal.EditJournal.load(
+            options.replay)
+    analysis_options['save'] = options.save
+
+    failed = False
+    # families sharing a name would overwrite each other's reports
+    names = _family_names(sources)
+    with ProcessPoolExecutor(max_workers=options.jobs) as executor:
+        futures = [
+            executor.submit(
+                run_family, source, options.output_dir, formats,
+                analysis_options, name)
+            for source, name in zip(sources, names)]
+        for source, future in zip(sources, futures):
+            try:
+                family_name, counts, written, drift_table = future.result()
+            except ValueError as error:
+                # glyph-level families exceeding --max-pairs,
+                # rules which do not apply, or invalid queries
+                print('{}: {}'.format(source, error), file=sys.stderr)
+                failed = True
+                continue
+            print('{}: {}'.format(family_name, ', '.join(
+                '{} {}'.format(key, count) for key, count in counts.items())))
+            if drift_table:
+                print(drift_table)
+            for key in options.fail_on:
+                if counts.get(key):
+                    failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,340 @@
+import collections
+import threading
+
+import numpy
+
+# line segments a curve is flattened into
+CURVE_STEPS = 8
+MAX_COMPONENT_DEPTH = 10
+
+
+def _transform_point(transformation, point):
+    xx, xy, yx, yy, dx, dy = transformation
+    x, y = point
+    return xx * x + yx * y + dx, xy * x + yy * y + dy
+
+
+def _cubic_points(p0, p1, p2, p3, steps):
+    points = []
+    for step in range(1, steps + 1):
+        t = step / float(steps)
+        mt = 1 - t
+        a, b = mt * mt * mt, 3 * mt * mt * t
+        c, d = 3 * mt * t * t, t * t * t
+        points.append((
+            a * p0[0] + b * p1[0] + c * p2[0] + d * p3[0],
+            a * p0[1] + b * p1[1] + c * p2[1] + d * p3[1]))
+    return points
+
+
+def _quadratic_points(p0, p1, p2, steps):
+    points = []
+    for step in range(1, steps + 1):
+        t = step / float(steps)
+        mt = 1 - t
+        a, b, c = mt * mt, 2 * mt * t, t * t
+        points.append((
+            a * p0[0] + b * p1[0] + c * p2[0],
+            a * p0[1] + b * p1[1] + c * p2[1]))
+    return points
+
+
+class FlatteningPen(object):
+    '''
+    Segment pen recording outlines as polygons, with curves flattened
+    into CURVE_STEPS line segments each. Components are drawn from
+    *glyph_set* (anything mapping names to drawable glyphs).
+    '''
+
+    def __init__(self, glyph_set=None, transformation=None, depth=0):
+        self.glyph_set = glyph_set
+        self.transformation = transformation
+        self.depth = depth
+        self.contours = []
+        self.components = set()
+        self._current = None
+
+    def _point(self, point):
+        if self.transformation is None:
+            return tuple(point)
+        return _transform_point(self.transformation, point)
+
+    def moveTo(self, point):
+        self._current = [self._point(point)]
+        self.contours.append((self._current, False))
+
+    def lineTo(self, point):
+        self._current.append(self._point(point))
+
+    def curveTo(self, *points):
+        points = [self._point(point) for point in points]
+        if len(points) == 3:
+            self._current.extend(_cubic_points(
+                self._current[-1], points[0], points[1], points[2],
+                CURVE_STEPS))
+        else:
+            # (rare) super-beziers are drawn through their points
+            self._current.extend(points)
+
+    def qCurveTo(self, *points):
+        if points[-1] is None:
+            # a contour of off-curve points only
+            points = [self._point(point) for point in points[:-1]]
+            implied = (
+                (points[-1][0] + points[0][0]) / 2.0,
+                (points[-1][1] + points[0][1]) / 2.0)
+            self._current = [implied]
+            self.contours.append((self._current, False))
+            points.append(implied)
+        else:
+            points = [self._point(point) for point in points]
+        start = self._current[-1]
+        off_curves, end = points[:-1], points[-1]
+        for i, off_curve in enumerate(off_curves):
+            if i + 1 < len(off_curves):
+                next_off = off_curves[i + 1]
+                on_curve = (
+                    (off_curve[0] + next_off[0]) / 2.0,
+                    (off_curve[1] + next_off[1]) / 2.0)
+            else:
+                on_curve = end
+            self._current.extend(_quadratic_points(
+                start, off_curve, on_curve, CURVE_STEPS))
+            start = on_curve
+        if not off_curves:
+            self._current.append(end)
+
+    def closePath(self):
+        if self.contours:
+            self.contours[-1] = (self.contours[-1][0], True)
+        self._current = None
+
+    def endPath(self):
+        self._current = None
+
+    def addComponent(self, glyph_name, transformation):
+        self.components.add(glyph_name)
+        if (
+            self.glyph_set is None or self.depth >= MAX_COMPONENT_DEPTH or
+            glyph_name not in self.glyph_set
+        ):
+            return
+        if self.transformation is not None:
+            transformation = _multiply(self.transformation, transformation)
+        component_pen = FlatteningPen(
+            self.glyph_set, tuple(transformation), self.depth + 1)
+        self.glyph_set[glyph_name].draw(component_pen)
+        self.contours.extend(component_pen.contours)
+        self.components.update(component_pen.components)
+
+
+def _multiply(outer, inner):
+    '''
+    Transformation applying *inner* first, then *outer*.
+    '''
+    a1, b1, c1, d1, e1, f1 = outer
+    a2, b2, c2, d2, e2, f2 = inner
+    return (
+        a2 * a1 + b2 * c1, a2 * b1 + b2 * d1,
+        c2 * a1 + d2 * c1, c2 * b1 + d2 * d1,
+        e2 * a1 + f2 * c1 + e1, e2 * b1 + f2 * d1 + f1)
+
+
+class OutlinePath(object):
+    '''
+    Flattened outline of a glyph: all contour points in one float32
+    array, with the end index and closedness of each contour.
+    Hosts may keep their own drawing object in *native*.
+    '''
+
+    __slots__ = [
+        'points', 'contour_ends', 'closed', 'width', 'components', 'native']
+
+    def __init__(self, contours, width=0, components=()):
+        points = [point for contour, _ in contours for point in contour]
+        self.points = numpy.array(
+            points, dtype=numpy.float32).reshape(len(points), 2)
+        self.contour_ends = numpy.cumsum(
+            [len(contour) for contour, _ in contours], dtype=numpy.int32)
+        self.closed = numpy.array(
+            [closed for _, closed in contours], dtype=bool)
+        self.width = width
+        self.components = frozenset(components)
+        self.native = None
+
+    @classmethod
+    def from_glyph(cls, glyph, glyph_set=None):
+        pen = FlatteningPen(glyph_set)
+        glyph.draw(pen)
+        return cls(pen.contours, glyph.width, pen.components)
+
+    @property
+    def nbytes(self):
+        return (
+            self.points.nbytes + self.contour_ends.nbytes +
+            self.closed.nbytes)
+
+    def contours(self):
+        '''
+        Iterates (points, closed) for every contour.
+        '''
+        start = 0
+        for end, closed in zip(self.contour_ends.tolist(), self.closed):
+            yield self.points[start:end], bool(closed)
+            start = end
+
+    def svg_path(self, offset=(0, 0)):
+        '''
+        SVG path data, for headless proofs.
+        '''
+        dx, dy = offset
+        commands = []
+        for points, closed in self.contours():
+            coordinates = [
+                '{:g} {:g}'.format(x + dx, y + dy) for
+                x, y in points.tolist()]
+            if coordinates:
+                commands.append('M' + ' L'.join(coordinates))
+                if closed:
+                    commands.append('Z')
+        return ' '.join(commands)
+
+
+def change_stamp(glyph):
+    '''
+    The host's own record of a glyph's last change, for fonts whose
+    changes cannot be observed: lastChange of the GSGlyph behind a
+    Glyphs glyph. None if the host keeps none.
+    '''
+    try:
+        naked = glyph.naked()
+    except AttributeError:
+        return
+    return getattr(naked, 'lastChange', None)
+
+
+class OutlineCache(object):
+    '''
+    Flattened outlines of the glyphs of a number of masters, shared by
+    the previews (and anything else drawing glyphs), so outlines are
+    only drawn through a pen again once their glyph changed.
+
+    Entries are keyed by (master index, glyph name, change counter) and
+    evicted least recently used first, once they take up more than
+    *max_bytes*. Change counters advance on glyph_changed(), which
+    observe() hooks up to the change notifications of defcon fonts.
+    For other fonts, the counters advance as the change_stamp() of a
+    glyph differs from the one it was drawn with.
+    Thread-safe, so outlines can be prefetched.
+    '''
+
+    def __init__(self, max_bytes=16 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._counters = {}
+        self._observed = {}
+        self._stamped = set()
+        self._stamps = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def outline(self, master_index, glyph, glyph_set=None):
+        '''
+        The OutlinePath of a glyph of a master. Components are looked
+        up in *glyph_set*, by default the glyph's font.
+        '''
+        name = glyph.name
+        if master_index in self._stamped:
+            self._check_stamp(master_index, glyph)
+        with self._lock:
+            counter = self._counters.get((master_index, name), 0)
+            key = (master_index, name, counter)
+            outline = self._entries.get(key)
+            if outline is not None:
+                self._entries[key] = self._entries.pop(key)
+                self.hits += 1
+                return outline
+        if glyph_set is None:
+            glyph_set = glyph.getParent()
+        outline = OutlinePath.from_glyph(glyph, glyph_set)
+        with self._lock:
+            self.misses += 1
+            if key not in self._entries:
+                self._entries[key] = outline
+                self.nbytes += outline.nbytes
+                self._evict()
+            return self._entries.get(key, outline)
+
+    def _evict(self):
+        # the newest entry stays, even if it is larger than max_bytes
+        while self.nbytes > self.max_bytes and len(self._entries) > 1:
+            _, outline = self._entries.popitem(last=False)
+            self.nbytes -= outline.nbytes
+
+    def glyph_changed(self, master_index, glyph_name):
+        '''
+        Drops a glyph's outline (and those of composites using it).
+        '''
+        with self._lock:
+            stale = [glyph_name] + [
+                name for (m_index, name, _), outline in
+                self._entries.items() if
+                m_index == master_index and glyph_name in outline.components]
+            for name in stale:
+                counter_key = (master_index, name)
+                counter = self._counters.get(counter_key, 0)
+                outline = self._entries.pop(
+                    (master_index, name, counter), None)
+                if outline is not None:
+                    self.nbytes -= outline.nbytes
+                self._counters[counter_key] = counter + 1
+
+    def _check_stamp(self, master_index, glyph):
+        stamp = change_stamp(glyph)
+        if stamp is None:
+            return
+        stamp_key = (master_index, glyph.name)
+        with self._lock:
+            last_stamp = self._stamps.get(stamp_key)
+            self._stamps[stamp_key] = stamp
+        if last_stamp is not None and last_stamp != stamp:
+            self.glyph_changed(master_index, glyph.name)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def observe(self, master_index, font):
+        '''
+        Follows glyph changes of a font which exposes a defcon font
+        via naked(). Returns False for other fonts (Glyphs), whose
+        glyphs are checked against their change_stamp() instead.
+        '''
+        try:
+            naked = font.naked()
+        except AttributeError:
+            naked = None
+        if not hasattr(getattr(naked, 'dispatcher', None), 'addObserver'):
+            self._stamped.add(master_index)
+            return False
+        self._observed[id(naked)] = (master_index, naked)
+        naked.dispatcher.addObserver(
+            self, '_glyph_changed_notification', 'Glyph.Changed')
+        return True
+
+    def stop_observing(self):
+        for _, naked in self._observed.values():
+            naked.dispatcher.removeObserver(self, 'Glyph.Changed')
+        self._observed = {}
+
+    def _glyph_changed_notification(self, notification):
+        glyph = notification.object
+        observed = self._observed.get(id(glyph.font))
+        if observed is not None:
+            self.glyph_changed(observed[0], glyph.name)
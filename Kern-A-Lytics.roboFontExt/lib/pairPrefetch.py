@@ -0,0 +1,101 @@
+import collections
+import threading
+
+
+def neighbour_indices(index, count, radius):
+    '''
+    Indices around *index* (excluding it), nearest first, alternating
+    between the next and the previous ones.
+    '''
+    indices = []
+    for distance in range(1, radius + 1):
+        for neighbour in (index + distance, index - distance):
+            if 0 <= neighbour < count:
+                indices.append(neighbour)
+    return indices
+
+
+class PairPrefetcher(threading.Thread):
+    '''
+    Prepares the previews of the pairs around the selected one on a
+    background thread: resolves their representative glyphs in every
+    master, loads the glyphs, and draws their outlines into the
+    OutlineCache. Each call of prefetch() replaces the pending work, so
+    jumping to another part of the list cancels the old neighbourhood.
+
+    Pairs already prepared are remembered (up to *memory* pairs), so
+    stepping back and forth does not prepare them again. Pairs failing
+    to prepare (a glyph missing, or edited meanwhile) are skipped.
+    '''
+
+    def __init__(
+        self, fonts, repr_caches, outline_cache, radius=10, memory=100
+    ):
+        super(PairPrefetcher, self).__init__()
+        self.daemon = True
+        self.fonts = fonts
+        self.repr_caches = repr_caches
+        self.outline_cache = outline_cache
+        self.radius = radius
+        self.memory = memory
+        self.prepared_count = 0
+        self.failed_count = 0
+        self._prepared = collections.OrderedDict()
+        self._request = None
+        self._generation = 0
+        self._condition = threading.Condition()
+        self._stopped = False
+
+    def prefetch(self, pair_list, index):
+        '''
+        Schedules the neighbours of row *index* of a PairRows list (the
+        glyph pairs their previews show), cancelling whatever was
+        scheduled before.
+        '''
+        pairs = [
+            pair_list.glyph_pair(i) for i in
+            neighbour_indices(index, len(pair_list), self.radius)]
+        with self._condition:
+            self._generation += 1
+            self._request = (self._generation, pairs)
+            self._condition.notify()
+
+    def is_prepared(self, pair):
+        return pair in self._prepared
+
+    def run(self):
+        while True:
+            with self._condition:
+                while self._request is None and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                generation, pairs = self._request
+                self._request = None
+            for pair in pairs:
+                if self._stopped or generation != self._generation:
+                    break
+                if pair in self._prepared:
+                    continue
+                try:
+                    self.prepare(pair)
+                except Exception:
+                    # the preview prepares the pair itself when shown
+                    self.failed_count += 1
+
+    def prepare(self, pair):
+        for f_index, font in enumerate(self.fonts):
+            repr_pair = self.repr_caches[f_index].repr_pair(pair)
+            if repr_pair is None:
+                continue
+            for glyph_name in repr_pair:
+                self.outline_cache.outline(f_index, font[glyph_name])
+        self._prepared[pair] = True
+        while len(self._prepared) > self.memory:
+            self._prepared.popitem(last=False)
+        self.prepared_count += 1
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
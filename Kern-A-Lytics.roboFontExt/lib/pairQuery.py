@@ -0,0 +1,420 @@
+import collections
+import operator
+import re
+
+import numpy
+
+from kernFilters import FILTERS, RANKING_METRICS, outlier_mask
+from presencePatterns import KERNED, MISSING
+from profileIndex import SIMILAR_AMOUNT, ProfileIndex
+
+OPERATORS = {
+    '<': operator.lt, '<=': operator.le,
+    '>': operator.gt, '>=': operator.ge,
+    '==': operator.eq, '!=': operator.ne,
+}
+# statistics queries can compare, besides the ranking metrics
+CONDITION_STATS = [
+    'minimum', 'maximum', 'total', 'gamut', 'abs_mean', 'spread',
+    'outlier_score', 'interpolation_error', 'reversals', 'kerned_masters']
+# filters with a parameter: name -> number of arguments
+FUNCTIONS = {
+    'outlier': 1, 'small_average': 1, 'top': 2, 'missing_only': 1,
+    'pattern': 1, 'like': 2}
+
+TOKEN_RE = re.compile(r'''\s*(?:
+    (?P<op><=|>=|==|!=|<|>) |
+    (?P<punct>[(),]) |
+    (?P<number>-?\d+(?:\.\d*)?(?![\w.*:=])) |
+    (?P<word>[^\s(),<>=!]+(?:=[^\s(),<>=!]+)?)
+)''', re.VERBOSE)
+MASTER_RE = re.compile(r'^m(\d+)$')
+KEYWORDS = ['and', 'or', 'not', 'is', 'none']
+
+
+def tokenize(text):
+    '''
+    (kind, value) tokens of a query; keywords are lowercased.
+    '''
+    tokens = []
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = TOKEN_RE.match(text, position)
+        if match is None or match.end() == position:
+            raise ValueError('invalid query at {!r}'.format(text[position:]))
+        position = match.end()
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'word' and value.lower() in KEYWORDS:
+            kind, value = 'keyword', value.lower()
+        tokens.append((kind, value))
+    return tokens
+
+
+def _number(value):
+    number = float(value)
+    return int(number) if number.is_integer() else number
+
+
+class _Parser(object):
+    '''
+    Recursive descent parser of the query grammar:
+
+        query  := term (OR term)*
+        term   := factor ([AND] factor)*
+        factor := NOT factor | '(' query ')' | atom
+        atom   := name op number | mN IS [NOT] NONE
+                | function '(' argument (',' argument)* ')'
+                | filter | search term
+    '''
+
+    def __init__(self, text):
+        self.text = text
+        self.tokens = tokenize(text)
+        self.position = 0
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return (None, None)
+
+    def take(self, kind=None, value=None):
+        token = self.peek()
+        if (kind is not None and token[0] != kind) or (
+            value is not None and token[1] != value
+        ):
+            found = 'end of query' if token[0] is None else repr(token[1])
+            raise ValueError('expected {} in {!r}, found {}'.format(
+                value or kind, self.text, found))
+        self.position += 1
+        return token[1]
+
+    def parse(self):
+        if not self.tokens:
+            raise ValueError('empty query')
+        node = self.query()
+        if self.peek()[0] is not None:
+            raise ValueError('unexpected {!r} in {!r}'.format(
+                self.peek()[1], self.text))
+        return node
+
+    def query(self):
+        terms = [self.term()]
+        while self.peek() == ('keyword', 'or'):
+            self.take()
+            terms.append(self.term())
+        return terms[0] if len(terms) == 1 else ('or', terms)
+
+    def term(self):
+        factors = [self.factor()]
+        while True:
+            token = self.peek()
+            if token == ('keyword', 'and'):
+                self.take()
+            elif token[0] != 'word' and token not in (
+                ('punct', '('), ('keyword', 'not')
+            ):
+                break
+            factors.append(self.factor())
+        return factors[0] if len(factors) == 1 else ('and', factors)
+
+    def factor(self):
+        token = self.peek()
+        if token == ('keyword', 'not'):
+            self.take()
+            return ('not', self.factor())
+        if token == ('punct', '('):
+            self.take()
+            node = self.query()
+            self.take('punct', ')')
+            return node
+        return self.atom()
+
+    def atom(self):
+        word = self.take('word')
+        kind, value = self.peek()
+        master = MASTER_RE.match(word)
+        if kind == 'op':
+            self.take()
+            number = _number(self.take('number'))
+            if master:
+                return ('master', int(master.group(1)), value, number)
+            if word in RANKING_METRICS:
+                word = RANKING_METRICS[word][0]
+            if word not in CONDITION_STATS:
+                raise ValueError('unknown statistic: {!r}'.format(word))
+            return ('stat', word, value, number)
+        if (kind, value) == ('keyword', 'is'):
+            if not master:
+                raise ValueError(
+                    'only masters (like m0) can be None: {!r}'.format(word))
+            self.take()
+            missing = self.peek() != ('keyword', 'not')
+            if not missing:
+                self.take()
+            self.take('keyword', 'none')
+            return ('missing', int(master.group(1)), missing)
+        if (kind, value) == ('punct', '(') and word in FUNCTIONS:
+            self.take()
+            arguments = [self.argument()]
+            while self.peek() == ('punct', ','):
+                self.take()
+                arguments.append(self.argument())
+            self.take('punct', ')')
+            if len(arguments) != FUNCTIONS[word]:
+                raise ValueError('{}() takes {} argument(s)'.format(
+                    word, FUNCTIONS[word]))
+            return ('call', word, tuple(arguments))
+        if word in dict(FILTERS):
+            return ('filter', word)
+        return ('search', word)
+
+    def argument(self):
+        kind, value = self.peek()
+        if kind == 'number':
+            return _number(self.take())
+        return self.take('word')
+
+
+def parse(text):
+    '''
+    Parses a query into a tree of tuples (see normalize).
+    '''
+    return _Parser(text).parse()
+
+
+def _operands(node, kind):
+    '''
+    Operands of nested operations of the same kind, like (a AND b) AND c.
+    '''
+    operands = []
+    for operand in node[1]:
+        if operand[0] == kind:
+            operands.extend(_operands(operand, kind))
+        else:
+            operands.append(operand)
+    return operands
+
+
+def normalize(node):
+    '''
+    Canonical text of a parsed query: operands of AND and OR are
+    sorted and deduplicated, so equivalent queries share cache entries.
+    '''
+    kind = node[0]
+    if kind in ('and', 'or'):
+        operands = set(
+            normalize(operand) for operand in _operands(node, kind))
+        if len(operands) == 1:
+            return operands.pop()
+        return '({})'.format(
+            ' {} '.format(kind.upper()).join(sorted(operands)))
+    if kind == 'not':
+        return 'NOT {}'.format(normalize(node[1]))
+    if kind == 'stat':
+        return '{} {} {}'.format(*node[1:])
+    if kind == 'master':
+        return 'm{} {} {}'.format(*node[1:])
+    if kind == 'missing':
+        return 'm{} is {}None'.format(node[1], '' if node[2] else 'not ')
+    if kind == 'call':
+        return '{}({})'.format(node[1], ', '.join(
+            str(argument) for argument in node[2]))
+    return node[1]
+
+
+def _required_filters(node):
+    '''
+    Keys of the filters a query needs ('single' for the statistics).
+    '''
+    kind = node[0]
+    if kind in ('and', 'or'):
+        return set().union(*[
+            _required_filters(operand) for operand in node[1]])
+    if kind == 'not':
+        return _required_filters(node[1])
+    if kind == 'filter':
+        return set([node[1]])
+    if kind in ('stat', 'call'):
+        return set(['single'])
+    return set()
+
+
+class QueryEngine(object):
+    '''
+    Evaluates queries over the pairs of a FilterEngine, like
+
+        gamut > 40 AND exception AND NOT single
+        m3 is None AND left:T
+        top(spread, 50) OR outlier(3)
+
+    Queries combine conditions on statistics (CONDITION_STATS, or the
+    keys of RANKING_METRICS), conditions on the value of a master (m0
+    is the first master; missing values match nothing but 'is None'),
+    the filters by key, the parameterized filters outlier(factor),
+    small_average(value), top(metric, amount), missing_only(master),
+    pattern(x-x) (kerned in the masters marked x, see
+    presencePatterns.pattern_string) and like(left, right), and the
+    search terms of a PairSearchIndex (*search_index*) with AND, OR,
+    NOT and parentheses. AND may be left out.
+
+    like(left, right) matches a pair and the SIMILAR_AMOUNT pairs with
+    the most similar kerning profiles, from a ProfileIndex (built on
+    first use if no *profile_index* is given), which follows the edits
+    of the engine through its row_listeners.
+
+    Every node of a query is compiled into a boolean mask over the
+    pairs. Masks are cached by the normalized query, packed into bits,
+    for as long as the engine's values are unchanged; the least
+    recently used beyond *cache_size* are dropped.
+    '''
+
+    def __init__(
+        self, engine, search_index=None, profile_index=None, cache_size=128
+    ):
+        self.engine = engine
+        self.search_index = search_index
+        self._profile_index = None
+        if profile_index is not None:
+            self._set_profile_index(profile_index)
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._cache = collections.OrderedDict()
+        self._version = None
+
+    @property
+    def profile_index(self):
+        if self._profile_index is None:
+            with self.engine.lock:
+                self._set_profile_index(
+                    ProfileIndex(self.engine.kern_matrix))
+        return self._profile_index
+
+    def _set_profile_index(self, profile_index):
+        self._profile_index = profile_index
+        self.engine.row_listeners.append(profile_index.update)
+
+    def mask(self, query):
+        '''
+        Boolean mask of the pairs matching a query (text or tree).
+        '''
+        node = query if isinstance(query, tuple) else parse(query)
+        # computed before taking the lock, which the computation takes
+        for key in _required_filters(node):
+            self.engine.compute_filter(key)
+        with self.engine.lock:
+            if self._version != self.engine.version:
+                self._cache.clear()
+                self._version = self.engine.version
+            return self._evaluate(node)
+
+    def select(self, query, within=None):
+        '''
+        Indices of the pairs matching a query. With *within* (an index
+        array, like a filter's membership), its matching pairs are
+        returned, in its order.
+        '''
+        mask = self.mask(query)
+        if within is None:
+            return numpy.flatnonzero(mask)
+        within = numpy.asarray(within, dtype=numpy.intp)
+        return within[mask[within]]
+
+    def _evaluate(self, node):
+        key = normalize(node)
+        bits = self._cache.get(key)
+        if bits is not None:
+            self._cache[key] = self._cache.pop(key)
+            self.hits += 1
+            return numpy.unpackbits(bits)[
+                :len(self.engine.kern_matrix)].astype(bool)
+        self.misses += 1
+        mask = self._compile(node)
+        self._cache[key] = numpy.packbits(mask)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return mask
+
+    def _compile(self, node):
+        kind = node[0]
+        engine = self.engine
+        if kind in ('and', 'or'):
+            combine = numpy.logical_and if kind == 'and' else (
+                numpy.logical_or)
+            mask = self._evaluate(node[1][0])
+            for operand in node[1][1:]:
+                mask = combine(mask, self._evaluate(operand))
+            return mask
+        if kind == 'not':
+            return ~self._evaluate(node[1])
+        if kind == 'filter':
+            return self._membership_mask(engine.membership(node[1]))
+        if kind == 'search':
+            if self.search_index is None:
+                raise ValueError('unknown filter: {!r}'.format(node[1]))
+            return self.search_index.term_mask(node[1])
+        if kind in ('master', 'missing'):
+            kern_matrix = engine.kern_matrix
+            if node[1] >= kern_matrix.master_count:
+                raise ValueError('there is no master m{} (of {})'.format(
+                    node[1], kern_matrix.master_count))
+            present = kern_matrix.present[:, node[1]]
+            if kind == 'missing':
+                return ~present if node[2] else present.copy()
+            values = kern_matrix.values[:, node[1]]
+            return present & OPERATORS[node[2]](values, node[3])
+        stats = engine.stats
+        if kind == 'stat':
+            return OPERATORS[node[2]](getattr(stats, node[1]), node[3])
+        name, arguments = node[1], node[2]
+        if name in ('missing_only', 'pattern'):
+            return self._presence_mask(name, arguments[0])
+        if name == 'like':
+            pair = tuple(str(argument) for argument in arguments)
+            pair_index = engine.kern_matrix.index.get(pair)
+            if pair_index is None:
+                raise ValueError('unknown pair: {} {}'.format(*pair))
+            similar, _ = self.profile_index.similar(
+                pair_index, SIMILAR_AMOUNT)
+            return self._membership_mask(
+                numpy.append(similar, pair_index))
+        if name == 'outlier':
+            abs_values = numpy.abs(
+                engine.kern_matrix.values.astype(numpy.int64))
+            return outlier_mask(abs_values, float(arguments[0]))
+        if name == 'small_average':
+            return stats.abs_mean < float(arguments[0])
+        metric, amount = arguments
+        if metric not in RANKING_METRICS:
+            raise ValueError('unknown metric: {!r}'.format(metric))
+        return self._membership_mask(engine.ranking(metric, int(amount)))
+
+    def _presence_mask(self, name, argument):
+        present = self.engine.kern_matrix.present
+        master_count = present.shape[1]
+        if name == 'pattern':
+            pattern = str(argument)
+            if len(pattern) != master_count or pattern.strip(
+                KERNED + MISSING
+            ):
+                raise ValueError(
+                    'pattern needs {!r} (kerned) or {!r} (missing) for '
+                    'each of {} masters: {!r}'.format(
+                        KERNED, MISSING, master_count, pattern))
+            kerned = numpy.array([char == KERNED for char in pattern])
+            return (present == kerned).all(axis=1)
+        master = MASTER_RE.match(str(argument))
+        master = int(master.group(1) if master else argument)
+        if not 0 <= master < master_count:
+            raise ValueError('there is no master m{} (of {})'.format(
+                master, master_count))
+        stats = self.engine.stats
+        return (stats.kerned_masters == master_count - 1) & (
+            ~present[:, master])
+
+    def _membership_mask(self, pair_indices):
+        mask = numpy.zeros(len(self.engine.kern_matrix), dtype=bool)
+        mask[pair_indices] = True
+        return mask
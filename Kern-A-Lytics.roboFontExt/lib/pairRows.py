@@ -0,0 +1,140 @@
+import itertools
+
+import numpy
+
+from exceptionIndex import GROUP_FLAG
+
+
+class PairRows(object):
+    '''
+    Rows of the pair list, backed by an index array into a KernMatrix.
+    Cells are only produced for the rows a table asks for, so showing
+    another filter costs nothing but replacing the index array.
+
+    Rows behave like a sequence of pairs. Besides L and R, cells can
+    show the pair's values ('values') or a statistic of PairStats
+    (by attribute name), taken from *stats*, a callable returning the
+    current PairStats (or None while they are being computed).
+
+    Group pairs can be expanded into rows of their member glyph pairs
+    (from *groups*), which are built on demand. Member rows stand for
+    the group pair they belong to.
+    '''
+
+    def __init__(self, kern_matrix, pair_indices=None, groups=None,
+            stats=None):
+        self.kern_matrix = kern_matrix
+        self.groups = groups or {}
+        self.stats = stats
+        self.set_indices(pair_indices)
+
+    def set_indices(self, pair_indices=None):
+        '''
+        Shows other pairs (all pairs if None); collapses all rows.
+        '''
+        if pair_indices is None:
+            pair_indices = numpy.arange(len(self.kern_matrix))
+        self.pair_indices = pair_indices
+        # base row -> member glyph pairs, for expanded rows
+        self._expanded = {}
+        self._expanded_rows = []
+
+    def __len__(self):
+        return len(self.pair_indices) + sum(
+            len(members) for members in self._expanded.values())
+
+    def __getitem__(self, row):
+        return self.kern_matrix.pairs[self.pair_index(row)]
+
+    def locate(self, row):
+        '''
+        (base row, member index) of a row; the member index is
+        None for rows which are not a member of an expanded pair.
+        '''
+        if row < 0:
+            row += len(self)
+        offset = 0
+        for base_row in self._expanded_rows:
+            start = base_row + offset
+            if row <= start:
+                break
+            member_count = len(self._expanded[base_row])
+            if row <= start + member_count:
+                return base_row, row - start - 1
+            offset += member_count
+        base_row = row - offset
+        if not 0 <= base_row < len(self.pair_indices):
+            raise IndexError(row)
+        return base_row, None
+
+    def pair_index(self, row):
+        '''
+        Index of the row's pair in the KernMatrix.
+        '''
+        base_row, _ = self.locate(row)
+        return int(self.pair_indices[base_row])
+
+    def glyph_pair(self, row):
+        '''
+        The member glyph pair of a row, the pair itself otherwise.
+        '''
+        base_row, member = self.locate(row)
+        if member is None:
+            return self.kern_matrix.pairs[int(self.pair_indices[base_row])]
+        return self._expanded[base_row][member]
+
+    def cell(self, row, key):
+        if key in ('L', 'R'):
+            return self.glyph_pair(row)[key == 'R']
+        pair_index = self.pair_index(row)
+        if key == 'values':
+            return ' '.join(
+                '-' if value is None else str(value) for
+                value in self.kern_matrix.row(pair_index))
+        stats = self.stats() if self.stats is not None else None
+        if stats is None:
+            return ''
+        value = getattr(stats, key)[pair_index]
+        return '{:g}'.format(value)
+
+    def members(self, pair):
+        '''
+        Glyph pairs a pair stands for (the pair itself for glyph pairs).
+        '''
+        sides = [
+            self.groups.get(item) or [item] if GROUP_FLAG in item else
+            [item] for item in pair]
+        return list(itertools.product(*sides))
+
+    def is_expandable(self, row):
+        base_row, member = self.locate(row)
+        pair = self.kern_matrix.pairs[int(self.pair_indices[base_row])]
+        return member is None and any(GROUP_FLAG in item for item in pair)
+
+    def is_expanded(self, row):
+        base_row, member = self.locate(row)
+        return member is None and base_row in self._expanded
+
+    def toggle(self, row):
+        '''
+        Expands a group pair into its member rows, or collapses it.
+        Returns the base row of the row toggled.
+        '''
+        base_row, member = self.locate(row)
+        if base_row in self._expanded:
+            del self._expanded[base_row]
+            self._expanded_rows.remove(base_row)
+        elif member is None and self.is_expandable(row):
+            pair_index = int(self.pair_indices[base_row])
+            self._expanded[base_row] = self.members(
+                self.kern_matrix.pairs[pair_index])
+            self._expanded_rows = sorted(self._expanded)
+        return base_row
+
+    def row_of_base(self, base_row):
+        '''
+        Display row of a base row, given the rows expanded above it.
+        '''
+        return base_row + sum(
+            len(self._expanded[expanded_row]) for
+            expanded_row in self._expanded_rows if expanded_row < base_row)
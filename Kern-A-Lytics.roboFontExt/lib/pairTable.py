@@ -0,0 +1,110 @@
+import AppKit
+import vanilla
+from lib.tools.debugTools import ClassNameIncrementer
+
+
+def _index_set(indexes):
+    index_set = AppKit.NSMutableIndexSet.indexSet()
+    for index in indexes:
+        index_set.addIndex_(index)
+    return index_set
+
+
+class PairTableDataSource(AppKit.NSObject, metaclass=ClassNameIncrementer):
+    '''
+    Feeds an NSTableView from a PairRows object, one cell at a time.
+    '''
+
+    def init(self):
+        self = super(PairTableDataSource, self).init()
+        self.rows = []
+        self.selection_callback = None
+        self.sender = None
+        return self
+
+    def numberOfRowsInTableView_(self, table_view):
+        return len(self.rows)
+
+    def tableView_objectValueForTableColumn_row_(
+            self, table_view, column, row):
+        return self.rows.cell(row, column.identifier())
+
+    def tableViewSelectionDidChange_(self, notification):
+        if self.selection_callback is not None:
+            self.selection_callback(self.sender)
+
+    def doubleClick_(self, table_view):
+        # expands or collapses group pairs
+        row = table_view.clickedRow()
+        if row < 0 or not hasattr(self.rows, 'toggle'):
+            return
+        base_row = self.rows.toggle(row)
+        table_view.reloadData()
+        table_view.selectRowIndexes_byExtendingSelection_(
+            _index_set([self.rows.row_of_base(base_row)]), False)
+
+
+class PairTable(vanilla.ScrollView):
+    '''
+    A list of pairs showing a PairRows object, with the parts of the
+    vanilla.List API the window uses. Unlike vanilla.List, no object
+    is created per row: the table asks for the cells it shows.
+    Double-clicking a group pair shows its member glyph pairs.
+    '''
+
+    def __init__(self, posSize, rows, columnDescriptions,
+            allowsMultipleSelection=False, selectionCallback=None):
+        table_view = AppKit.NSTableView.alloc().initWithFrame_(
+            ((0, 0), (100, 100)))
+        for description in columnDescriptions:
+            column = AppKit.NSTableColumn.alloc().initWithIdentifier_(
+                description.get('key', description['title']))
+            column.headerCell().setTitle_(description['title'])
+            column.setEditable_(False)
+            table_view.addTableColumn_(column)
+        table_view.setAllowsMultipleSelection_(allowsMultipleSelection)
+        table_view.setUsesAlternatingRowBackgroundColors_(True)
+        table_view.setColumnAutoresizingStyle_(
+            AppKit.NSTableViewUniformColumnAutoresizingStyle)
+
+        self._data_source = PairTableDataSource.alloc().init()
+        self._data_source.rows = rows
+        self._data_source.selection_callback = selectionCallback
+        self._data_source.sender = self
+        table_view.setDataSource_(self._data_source)
+        table_view.setDelegate_(self._data_source)
+        table_view.setTarget_(self._data_source)
+        table_view.setDoubleAction_('doubleClick:')
+        self._table_view = table_view
+
+        super(PairTable, self).__init__(
+            posSize, table_view, hasHorizontalScroller=False,
+            autohidesScrollers=True)
+
+    def getNSTableView(self):
+        return self._table_view
+
+    def __len__(self):
+        return len(self._data_source.rows)
+
+    def set(self, rows):
+        self._data_source.rows = rows
+        self._table_view.reloadData()
+
+    def get(self):
+        return self._data_source.rows
+
+    def getSelection(self):
+        index_set = self._table_view.selectedRowIndexes()
+        selection = []
+        index = index_set.firstIndex()
+        while index != AppKit.NSNotFound:
+            selection.append(index)
+            index = index_set.indexGreaterThanIndex_(index)
+        return selection
+
+    def setSelection(self, selection):
+        self._table_view.selectRowIndexes_byExtendingSelection_(
+            _index_set(selection), False)
+        if selection:
+            self._table_view.scrollRowToVisible_(selection[0])
@@ -2,10 +2,30 @@ import AppKit
 import vanilla
 from pprint import pprint
 from kerningHelper import get_repr_pair
+from outlineCache import OutlineCache
 import mojo.drawingTools as drawBot
 from lib.tools.debugTools import ClassNameIncrementer
 
 
+def bezier_path(outline):
+    '''
+    NSBezierPath of a cached OutlinePath, built once per outline.
+    '''
+    if outline.native is None:
+        path = AppKit.NSBezierPath.bezierPath()
+        for points, closed in outline.contours():
+            points = points.tolist()
+            if not points:
+                continue
+            path.moveToPoint_(points[0])
+            for point in points[1:]:
+                path.lineToPoint_(point)
+            if closed:
+                path.closePath()
+        outline.native = path
+    return outline.native
+
+
 class PairView(AppKit.NSView, metaclass=ClassNameIncrementer):
 
     def init(self):
@@ -72,7 +92,7 @@ class PairView(AppKit.NSView, metaclass=ClassNameIncrementer):
         drawBot.translate(-glyph_l.width - self._kern_value / 2, 0)
 
         for glyph in glyph_pair:
-            path = glyph.getRepresentation('defconAppKit.NSBezierPath')
+            path = self.delegate.glyph_path(glyph)
 
             drawBot.stroke(None)
             # drawBot.fill(0, 1, 0)
@@ -87,10 +107,19 @@ class PairView(AppKit.NSView, metaclass=ClassNameIncrementer):
 class DrawPair(vanilla.Group):
 
     nsViewClass = PairView
-    def __init__(self, posSize):
+    def __init__(self, posSize, outline_cache=None, master_index=0):
         self._setupView(self.nsViewClass, posSize)
         self.getNSView().delegate = self
         self.checked = False
+        # shared by the previews of all masters
+        if outline_cache is None:
+            outline_cache = OutlineCache()
+        self.outline_cache = outline_cache
+        self.master_index = master_index
+
+    def glyph_path(self, glyph):
+        return bezier_path(
+            self.outline_cache.outline(self.master_index, glyph))
     
     def setGlyphData_kerning(self, glyph, kerning):
         self.getNSView().setGlyphData_kerning_(glyph, kerning)
@@ -0,0 +1,225 @@
+'''
+Headless access to the kerning of UFOs.
+
+Only kerning.plist, groups.plist and lib.plist are read when a font is
+loaded; fontinfo.plist is read on first access to *info*, and glyphs
+(via fontTools.ufoLib) only once they are looked up by name.
+The fonts can be passed to kerningHelper.get_kern_matrix and the
+other helpers in place of fonts opened in RoboFont.
+'''
+
+import os
+import plistlib
+import xml.etree.ElementTree as ElementTree
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+def _read_plist(ufo_path, file_name):
+    plist_path = os.path.join(ufo_path, file_name)
+    if not os.path.exists(plist_path):
+        return {}
+    with open(plist_path, 'rb') as plist_file:
+        return plistlib.load(plist_file)
+
+
+def _flatten_kerning(nested_kerning):
+    '''
+    kerning.plist stores kerning as {left: {right: value}}
+    '''
+    return {
+        (left, right): value for
+        left, right_dict in nested_kerning.items() for
+        right, value in right_dict.items()}
+
+
+def _nest_kerning(kerning):
+    nested_kerning = {}
+    for (left, right), value in kerning.items():
+        nested_kerning.setdefault(left, {})[right] = value
+    return nested_kerning
+
+
+class UFOInfo(object):
+
+    def __init__(self, info_dict):
+        self._info_dict = info_dict
+
+    def __getattr__(self, attribute):
+        if attribute.startswith('_'):
+            raise AttributeError(attribute)
+        return self._info_dict.get(attribute)
+
+
+def read_info(ufo_path):
+    '''
+    The fontinfo of a UFO, without loading the font.
+    '''
+    return UFOInfo(_read_plist(ufo_path, 'fontinfo.plist'))
+
+
+class UFOGlyph(object):
+    '''
+    A glyph read from a .glif file, with its outline recorded
+    so it can be drawn into any segment pen.
+    '''
+
+    def __init__(self, font, name):
+        from fontTools.pens.pointPen import PointToSegmentPen
+        from fontTools.pens.recordingPen import RecordingPen
+
+        self._font = font
+        self.name = name
+        self.width = 0
+        self.unicodes = []
+        self._recording = RecordingPen()
+        font.glyph_set.readGlyph(
+            name, self, PointToSegmentPen(self._recording))
+
+    def getParent(self):
+        return self._font
+
+    def draw(self, pen):
+        self._recording.replay(pen)
+
+
+class UFOKerningFont(object):
+    '''
+    Kerning, groups and glyph order of a UFO, read without parsing
+    any glyphs. Glyphs are loaded on first access.
+    '''
+
+    def __init__(self, path, kerning, groups, lib):
+        self.path = path
+        # set for fonts loaded from a designspace
+        self.source_name = None
+        self.location = None
+        self.kerning = kerning
+        self.groups = groups
+        self.lib = lib
+        self._info = None
+        self._glyph_set = None
+        self._glyphs = {}
+
+    @classmethod
+    def read(cls, path):
+        return cls(
+            path,
+            _flatten_kerning(_read_plist(path, 'kerning.plist')),
+            _read_plist(path, 'groups.plist'),
+            _read_plist(path, 'lib.plist'))
+
+    def __getstate__(self):
+        # glyph sets and loaded glyphs stay in the loading process
+        state = dict(self.__dict__)
+        state.update(_glyph_set=None, _glyphs={})
+        return state
+
+    def save_kerning(self):
+        '''
+        Writes the (edited) kerning back to the UFO's kerning.plist.
+        '''
+        plist_path = os.path.join(self.path, 'kerning.plist')
+        with open(plist_path, 'wb') as plist_file:
+            plistlib.dump(
+                _nest_kerning(self.kerning), plist_file, sort_keys=True)
+
+    @property
+    def info(self):
+        if self._info is None:
+            self._info = read_info(self.path)
+        return self._info
+
+    @property
+    def glyph_set(self):
+        if self._glyph_set is None:
+            from fontTools.ufoLib.glifLib import GlyphSet
+            self._glyph_set = GlyphSet(os.path.join(self.path, 'glyphs'))
+        return self._glyph_set
+
+    @property
+    def glyphOrder(self):
+        glyph_order = self.lib.get('public.glyphOrder')
+        if glyph_order is None:
+            contents = _read_plist(
+                os.path.join(self.path, 'glyphs'), 'contents.plist')
+            glyph_order = sorted(contents)
+        return glyph_order
+
+    def getCharacterMapping(self):
+        '''
+        Unicode -> glyph names, like fontParts. Only the unicodes
+        of the glyph files are read.
+        '''
+        cmap = {}
+        for glyph_name, unicodes in self.glyph_set.getUnicodes().items():
+            for code_point in unicodes:
+                cmap.setdefault(code_point, []).append(glyph_name)
+        return cmap
+
+    def keys(self):
+        return self.glyph_set.keys()
+
+    def __contains__(self, glyph_name):
+        return glyph_name in self.glyph_set
+
+    def __getitem__(self, glyph_name):
+        if glyph_name not in self._glyphs:
+            if glyph_name not in self.glyph_set:
+                raise KeyError(glyph_name)
+            self._glyphs[glyph_name] = UFOGlyph(self, glyph_name)
+        return self._glyphs[glyph_name]
+
+    def __repr__(self):
+        return '<UFOKerningFont {}>'.format(self.path)
+
+
+def load_fonts(paths, sort_by=None, max_workers=None, use_processes=False):
+    '''
+    Reads a number of UFOs in parallel, using a thread pool (or a
+    process pool, which avoids the GIL for large kerning plists).
+    Fonts are returned in the order of *paths*, or sorted by the
+    fontinfo attribute *sort_by* (like AllFonts('styleName')).
+    '''
+    executor_class = ProcessPoolExecutor if use_processes else (
+        ThreadPoolExecutor)
+    with executor_class(max_workers=max_workers) as executor:
+        fonts = list(executor.map(UFOKerningFont.read, paths))
+    if sort_by is not None:
+        fonts.sort(key=lambda font: getattr(font.info, sort_by) or '')
+    return fonts
+
+
+def read_designspace_sources(designspace_path):
+    '''
+    Returns (ufo path, source name, location) for every source of a
+    designspace file, in the order of the file. Locations map axis
+    names to design coordinates.
+    '''
+    base_dir = os.path.dirname(os.path.abspath(designspace_path))
+    tree = ElementTree.parse(designspace_path)
+    sources = []
+    for source in tree.getroot().iter('source'):
+        if source.get('layer'):
+            # sparse layer sources carry no kerning of their own
+            continue
+        location = {}
+        for dimension in source.iter('dimension'):
+            location[dimension.get('name')] = float(
+                dimension.get('xvalue', 0))
+        sources.append((
+            os.path.normpath(os.path.join(base_dir, source.get('filename'))),
+            source.get('stylename') or source.get('name'),
+            location))
+    return sources
+
+
+def load_designspace(designspace_path, **kwargs):
+    '''
+    Loads the sources of a designspace file (see load_fonts).
+    '''
+    sources = read_designspace_sources(designspace_path)
+    fonts = load_fonts([path for path, _, _ in sources], **kwargs)
+    by_path = {path: (name, location) for path, name, location in sources}
+    for font in fonts:
+        font.source_name, font.location = by_path[font.path]
+    return fonts
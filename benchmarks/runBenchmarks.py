@@ -0,0 +1,445 @@
+'''
+Times and memory-profiles the kerningHelper functions and the steps
+FlexibleWindow takes to set up its model, on synthetic families.
+
+    python benchmarks/runBenchmarks.py -s small -s medium -o results.json
+    python benchmarks/runBenchmarks.py --check benchmarks/thresholds.json
+    python benchmarks/runBenchmarks.py -s large --glyphs 3000 --masters 12
+
+Every benchmark is run --repeat times (each with a fresh setup), the
+fastest run is reported. Memory is the tracemalloc peak of one more run,
+allocations made during setup excluded. With --check, results exceeding
+the thresholds of their scenario are listed as regressions, and the
+exit status is 1.
+'''
+
+import argparse
+import inspect
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+LIB_DIR = os.path.join(
+    os.path.dirname(BENCH_DIR), 'Kern-A-Lytics.roboFontExt', 'lib')
+sys.path.insert(0, LIB_DIR)
+
+import batchEdit  # noqa: E402
+import kerningHelper  # noqa: E402
+import kernFilters  # noqa: E402
+import pairQuery  # noqa: E402
+import pairRows  # noqa: E402
+import reprCache  # noqa: E402
+from syntheticFamily import SyntheticFont, make_family  # noqa: E402
+
+SCENARIOS = {
+    'small': dict(
+        masters=2, glyphs=400, kern1_groups=40, kern2_groups=40),
+    'medium': dict(
+        masters=4, glyphs=1000, kern1_groups=100, kern2_groups=100),
+    'large': dict(
+        masters=8, glyphs=2500, kern1_groups=250, kern2_groups=250),
+}
+FAMILY_OPTIONS = [
+    ('masters', int), ('glyphs', int), ('kern1_groups', int),
+    ('kern2_groups', int), ('grouped_ratio', float),
+    ('group_pair_density', float), ('glyph_pair_density', float),
+    ('exception_density', float), ('sparsity', float), ('seed', int),
+]
+# FlexibleWindow's settings
+OUTLIER_FACTOR = 5
+SMALL_AVERAGE_VALUE = 5
+EDIT_COUNT = 100
+# rows visible in the pair list
+VISIBLE_ROWS = 40
+SEARCHES = [
+    'glyph00010', 'glyph001*', 'left:script=cyrillic',
+    'left:script=greek right:case=upper glyph00030']
+QUERIES = [
+    'gamut > 40 AND exception AND NOT single', 'm1 is None',
+    '(outlier OR zero_value) AND max >= 10', 'top(spread, 50) OR outlier(3)',
+    'small_average(10) AND NOT m0 is None AND left:script=latin']
+
+
+class Context(object):
+    '''
+    Data shared by the benchmarks of a scenario. Nothing in here
+    is modified by a benchmark.
+    '''
+
+    def __init__(self, fonts):
+        self.fonts = fonts
+        self.cmb_kerning = kerningHelper.get_combined_kern_dict(fonts)
+        self.kern_matrix = kerningHelper.get_kern_matrix(fonts)
+        self.pairs = list(self.cmb_kerning.keys())
+        self.value_lists = list(self.cmb_kerning.values())
+
+
+def _new_engine(ctx, kern_matrix=None):
+    return kernFilters.FilterEngine(
+        kern_matrix or ctx.kern_matrix, ctx.fonts,
+        outlier_factor=OUTLIER_FACTOR,
+        small_average_value=SMALL_AVERAGE_VALUE)
+
+
+def _computed_engine(ctx, kern_matrix=None):
+    engine = _new_engine(ctx, kern_matrix)
+    engine.compute_filter('single')
+    engine.compute_filter('exception')
+    return engine
+
+
+def _repr_pairs(ctx):
+    cache = reprCache.ReprGlyphCache(ctx.fonts[0])
+    return [
+        kerningHelper.get_repr_pair(ctx.fonts[0], pair, cache) for
+        pair in ctx.pairs]
+
+
+def _edit_values(engine):
+    kern_matrix = engine.kern_matrix
+    step = max(len(kern_matrix) // EDIT_COUNT, 1)
+    for pair in kern_matrix.pairs[::step][:EDIT_COUNT]:
+        engine.set_value(pair, 0, 12)
+
+
+def _font_copies(ctx):
+    return [
+        SyntheticFont(
+            font.info.familyName, font.info.styleName, dict(font.kerning),
+            font.groups, font.glyphOrder)
+        for font in ctx.fonts]
+
+
+def _batch_editor(ctx):
+    engine = _computed_engine(ctx, ctx.kern_matrix.subset(
+        range(len(ctx.kern_matrix))))
+    return batchEdit.BatchEditor(engine, _font_copies(ctx))
+
+
+def _batch_edit(editor):
+    # +10 on the whole list, as with the Whole List checkbox
+    editor.apply('shift', editor.select('all'), amount=10)
+
+
+def _drag_state(ctx):
+    engine = _computed_engine(ctx, ctx.kern_matrix.subset(
+        range(len(ctx.kern_matrix))))
+    return engine, batchEdit.WriteBack(_font_copies(ctx))
+
+
+def _drag(engine, write_back):
+    # mouse events of a slider drag, written to the font on mouse up
+    pair = engine.kern_matrix.pairs[len(engine.kern_matrix) // 2]
+    for value in range(EDIT_COUNT):
+        engine.set_value(pair, 0, value)
+        write_back.set(0, pair, value)
+    write_back.flush()
+
+
+def _filtered_engine(ctx):
+    engine = _computed_engine(ctx)
+    engine.members()
+    return engine
+
+
+def _switch_filters(engine):
+    # every filter shown once, with the cells of its visible rows
+    rows = pairRows.PairRows(engine.kern_matrix)
+    for key in engine.keys:
+        rows.set_indices(engine.membership(key))
+        for row in range(min(len(rows), VISIBLE_ROWS)):
+            rows.cell(row, 'L')
+            rows.cell(row, 'R')
+
+
+def _search_state(ctx):
+    return (
+        _filtered_engine(ctx),
+        kerningHelper.get_search_index(ctx.fonts, ctx.kern_matrix))
+
+
+def _search(engine, index):
+    # searches typed into the search box, within every filter
+    for key in engine.keys:
+        for text in SEARCHES:
+            index.search(text, engine.membership(key))
+
+
+def _similar(index):
+    # stepping through the list, every pair edited before it is shown
+    for pair_index in range(0, len(index), max(len(index) // 200, 1)):
+        index.update([pair_index])
+        index.similar(pair_index)
+
+
+def _query_engine(ctx):
+    return pairQuery.QueryEngine(
+        _filtered_engine(ctx),
+        kerningHelper.get_search_index(ctx.fonts, ctx.kern_matrix))
+
+
+def _query(queries):
+    # ad-hoc queries, then the same ones again from the cache
+    for _ in range(2):
+        for text in QUERIES:
+            queries.select(text)
+
+
+# name: (setup(ctx) -> state, run(ctx, state))
+HELPER_BENCHMARKS = {
+    'numeric_value_list': (None, lambda ctx, _: [
+        kerningHelper.numeric_value_list(v) for v in ctx.value_lists]),
+    'random_value_list': (None, lambda ctx, _: [
+        kerningHelper.random_value_list(len(ctx.fonts)) for
+        _ in ctx.value_lists]),
+    'get_repr_pair': (None, lambda ctx, _: _repr_pairs(ctx)),
+    'get_combined_kern_dict': (None, lambda ctx, _: (
+        kerningHelper.get_combined_kern_dict(ctx.fonts))),
+    'get_kern_matrix': (None, lambda ctx, _: (
+        kerningHelper.get_kern_matrix(ctx.fonts))),
+    'get_flat_kerning': (None, lambda ctx, _: (
+        kerningHelper.get_flat_kerning(ctx.fonts))),
+    'get_search_index': (None, lambda ctx, _: (
+        kerningHelper.get_search_index(ctx.fonts, ctx.kern_matrix))),
+    'get_profile_index': (None, lambda ctx, _: (
+        kerningHelper.get_profile_index(ctx.kern_matrix))),
+    'get_group_index': (None, lambda ctx, _: (
+        kerningHelper.get_group_index(ctx.fonts))),
+    'get_canonical_kern_matrix': (None, lambda ctx, _: (
+        kerningHelper.get_canonical_kern_matrix(ctx.fonts))),
+    'ranked_dict': (None, lambda ctx, _: [
+        kerningHelper.ranked_dict(ctx.kern_matrix, metric) for
+        metric in kernFilters.RANKING_METRICS]),
+    'same_value_dict': (None, lambda ctx, _: (
+        kerningHelper.same_value_dict(ctx.cmb_kerning))),
+    'zero_value_dict': (None, lambda ctx, _: (
+        kerningHelper.zero_value_dict(ctx.cmb_kerning))),
+    'outlier_dict': (None, lambda ctx, _: (
+        kerningHelper.outlier_dict(ctx.cmb_kerning, OUTLIER_FACTOR))),
+    'robust_outlier_dict': (None, lambda ctx, _: (
+        kerningHelper.robust_outlier_dict(ctx.kern_matrix))),
+    'interpolation_dict': (None, lambda ctx, _: (
+        kerningHelper.interpolation_dict(ctx.kern_matrix))),
+    'partial_dict': (None, lambda ctx, _: (
+        kerningHelper.partial_dict(ctx.kern_matrix))),
+    'drift_residual_dict': (None, lambda ctx, _: (
+        kerningHelper.drift_residual_dict(ctx.kern_matrix))),
+    'similar_dict': (None, lambda ctx, _: (
+        kerningHelper.similar_dict(
+            ctx.kern_matrix, ctx.kern_matrix.pairs[0]))),
+    'high_gamut_dict': (None, lambda ctx, _: (
+        kerningHelper.high_gamut_dict(ctx.cmb_kerning))),
+    'largest_value_dict': (None, lambda ctx, _: (
+        kerningHelper.largest_value_dict(ctx.cmb_kerning))),
+    'single_exception_list': (None, lambda ctx, _: (
+        kerningHelper.single_exception_list(ctx.fonts[0]))),
+    'exception_dict': (None, lambda ctx, _: (
+        kerningHelper.exception_dict(ctx.fonts, ctx.cmb_kerning))),
+    'small_average_dict': (None, lambda ctx, _: (
+        kerningHelper.small_average_dict(
+            ctx.cmb_kerning, SMALL_AVERAGE_VALUE))),
+    'single_pair_dict': (None, lambda ctx, _: (
+        kerningHelper.single_pair_dict(ctx.cmb_kerning))),
+}
+
+# the steps of FlexibleWindow.__init__ and its FilterWorker
+WINDOW_BENCHMARKS = {
+    'kern_matrix': (None, lambda ctx, _: (
+        kerningHelper.get_kern_matrix(ctx.fonts))),
+    'pair_list': (None, lambda ctx, _: pairRows.PairRows(ctx.kern_matrix)),
+    'repr_caches': (None, lambda ctx, _: [
+        reprCache.ReprGlyphCache(font).rank for font in ctx.fonts]),
+    'filter_labels': (None, lambda ctx, _: [
+        _new_engine(ctx).label(key) for key, _ in kernFilters.FILTERS]),
+    'filter_stats': (
+        _new_engine, lambda ctx, engine: engine.compute_filter('single')),
+    'filter_exceptions': (
+        _new_engine, lambda ctx, engine: engine.compute_filter('exception')),
+    'filter_memberships': (
+        _computed_engine, lambda ctx, engine: engine.members()),
+    'filter_worker': (_new_engine, lambda ctx, engine: (
+        kernFilters.FilterWorker(engine, lambda key: None).run())),
+    'rankings': (_computed_engine, lambda ctx, engine: [
+        engine.ranking(metric, amount) for
+        metric in kernFilters.RANKING_METRICS for amount in (10, 100, 1000)]),
+    'set_value': (
+        lambda ctx: _computed_engine(ctx, ctx.kern_matrix.subset(
+            range(len(ctx.kern_matrix)))),
+        lambda ctx, engine: _edit_values(engine)),
+    'batch_edit': (_batch_editor, lambda ctx, editor: _batch_edit(editor)),
+    'filter_switch': (
+        _filtered_engine, lambda ctx, engine: _switch_filters(engine)),
+    'drag': (_drag_state, lambda ctx, state: _drag(*state)),
+    'search': (_search_state, lambda ctx, state: _search(*state)),
+    'query': (_query_engine, lambda ctx, queries: _query(queries)),
+    'similar': (
+        lambda ctx: kerningHelper.get_profile_index(ctx.kern_matrix),
+        lambda ctx, index: _similar(index)),
+}
+
+
+def public_helpers():
+    return sorted(
+        name for name, obj in inspect.getmembers(
+            kerningHelper, inspect.isfunction) if
+        not name.startswith('_') and obj.__module__ == 'kerningHelper')
+
+
+def measure(ctx, setup, run, repeat):
+    times = []
+    for _ in range(repeat):
+        state = setup(ctx) if setup else None
+        start = time.perf_counter()
+        run(ctx, state)
+        times.append(time.perf_counter() - start)
+
+    state = setup(ctx) if setup else None
+    tracemalloc.start()
+    run(ctx, state)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'seconds': min(times),
+        'median_seconds': statistics.median(times),
+        'peak_kib': round(peak / 1024, 1),
+    }
+
+
+def run_scenario(family_options, repeat, only=None):
+    fonts = make_family(**family_options)
+    ctx = Context(fonts)
+    missing = set(public_helpers()) - set(HELPER_BENCHMARKS)
+    if missing:
+        raise KeyError(
+            'no benchmark for kerningHelper.{}'.format(
+                ', '.join(sorted(missing))))
+
+    benchmarks = [
+        ('helper.' + name, spec) for
+        name, spec in sorted(HELPER_BENCHMARKS.items())]
+    benchmarks += [
+        ('window.' + name, spec) for name, spec in WINDOW_BENCHMARKS.items()]
+    results = {}
+    for name, (setup, run) in benchmarks:
+        if only and not any(pattern in name for pattern in only):
+            continue
+        results[name] = measure(ctx, setup, run, repeat)
+    return {
+        'family': family_options,
+        'pair_count': len(ctx.kern_matrix),
+        'results': results,
+    }
+
+
+def check_thresholds(scenarios, thresholds):
+    '''
+    Returns the results exceeding their thresholds.
+    '''
+    regressions = []
+    for scenario_name, scenario in scenarios.items():
+        limits = thresholds.get(scenario_name, {})
+        for name, result in scenario['results'].items():
+            for metric, limit in limits.get(name, {}).items():
+                if result[metric] > limit:
+                    regressions.append({
+                        'scenario': scenario_name, 'benchmark': name,
+                        'metric': metric, 'value': result[metric],
+                        'threshold': limit})
+    return regressions
+
+
+def make_thresholds(scenarios, headroom, memory_headroom, min_seconds):
+    return {
+        scenario_name: {
+            name: {
+                'seconds': round(
+                    max(result['seconds'] * headroom, min_seconds), 4),
+                'peak_kib': round(
+                    result['peak_kib'] * memory_headroom, 1)}
+            for name, result in scenario['results'].items()}
+        for scenario_name, scenario in scenarios.items()}
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark kerningHelper and the Kern-A-Lytics model.')
+    parser.add_argument(
+        '-s', '--scenario', dest='scenarios', action='append',
+        choices=sorted(SCENARIOS),
+        help='family size(s) to benchmark (default: small and medium)')
+    for option, option_type in FAMILY_OPTIONS:
+        parser.add_argument(
+            '--' + option.replace('_', '-'), type=option_type,
+            help='overrides the scenario setting')
+    parser.add_argument(
+        '-r', '--repeat', type=int, default=3,
+        help='timed runs per benchmark (default: 3)')
+    parser.add_argument(
+        '-k', '--only', action='append', metavar='PATTERN',
+        help='only run benchmarks whose name contains PATTERN')
+    parser.add_argument(
+        '-o', '--output', help='write the JSON results to this file')
+    parser.add_argument(
+        '--check', metavar='THRESHOLDS',
+        help='compare the results to a thresholds file')
+    parser.add_argument(
+        '--write-thresholds', metavar='THRESHOLDS',
+        help='write the results (times headroom) as thresholds')
+    parser.add_argument(
+        '--headroom', type=float, default=3.0,
+        help='factor applied to times by --write-thresholds (default: 3)')
+    parser.add_argument(
+        '--memory-headroom', type=float, default=1.5,
+        help='factor applied to memory peaks by --write-thresholds '
+        '(default: 1.5)')
+    parser.add_argument(
+        '--min-seconds', type=float, default=0.01,
+        help='lowest time threshold written, as very short '
+        'benchmarks are noisy (default: 0.01)')
+    options = parser.parse_args(args)
+
+    overrides = {
+        option: getattr(options, option) for option, _ in FAMILY_OPTIONS if
+        getattr(options, option) is not None}
+    scenarios = {}
+    for scenario_name in options.scenarios or ['small', 'medium']:
+        family_options = dict(SCENARIOS[scenario_name], **overrides)
+        if overrides:
+            # custom families are not comparable to the thresholds
+            scenario_name += '-custom'
+        scenarios[scenario_name] = run_scenario(
+            family_options, options.repeat, options.only)
+
+    output = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'scenarios': scenarios,
+    }
+    if options.check:
+        with open(options.check) as thresholds_file:
+            output['regressions'] = check_thresholds(
+                scenarios, json.load(thresholds_file))
+    if options.write_thresholds:
+        with open(options.write_thresholds, 'w') as thresholds_file:
+            json.dump(
+                make_thresholds(
+                    scenarios, options.headroom, options.memory_headroom,
+                    options.min_seconds),
+                thresholds_file, indent=1, sort_keys=True)
+
+    if options.output:
+        with open(options.output, 'w') as output_file:
+            json.dump(output, output_file, indent=1)
+    else:
+        json.dump(output, sys.stdout, indent=1)
+        print()
+    return 1 if output.get('regressions') else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
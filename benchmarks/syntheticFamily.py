@@ -0,0 +1,150 @@
+'''
+Synthetic multi-master families for benchmarking.
+
+make_family builds fonts with the attributes the kerningHelper
+functions use (kerning, groups, lib, glyphOrder, info);
+write_ufos stores them as minimal UFOs for the headless loader.
+'''
+
+import os
+import plistlib
+import random
+
+# unicodes of the first glyphs: letters of a few scripts, and digits
+CODE_POINTS = (
+    list(range(0x41, 0x5b)) + list(range(0x61, 0x7b)) +
+    list(range(0x391, 0x3a2)) + list(range(0x3b1, 0x3c2)) +
+    list(range(0x410, 0x450)) + list(range(0x30, 0x3a)))
+
+
+class SyntheticInfo(object):
+
+    def __init__(self, familyName, styleName, unitsPerEm=1000):
+        self.familyName = familyName
+        self.styleName = styleName
+        self.unitsPerEm = unitsPerEm
+
+
+class SyntheticFont(object):
+
+    def __init__(self, family_name, style_name, kerning, groups, glyph_order):
+        self.info = SyntheticInfo(family_name, style_name)
+        self.kerning = kerning
+        self.groups = groups
+        self.glyphOrder = glyph_order
+        self.lib = {'public.glyphOrder': glyph_order}
+
+    def getCharacterMapping(self):
+        return {
+            code_point: [glyph_name] for code_point, glyph_name in
+            zip(CODE_POINTS, self.glyphOrder)}
+
+    def __repr__(self):
+        return '<SyntheticFont {}>'.format(self.info.styleName)
+
+
+def _make_groups(rnd, glyph_order, side, group_count, grouped_ratio):
+    glyphs = list(glyph_order)
+    rnd.shuffle(glyphs)
+    grouped = glyphs[:int(len(glyphs) * grouped_ratio)]
+    groups = {}
+    for i, glyph_name in enumerate(grouped):
+        group_name = 'public.kern{}.group{:03d}'.format(
+            side, i % max(group_count, 1))
+        groups.setdefault(group_name, []).append(glyph_name)
+    for members in groups.values():
+        members.sort(key=glyph_order.index)
+    return groups
+
+
+def make_family(
+    masters=4, glyphs=500, kern1_groups=60, kern2_groups=60,
+    grouped_ratio=0.7, group_pair_density=0.3, glyph_pair_density=0.002,
+    exception_density=0.05, sparsity=0.05, seed=0,
+    family_name='Synthetic'
+):
+    '''
+    Returns a list of SyntheticFonts sharing glyph order and groups.
+
+    *group_pair_density* is the share of all group-group combinations
+    which are kerned, *glyph_pair_density* the share of glyph-glyph
+    combinations of ungrouped glyphs. *exception_density* is the share
+    of kerned group pairs that get exceptions (glyph-group, group-glyph
+    and glyph-glyph). *sparsity* is the probability of a pair
+    being missing in any single master.
+    '''
+    rnd = random.Random(seed)
+    glyph_order = ['glyph{:05d}'.format(i) for i in range(glyphs)]
+    groups = _make_groups(rnd, glyph_order, 1, kern1_groups, grouped_ratio)
+    groups.update(
+        _make_groups(rnd, glyph_order, 2, kern2_groups, grouped_ratio))
+    left_groups = sorted(g for g in groups if g.startswith('public.kern1.'))
+    right_groups = sorted(g for g in groups if g.startswith('public.kern2.'))
+
+    base_kerning = {}
+    for left in left_groups:
+        for right in right_groups:
+            if rnd.random() >= group_pair_density:
+                continue
+            value = rnd.randint(-150, 60)
+            base_kerning[(left, right)] = value
+            if rnd.random() < exception_density:
+                l_glyph = rnd.choice(groups[left])
+                r_glyph = rnd.choice(groups[right])
+                base_kerning[(l_glyph, right)] = value + rnd.randint(-30, 30)
+                base_kerning[(left, r_glyph)] = value + rnd.randint(-30, 30)
+                base_kerning[(l_glyph, r_glyph)] = value + rnd.randint(
+                    -30, 30)
+
+    grouped_glyphs = set(g for members in groups.values() for g in members)
+    ungrouped = [g for g in glyph_order if g not in grouped_glyphs]
+    glyph_pair_count = int(len(ungrouped) ** 2 * glyph_pair_density)
+    for _ in range(glyph_pair_count):
+        pair = rnd.choice(ungrouped), rnd.choice(ungrouped)
+        base_kerning[pair] = rnd.randint(-100, 40)
+
+    fonts = []
+    for m_index in range(masters):
+        scale = 0.6 + 0.8 * m_index / max(masters - 1, 1)
+        kerning = {}
+        for pair, value in base_kerning.items():
+            if rnd.random() < sparsity:
+                continue
+            kerning[pair] = int(round(value * scale)) + rnd.randint(-3, 3)
+        fonts.append(SyntheticFont(
+            family_name, 'Master{:02d}'.format(m_index),
+            kerning, groups, glyph_order))
+    return fonts
+
+
+def _write_plist(path, data):
+    with open(path, 'wb') as plist_file:
+        plistlib.dump(data, plist_file)
+
+
+def write_ufos(fonts, directory):
+    '''
+    Writes the fonts as UFOs (without glyphs), returns their paths.
+    '''
+    paths = []
+    for font in fonts:
+        ufo_path = os.path.join(directory, '{}-{}.ufo'.format(
+            font.info.familyName, font.info.styleName))
+        os.makedirs(os.path.join(ufo_path, 'glyphs'))
+        nested_kerning = {}
+        for (left, right), value in font.kerning.items():
+            nested_kerning.setdefault(left, {})[right] = value
+        _write_plist(
+            os.path.join(ufo_path, 'metainfo.plist'),
+            {'creator': 'syntheticFamily', 'formatVersion': 3})
+        _write_plist(
+            os.path.join(ufo_path, 'fontinfo.plist'),
+            {'familyName': font.info.familyName,
+                'styleName': font.info.styleName,
+                'unitsPerEm': font.info.unitsPerEm})
+        _write_plist(os.path.join(ufo_path, 'kerning.plist'), nested_kerning)
+        _write_plist(os.path.join(ufo_path, 'groups.plist'), font.groups)
+        _write_plist(os.path.join(ufo_path, 'lib.plist'), font.lib)
+        _write_plist(os.path.join(ufo_path, 'glyphs', 'contents.plist'), {})
+        paths.append(ufo_path)
+    return paths